@@ -9,6 +9,10 @@ pg = st.navigation(
             (st.Page("overviews/agencies.py", title="Agencies", icon=":material/account_balance:")),
             (st.Page("overviews/titles.py", title="Titles", icon=":material/book:")),
             (st.Page("overviews/corrections.py", title="Corrections", icon=":material/edit:")),
+            (st.Page("overviews/search.py", title="Search", icon=":material/search:")),
+        ],
+        "Operations": [
+            (st.Page("overviews/runs.py", title="Runs", icon=":material/monitoring:")),
         ],
     }
 )
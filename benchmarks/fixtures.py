@@ -0,0 +1,235 @@
+"""
+Fixtures served by the local eCFR stand-in (see `benchmarks.stub`).
+
+A fixture directory mirrors the API responses used by `utils.ecfr`:
+
+    titles.json, agencies.json, corrections.json, versions/title-<N>.json, xml/title-<N>.xml
+
+`generate` writes a deterministic synthetic set with a small, a mid-size and a very large Title. `record` replaces the
+small and mid-size Titles (and the Agency list) with real responses from ecfr.gov, for benchmarks closer to
+production data.
+"""
+import json
+import logging
+import os
+import random
+
+FIXTURES_DIR = os.getenv("ECFR_BENCHMARK_FIXTURES", os.path.join(os.path.dirname(__file__), "fixtures"))
+ISSUE_DATE = "2025-01-02"
+# Bumped whenever generated fixtures change, so older synthetic fixture sets are regenerated.
+VERSION = 2
+
+# Parts per synthetic Title at scale 1 (each part is about 50 KB of XML).
+TITLE_SIZES = {"small": (1, 8), "mid": (2, 120), "huge": (3, 1200)}
+CHAPTERS_PER_TITLE = 4
+SECTIONS_PER_PART = 20
+
+_WORDS = (
+    "the of and to in a or any shall be for by this that with as under is on not may such other agency section "
+    "paragraph requirements administrator applicable provided information including accordance determined regulation "
+    "person required notwithstanding subsection appropriate environmental certification documentation "
+    "authorization implementation compliance emission facility standards performance operator reporting"
+).split()
+
+
+def _paragraph(rng):
+    sentences = []
+    for _ in range(rng.randint(1, 4)):
+        words = rng.choices(_WORDS, k=rng.randint(8, 30))
+        sentences.append(" ".join(words).capitalize() + ".")
+    return f"<P>{' '.join(sentences)}</P>"
+
+
+def _chapter(index):
+    return ["I", "II", "III", "IV", "V", "VI", "VII", "VIII"][index]
+
+
+def _part_number(chapter, part):
+    return chapter * 1000 + part + 1
+
+
+def write_title_xml(path, title, parts, rng):
+    """Writes a synthetic Title in the eCFR's source XML layout, one part at a time."""
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<ECFR>\n<DIV1 N="{title}" TYPE="TITLE">'
+                f'<HEAD>Title {title}—Synthetic Benchmark Regulations</HEAD>\n')
+        parts_per_chapter = max(1, parts // CHAPTERS_PER_TITLE)
+        for chapter in range(CHAPTERS_PER_TITLE):
+            f.write(f'<DIV3 N="{_chapter(chapter)}" TYPE="CHAPTER"><HEAD>Chapter {_chapter(chapter)}</HEAD>\n')
+            for subchapter in "AB":
+                f.write(f'<DIV4 N="{subchapter}" TYPE="SUBCHAP"><HEAD>Subchapter {subchapter}</HEAD>\n')
+                start = 0 if subchapter == "A" else parts_per_chapter // 2
+                end = parts_per_chapter // 2 if subchapter == "A" else parts_per_chapter
+                for part in range(start, end):
+                    number = _part_number(chapter, part)
+                    f.write(f'<DIV5 N="{number}" TYPE="PART"><HEAD>PART {number}—GENERAL PROVISIONS</HEAD>\n')
+                    for section in range(SECTIONS_PER_PART):
+                        f.write(f'<DIV8 N="{number}.{section + 1}" TYPE="SECTION">'
+                                f'<HEAD>§ {number}.{section + 1} Requirements.</HEAD>')
+                        f.write("".join(_paragraph(rng) for _ in range(rng.randint(2, 8))))
+                        f.write("</DIV8>\n")
+                    f.write(f'<DIV9 N="Appendix A to Part {number}" TYPE="APPENDIX">'
+                            f'<HEAD>Appendix A to Part {number}</HEAD>{_paragraph(rng)}</DIV9>\n')
+                    f.write("</DIV5>\n")
+                f.write("</DIV4>\n")
+            f.write("</DIV3>\n")
+        f.write("</DIV1>\n</ECFR>\n")
+
+
+def _references(title, parts):
+    parts_per_chapter = max(1, parts // CHAPTERS_PER_TITLE)
+    references = [{"title": title, "chapter": _chapter(0)}]
+    references.append({"title": title, "chapter": _chapter(1), "subchapter": "B"})
+    for chapter in range(2, CHAPTERS_PER_TITLE):
+        for part in range(0, parts_per_chapter, max(1, parts_per_chapter // 4)):
+            references.append({"title": title, "chapter": _chapter(chapter), "part": str(_part_number(chapter, part))})
+    return references
+
+
+def _correction_references(title, parts, rng):
+    """
+    The `cfr_references` of a synthetic Correction: one to three locations in the Title, mostly sections, some parts
+    and some sections that do not exist (e.g. since removed), with or without their chapter.
+    """
+    parts_per_chapter = max(1, parts // CHAPTERS_PER_TITLE)
+    references = []
+    for _ in range(rng.randint(1, 3)):
+        chapter, part = rng.randrange(CHAPTERS_PER_TITLE), rng.randrange(parts_per_chapter)
+        number = _part_number(chapter, part)
+        hierarchy = {"title": str(title), "chapter": _chapter(chapter), "part": str(number)}
+        kind = rng.random()
+        if kind < 0.7:
+            hierarchy["section"] = f"{number}.{rng.randint(1, SECTIONS_PER_PART)}"
+        elif kind < 0.8:
+            hierarchy["section"] = f"{number}.{SECTIONS_PER_PART + rng.randint(1, 10)}"
+        if rng.random() < 0.1:
+            del hierarchy["chapter"]
+        citation = f"{title} CFR {hierarchy.get('section', number)}"
+        references.append({"cfr_reference": citation, "hierarchy": hierarchy})
+    return references
+
+
+def _write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+
+
+def generate(directory=FIXTURES_DIR, scale=1.0, seed=0):
+    """Writes the synthetic fixture set. `scale` multiplies the number of parts of every Title."""
+    rng = random.Random(seed)
+    os.makedirs(os.path.join(directory, "xml"), exist_ok=True)
+
+    titles, agencies, corrections = [], [], []
+    for label, (title, parts) in TITLE_SIZES.items():
+        parts = max(CHAPTERS_PER_TITLE, int(parts * scale))
+        logging.info(f"Generating {label} Title {title} ({parts} parts)")
+        write_title_xml(os.path.join(directory, "xml", f"title-{title}.xml"), title, parts, rng)
+        titles.append({
+            "number": title, "name": f"Synthetic {label.title()} Title", "latest_amended_on": ISSUE_DATE,
+            "latest_issue_date": ISSUE_DATE, "up_to_date_as_of": ISSUE_DATE, "reserved": False,
+        })
+
+        references = _references(title, parts)
+        for i, reference in enumerate(references):
+            slug = f"agency-{title}-{i}"
+            agencies.append({
+                "name": f"Agency {title}-{i}", "short_name": f"A{title}{i}", "display_name": f"Agency {title}-{i}",
+                "sortable_name": f"Agency {title}-{i}", "slug": slug, "children": [], "cfr_references": [reference],
+            })
+
+        versions = []
+        part_numbers = [
+            _part_number(chapter, part)
+            for chapter in range(CHAPTERS_PER_TITLE) for part in range(max(1, parts // CHAPTERS_PER_TITLE))
+        ]
+        for number in part_numbers:
+            for day in range(1, 4):
+                versions.append({
+                    "date": f"2024-0{day}-01", "amendment_date": f"2024-0{day}-01", "issue_date": f"2024-0{day}-01",
+                    "identifier": f"{number}.1", "name": f"§ {number}.1 Requirements.", "part": str(number),
+                    "substantive": True, "removed": False, "subpart": None, "title": str(title), "type": "section",
+                })
+        _write_json(os.path.join(directory, "versions", f"title-{title}.json"), {
+            "content_versions": versions,
+            "meta": {"title": str(title), "result_count": len(versions), "issue_date": {"lte": ISSUE_DATE},
+                     "latest_amendment_date": ISSUE_DATE, "latest_issue_date": ISSUE_DATE},
+        })
+
+        for i in range(parts * 2):
+            year = 2000 + rng.randint(0, 24)
+            corrected = f"{year}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+            corrections.append({
+                "id": len(corrections) + 1, "cfr_references": _correction_references(title, parts, rng),
+                "corrective_action": "Corrected",
+                "error_corrected": corrected, "error_occurred": f"{year - 1}-06-01", "fr_citation": f"{year} FR {i}",
+                "position": i, "display_in_toc": False, "title": title, "year": year, "last_modified": corrected,
+            })
+
+    _write_json(os.path.join(directory, "titles.json"), {"titles": titles})
+    _write_json(os.path.join(directory, "agencies.json"), {"agencies": agencies})
+    _write_json(os.path.join(directory, "corrections.json"), {"ecfr_corrections": corrections})
+    _write_json(os.path.join(directory, "manifest.json"), {
+        "version": VERSION, "scale": scale, "seed": seed,
+        "titles": {label: title for label, (title, _) in TITLE_SIZES.items()},
+    })
+
+
+def record(small, mid, directory=FIXTURES_DIR):
+    """Replaces the small and mid-size synthetic Titles with real Titles recorded from ecfr.gov."""
+    # Imported here so that importing this module does not fix `utils.client.BASE_URL` before the stub is configured.
+    from utils import ecfr
+
+    titles_data = ecfr.fetch_titles()
+    agencies_data = ecfr.fetch_agencies()
+    if not titles_data or not agencies_data:
+        raise RuntimeError("Failed to fetch Titles or Agencies from the eCFR.")
+    titles = {t["number"]: t for t in titles_data}
+
+    with open(os.path.join(directory, "manifest.json")) as f:
+        manifest = json.load(f)
+    with open(os.path.join(directory, "titles.json")) as f:
+        fixture_titles = {t["number"]: t for t in json.load(f)["titles"]}
+
+    for label, title in (("small", small), ("mid", mid)):
+        date = titles[title]["latest_issue_date"]
+        logging.info(f"Recording {label} Title {title} on {date}")
+        xml = ecfr.fetch_xml_for_title(date, title)
+        versions = ecfr.fetch_versions_for_title(title)
+        if xml is None or versions is None:
+            raise RuntimeError(f"Failed to record Title {title}.")
+
+        previous = manifest["titles"][label]
+        fixture_titles.pop(previous, None)
+        for name in (os.path.join("xml", f"title-{previous}.xml"), os.path.join("versions", f"title-{previous}.json")):
+            if os.path.exists(os.path.join(directory, name)):
+                os.remove(os.path.join(directory, name))
+
+        with open(os.path.join(directory, "xml", f"title-{title}.xml"), "w", encoding="utf-8") as f:
+            f.write(xml)
+        _write_json(os.path.join(directory, "versions", f"title-{title}.json"), versions)
+        fixture_titles[title] = titles[title]
+        manifest["titles"][label] = title
+
+    _write_json(os.path.join(directory, "titles.json"), {"titles": sorted(fixture_titles.values(),
+                                                                           key=lambda t: t["number"])})
+    # Synthetic Agencies of the very large Title are kept so it is still referenced.
+    with open(os.path.join(directory, "agencies.json")) as f:
+        synthetic = [
+            agency for agency in json.load(f)["agencies"]
+            if all(reference["title"] == manifest["titles"]["huge"] for reference in agency["cfr_references"])
+        ]
+    _write_json(os.path.join(directory, "agencies.json"), {"agencies": agencies_data["agencies"] + synthetic})
+    corrections = ecfr.fetch_corrections()
+    if corrections is not None:
+        _write_json(os.path.join(directory, "corrections.json"), corrections)
+    manifest["recorded"] = True
+    _write_json(os.path.join(directory, "manifest.json"), manifest)
+
+
+def load_manifest(directory=FIXTURES_DIR):
+    try:
+        with open(os.path.join(directory, "manifest.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
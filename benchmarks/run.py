@@ -0,0 +1,309 @@
+"""
+Offline benchmarks of the metrics pipeline stages against the local eCFR stand-in.
+
+    python -m benchmarks.run                      # generate fixtures if needed, run, save results
+    python -m benchmarks.run --compare benchmarks/results/<previous>.json
+
+For every fixture Title, each stage reports wall time, peak RSS during the stage and throughput (MB/s of XML and/or
+items per second). Results are written as JSON to `benchmarks/results/<commit>.json` so runs from different commits
+can be compared.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import nltk
+import numpy as np
+
+from benchmarks import fixtures, stub
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+def current_rss():
+    """Resident set size of this process in bytes, or None where `/proc` is unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+class PeakRSS:
+    """Samples RSS in a background thread to find the peak within a block."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss() or 0)
+
+    def __enter__(self):
+        self.peak = current_rss() or 0
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        rss = current_rss()
+        if rss is None:
+            # Without /proc, fall back to the process-wide peak (kilobytes on Linux, bytes on macOS).
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            rss = peak if sys.platform == "darwin" else peak * 1024
+        self.peak = max(self.peak, rss)
+
+
+class Benchmark:
+    def __init__(self):
+        self.results = []
+
+    def measure(self, stage, fn, title=None, size=None, items=None):
+        """
+        Runs `fn()` once and records its wall time, peak RSS and throughput. Returns the result of `fn`.
+
+        `size` is the number of bytes processed, or a function of the result returning it.
+        """
+        with PeakRSS() as rss:
+            start = time.perf_counter()
+            value = fn()
+            elapsed = time.perf_counter() - start
+        if callable(size):
+            size = size(value)
+
+        result = {
+            "stage": stage,
+            "title": title,
+            "seconds": elapsed,
+            "peak_rss_mb": rss.peak / 1024 ** 2,
+            "mb": size / 1024 ** 2 if size is not None else None,
+            "mb_per_s": size / 1024 ** 2 / elapsed if size is not None and elapsed > 0 else None,
+            "items": items,
+            "items_per_s": items / elapsed if items is not None and elapsed > 0 else None,
+        }
+        self.results.append(result)
+        logging.info(
+            f"{stage:<18} {str(title or ''):>5} {elapsed:8.3f}s {result['peak_rss_mb']:8.1f} MB RSS"
+            + (f" {result['mb_per_s']:8.2f} MB/s" if result["mb_per_s"] is not None else "")
+            + (f" {result['items_per_s']:10.1f} items/s" if result["items_per_s"] is not None else "")
+        )
+        return value
+
+
+def run(directory, scale):
+    """Runs every stage and returns the results. Must be called with `ECFR_BASE_URL` pointing at the stub."""
+    from utils import coverage, custom_metrics, ecfr, hierarchy, scoring, search, snapshot
+    from utils.agencies import iter_agencies, reference_key
+    from utils.cache import iter_file, xml_key, xml_store
+    from utils.corrections import GRANULARITIES, CorrectionsStore, agency_cube, count_by_agency
+    from utils.fingerprints import counts_store
+
+    # This is needed for sentence tokenization, as in the metrics job.
+    nltk.download('punkt_tab')
+
+    benchmark = Benchmark()
+    work_dir = tempfile.mkdtemp(prefix="ecfr-benchmark-")
+
+    titles = benchmark.measure("fetch_titles", ecfr.fetch_titles)
+    agencies = list(iter_agencies(benchmark.measure("fetch_agencies", ecfr.fetch_agencies)["agencies"]))
+
+    reference_metrics = {}
+    paths_by_title = {}
+    for title_data in titles:
+        title, date = title_data["number"], title_data["latest_issue_date"]
+        references = [
+            reference for agency in agencies for reference in agency["cfr_references"] if reference["title"] == title
+        ]
+
+        # The XML is streamed into the store and from the store into the parser, as in the metrics job.
+        benchmark.measure(
+            "download", lambda: ecfr.download_xml(date, title), title,
+            lambda _: xml_store.raw_size(xml_key(date, title)),
+        )
+        size = xml_store.raw_size(xml_key(date, title))
+        benchmark.measure("fetch_versions", lambda: ecfr.fetch_versions_for_title(title), title)
+
+        def parse():
+            with xml_store.open(xml_key(date, title)) as f:
+                return hierarchy.build_title_index(iter_file(f), title, date, counts_store)
+
+        index = benchmark.measure("parse_and_count", parse, title, size, len(references))
+        # Parsing again finds the counts of every text segment in the counts store.
+        benchmark.measure("parse_cached", parse, title, size, len(references))
+
+        def process_references():
+            nodes = [index.find(reference) for reference in references]
+            counts = [node.counts if node is not None else scoring.TextCounts() for node in nodes]
+            scores = scoring.score_batch(counts)
+            return {
+                reference_key(reference): {
+                    "reference": reference,
+                    "node": index.path_key(node) if node is not None else None,
+                    "word_count": node.word_count if node is not None else 0,
+                    "sentence_count": counts[i].sentences,
+                    **{name: None if np.isnan(values[i]) else float(values[i]) for name, values in scores.items()},
+                    **custom_metrics.values(node.metrics if node is not None else {}, counts[i]),
+                    "counts": counts[i],
+                }
+                for i, (reference, node) in enumerate(zip(references, nodes))
+            }
+
+        reference_metrics.update(benchmark.measure("process_reference", process_references, title, None,
+                                                   len(references)))
+        benchmark.measure(
+            "score_nodes", lambda: scoring.score_batch([node.counts for node in index.nodes]), title, None,
+            len(index.nodes),
+        )
+
+        def parse_and_index():
+            with xml_store.open(xml_key(date, title)) as f, \
+                    search.SegmentWriter(title, date, os.path.join(work_dir, "search")) as segment:
+                hierarchy.build_title_index(iter_file(f), title, date, counts_store, segment)
+                segment.publish(str(title))
+
+        # Section text is indexed for search while parsing, so this is a (cached) parse plus indexing.
+        benchmark.measure("search_index", parse_and_index, title, size)
+        paths_by_title[title] = [index.path_key(node) for node in index.nodes]
+        del index
+
+    # Agencies are aggregated without deduplicating nested references; only the snapshot stages use them.
+    metrics = {}
+    for agency in agencies:
+        agency_references = [reference_metrics[reference_key(reference)] for reference in agency["cfr_references"]]
+        total_counts = sum((reference["counts"] for reference in agency_references), scoring.TextCounts())
+        scores = scoring.score(total_counts)
+        metrics[agency["slug"]] = {
+            "total_word_count": sum(reference["word_count"] for reference in agency_references),
+            "average_flesch_kincaid": scores["flesch_kincaid"],
+            "average_flesch_reading_ease": scores["flesch_reading_ease"],
+            "average_smog": scores["smog"],
+            "counts": total_counts.to_dict(),
+            "references": agency_references,
+        }
+
+    tables = benchmark.measure(
+        "snapshot_build", lambda: snapshot.encode(snapshot.build_tables(metrics)), None, None, len(metrics)
+    )
+    benchmark.measure(
+        "snapshot_load", lambda: [snapshot.decode(data) for data in tables.values()], None,
+        sum(len(data) for data in tables.values()), len(metrics),
+    )
+
+    corrections = CorrectionsStore(os.path.join(work_dir, "corrections"))
+    benchmark.measure("corrections_sync", corrections.sync)
+    correction_count = len(corrections.corrections())
+    for granularity in GRANULARITIES:
+        benchmark.measure(f"corrections_{granularity}", lambda: corrections.cube(granularity), None, None,
+                          correction_count)
+
+    index = benchmark.measure(
+        "hierarchy_index", lambda: coverage.HierarchyIndex(paths_by_title), None, None,
+        sum(map(len, paths_by_title.values())),
+    )
+    agency_paths = {
+        agency["slug"]: [
+            reference_metrics[reference_key(reference)]["node"] for reference in agency["cfr_references"]
+            if reference_metrics[reference_key(reference)]["node"] is not None
+        ]
+        for agency in agencies
+    }
+    counts = benchmark.measure(
+        "agency_corrections", lambda: count_by_agency(corrections.corrections(), index, agency_paths), None, None,
+        correction_count,
+    )
+    for granularity in GRANULARITIES:
+        benchmark.measure(f"agency_cube_{granularity}", lambda: agency_cube(counts, granularity), None, None,
+                          len(counts))
+
+    return {
+        "commit": git_commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "fixtures": fixtures.load_manifest(directory),
+        "scale": scale,
+        "results": benchmark.results,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(__file__),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(baseline, report):
+    """Logs the change in wall time and peak RSS of each stage relative to a baseline report."""
+    previous = {(r["stage"], r["title"]): r for r in baseline["results"]}
+    logging.info(f"Compared with {baseline['commit']} ({baseline['created']}):")
+    for result in report["results"]:
+        before = previous.get((result["stage"], result["title"]))
+        if before is None or not before["seconds"]:
+            continue
+        time_change = (result["seconds"] / before["seconds"] - 1) * 100
+        rss_change = result["peak_rss_mb"] - before["peak_rss_mb"]
+        logging.info(
+            f"{result['stage']:<18} {str(result['title'] or ''):>5} {time_change:+7.1f}% time {rss_change:+8.1f} MB RSS"
+        )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Benchmark the metrics pipeline against local eCFR fixtures.")
+    parser.add_argument("--fixtures", default=fixtures.FIXTURES_DIR, help="Fixture directory.")
+    parser.add_argument("--scale", type=float, default=1.0, help="Size multiplier for generated fixtures.")
+    parser.add_argument("--regenerate", action="store_true", help="Regenerate synthetic fixtures.")
+    parser.add_argument(
+        "--record", nargs=2, type=int, metavar=("SMALL", "MID"),
+        help="Record two real Titles from ecfr.gov as the small and mid-size fixtures, then exit.",
+    )
+    parser.add_argument("--compare", metavar="REPORT", help="Previous report to compare against.")
+    parser.add_argument("--output", help="Report path (default: benchmarks/results/<commit>.json).")
+    args = parser.parse_args()
+
+    manifest = fixtures.load_manifest(args.fixtures)
+    if args.regenerate or manifest is None or (
+        not manifest.get("recorded")
+        and (manifest["scale"] != args.scale or manifest.get("version") != fixtures.VERSION)
+    ):
+        fixtures.generate(args.fixtures, scale=args.scale)
+    if args.record:
+        fixtures.record(*args.record, directory=args.fixtures)
+        sys.exit(0)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    server = stub.serve(args.fixtures)
+    # The eCFR clients read these when first imported by `run`.
+    os.environ["ECFR_BASE_URL"] = server.url
+    os.environ["ECFR_CACHE_DIR"] = tempfile.mkdtemp(prefix="ecfr-benchmark-cache-")
+    report = run(args.fixtures, args.scale)
+    server.shutdown()
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{report['commit']}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    logging.info(f"Saved results to {output}")
+
+    if baseline is not None:
+        compare(baseline, report)
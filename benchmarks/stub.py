@@ -0,0 +1,167 @@
+"""
+Local stand-in for the eCFR API endpoints used by `utils.ecfr`, serving fixtures from disk.
+
+Point the clients at it with `ECFR_BASE_URL`:
+
+    python -m benchmarks.stub --port 8765
+    ECFR_BASE_URL=http://127.0.0.1:8765 python -m scripts.calculate_agency_metrics
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import threading
+
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from benchmarks.fixtures import FIXTURES_DIR
+
+# Elements returned for hierarchy query parameters of the full XML endpoint.
+SLICE_ELEMENTS = {
+    "chapter": ("DIV3", "CHAPTER"),
+    "subchapter": ("DIV4", "SUBCHAP"),
+    "part": ("DIV5", "PART"),
+    "section": ("DIV8", "SECTION"),
+    "appendix": ("DIV9", "APPENDIX"),
+}
+# Hierarchy types of the structure endpoint, by the TYPE of their XML elements.
+STRUCTURE_TYPES = {
+    "TITLE": "title", "SUBTITLE": "subtitle", "CHAPTER": "chapter", "SUBCHAP": "subchapter", "PART": "part",
+    "SUBPART": "subpart", "SUBJGRP": "subject_group", "SECTION": "section", "APPENDIX": "appendix",
+}
+
+_full = re.compile(r"^/api/versioner/v1/full/([^/]+)/title-(\d+)\.xml$")
+_versions = re.compile(r"^/api/versioner/v1/versions/title-(\d+)\.json$")
+_structure = re.compile(r"^/api/versioner/v1/structure/([^/]+)/title-(\d+)\.json$")
+_div = re.compile(rb'<DIV\d N="([^"]*)" TYPE="([^"]*)"[^>]*>|</DIV\d>')
+
+
+class FixtureServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, directory=FIXTURES_DIR):
+        super().__init__(address, FixtureHandler)
+        self.directory = directory
+        self.read = lru_cache(maxsize=16)(self._read)
+
+    def _read(self, name):
+        with open(os.path.join(self.directory, name), "rb") as f:
+            return f.read()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logging.debug(f"stub: {format % args}")
+
+    def _send(self, status, body, content_type="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _fixture(self, name):
+        try:
+            return self.server.read(name)
+        except FileNotFoundError:
+            return None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        if url.path == "/api/admin/v1/agencies.json":
+            body = self._fixture("agencies.json")
+        elif url.path == "/api/versioner/v1/titles.json":
+            body = self._fixture("titles.json")
+        elif url.path == "/api/admin/v1/corrections.json":
+            body = self._corrections(params)
+        elif match := _versions.match(url.path):
+            body = self._fixture(os.path.join("versions", f"title-{match[1]}.json"))
+        elif match := _structure.match(url.path):
+            body = self._fixture(os.path.join("xml", f"title-{match[2]}.xml"))
+            if body is not None:
+                body = json.dumps(self._structure(body)).encode("utf-8")
+        elif match := _full.match(url.path):
+            body = self._fixture(os.path.join("xml", f"title-{match[2]}.xml"))
+            if body is not None:
+                body = self._slice(body, params)
+            if body is not None:
+                return self._send(200, body, "application/xml")
+        else:
+            body = None
+
+        if body is None:
+            return self._send(404, b'{"error": "Not Found"}')
+        self._send(200, body)
+
+    def _corrections(self, params):
+        body = self._fixture("corrections.json")
+        if body is None or "title" not in params:
+            return body
+        corrections = json.loads(body)["ecfr_corrections"]
+        return json.dumps({
+            "ecfr_corrections": [c for c in corrections if str(c["title"]) == params["title"]]
+        }).encode("utf-8")
+
+    @staticmethod
+    def _structure(xml):
+        """The hierarchy of a Title's XML with the size of each element, as from the structure endpoint."""
+        root = {"children": []}
+        stack = [(root, 0)]
+        for match in _div.finditer(xml):
+            if match[1] is not None:
+                node = {
+                    "identifier": match[1].decode("utf-8"),
+                    "type": STRUCTURE_TYPES.get(match[2].decode("utf-8"), match[2].decode("utf-8").lower()),
+                    "children": [],
+                }
+                stack[-1][0]["children"].append(node)
+                stack.append((node, match.start()))
+            elif len(stack) > 1:
+                node, start = stack.pop()
+                node["size"] = match.end() - start
+        return root["children"][0] if root["children"] else {}
+
+    @staticmethod
+    def _slice(xml, params):
+        """The innermost requested hierarchy element of a Title's XML, or None if it does not exist."""
+        for level in ("appendix", "section", "part", "subchapter", "chapter"):
+            if level in params:
+                tag, div_type = SLICE_ELEMENTS[level]
+                start = xml.find(f'<{tag} N="{params[level]}" TYPE="{div_type}">'.encode("utf-8"))
+                if start < 0:
+                    return None
+                end = xml.find(f"</{tag}>".encode("utf-8"), start)
+                return xml[start:end + len(tag) + 3]
+        return xml
+
+
+def serve(directory=FIXTURES_DIR, host="127.0.0.1", port=0):
+    """Starts the stub in a background thread and returns the server (see `FixtureServer.url`)."""
+    server = FixtureServer((host, port), directory)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Serve eCFR API fixtures locally.")
+    parser.add_argument("--directory", default=FIXTURES_DIR, help="Fixture directory.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    server = FixtureServer((args.host, args.port), args.directory)
+    logging.info(f"Serving {args.directory} at {server.url}")
+    server.serve_forever()
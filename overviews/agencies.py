@@ -1,10 +1,9 @@
 import altair as alt
-import json
 import pandas as pd
-import redis
 import streamlit as st
 
-from utils import ecfr
+from utils import custom_metrics, dashboard, history, rollup, scoring, snapshot
+from utils.agencies import covered_references
 
 st.set_page_config(layout="wide")
 
@@ -13,63 +12,59 @@ st.link_button("Readability Metrics", "https://pypi.org/project/py-readability-m
                disabled=False, use_container_width=False)
 
 
-@st.cache_resource
-def get_redis_client():
-    return redis.Redis(
-        host=st.secrets["REDIS_URL"],
-        port=st.secrets["REDIS_PORT"],
-        password=st.secrets["REDIS_PASSWORD"],
-        ssl=True
-    )
-
+SMOG_HELP = (
+    "A higher SMOG score indicates worse readability. Computed from every sentence rather than py-readability-metrics' "
+    "default sample of 30 sentences, so it differs from the library's default by about 1.2 grades on average."
+)
 
-r = get_redis_client()
+data = dashboard.connect(st.secrets["REDIS_URL"], st.secrets["REDIS_PORT"], st.secrets["REDIS_PASSWORD"])
 
 
-@st.cache_data
-def fetch_agencies():
-    return ecfr.fetch_agencies()
+def fetch_agency_history(agency):
+    """An Agency's time series, combined from its share of each referenced Title's history."""
+    titles = sorted({reference["title"] for reference in covered_references(agency)})
+    series = [
+        title_history["agencies"].get(agency["slug"], history.empty_series())
+        for title_history in map(data.title_history, titles) if title_history is not None
+    ]
+    return history.to_frame(history.combine(series))
 
 
-def fetch_aggregate_agency_metrics(slugs):
-    extracted_data = {
-        "Word Count": [],
-        "Average Flesch-Kincaid": [],
-        "Average Flesch Reading Ease": [],
-        "Average SMOG": [],
-    }
-
-    for agency in [json.loads(v) if v is not None else None for v in r.mget(slugs)]:
+def fetch_group_metrics(slugs):
+    """Metrics for a group of Agencies, rolled up from the distinct hierarchy nodes they cover."""
+    nodes = {}
+    for agency in data.agency_metrics(slugs):
         if agency is not None:
-            extracted_data["Word Count"].append(agency.get("total_word_count"))
-            extracted_data["Average Flesch-Kincaid"].append(agency.get("average_flesch_kincaid"))
-            extracted_data["Average Flesch Reading Ease"].append(agency.get("average_flesch_reading_ease"))
-            extracted_data["Average SMOG"].append(agency.get("average_smog"))
-        else:
-            extracted_data["Word Count"].append(None)
-            extracted_data["Average Flesch-Kincaid"].append(None)
-            extracted_data["Average Flesch Reading Ease"].append(None)
-            extracted_data["Average SMOG"].append(None)
-
-    return extracted_data
-
-
-def fetch_metrics_for_agency(slug):
-    v = r.get(slug)
-    return json.loads(v) if v is not None else None
+            nodes.update(agency.get("nodes", {}))
+    word_count, counts, metric_counts = rollup.rollup(nodes)
+    scores = {
+        name: round(score, 2) if score is not None else None
+        for name, score in {**scoring.score(counts), **custom_metrics.values(metric_counts, counts)}.items()
+    }
+    return {"Word Count": word_count, **scores}
 
 
 with st.spinner("Fetching Agencies..."):
-    agencies_data = fetch_agencies()
+    agencies_data = dashboard.agencies()
 
 if agencies_data:
     agencies = pd.DataFrame(agencies_data["agencies"]).set_index("sortable_name")
 
     with st.spinner("Fetching Agency metrics..."):
-        slugs = agencies["slug"].tolist()
-        agency_metrics = fetch_aggregate_agency_metrics(slugs)
-        for key, values in agency_metrics.items():
-            agencies[key] = values
+        agency_snapshot, reference_snapshot = data.snapshot()
+        if agency_snapshot is not None:
+            # Snapshots of older generations may lack the columns of newer metrics.
+            agency_metrics = agency_snapshot.set_index("slug").reindex(
+                index=agencies["slug"], columns=snapshot.AGENCIES_SCHEMA.names[1:]
+            )
+        else:
+            agency_metrics = pd.DataFrame(index=agencies["slug"], columns=snapshot.AGENCIES_SCHEMA.names[1:], dtype=float)
+        agencies["Word Count"] = agency_metrics["total_word_count"].to_numpy()
+        agencies["Average Flesch-Kincaid"] = agency_metrics["average_flesch_kincaid"].to_numpy()
+        agencies["Average Flesch Reading Ease"] = agency_metrics["average_flesch_reading_ease"].to_numpy()
+        agencies["Average SMOG"] = agency_metrics["average_smog"].to_numpy()
+        for visitor in custom_metrics.VISITORS:
+            agencies[visitor.label] = agency_metrics[visitor.name].to_numpy()
 
     col1, col2, col3, col4, col5 = st.columns(5)
     with col1:
@@ -92,7 +87,7 @@ if agencies_data:
         st.metric(
             "Average SMOG",
             round(agencies["Average SMOG"].mean(), 2),
-            help="A higher SMOG score indicates worse readability.",
+            help=SMOG_HELP,
         )
 
     calculating_count = agencies["Word Count"].isnull().sum()
@@ -102,7 +97,18 @@ if agencies_data:
     overview = agencies.drop(columns=["display_name", "slug", "cfr_references", "children"], errors="ignore")
     overview = overview.rename(columns={"name": "Name", "short_name": "Short Name"})
 
-    st.dataframe(overview, hide_index=True, use_container_width=True)
+    st.dataframe(
+        overview,
+        hide_index=True,
+        use_container_width=True,
+        column_config={
+            "Average SMOG": st.column_config.NumberColumn(help=SMOG_HELP),
+            **{
+                visitor.label: st.column_config.NumberColumn(help=visitor.description)
+                for visitor in custom_metrics.VISITORS
+            },
+        },
+    )
 
     with st.expander("Distribution of Word Counts", expanded=False):
         excluded_agencies = st.multiselect(
@@ -129,6 +135,29 @@ if agencies_data:
             ).properties(width=1000, height=1000)
             st.altair_chart(chart, use_container_width=False)
 
+    with st.expander("Agency Group", expanded=False):
+        group = st.multiselect(
+            "Agencies",
+            options=agencies_data["agencies"],
+            format_func=lambda a: a["name"],
+            placeholder="Select Agencies to Group",
+            help="Shared and nested CFR references are only counted once.",
+        )
+        if group:
+            group_metrics = fetch_group_metrics([a["slug"] for a in group])
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                st.metric("Word Count", group_metrics["Word Count"])
+            with col2:
+                st.metric("Flesch-Kincaid", group_metrics["flesch_kincaid"])
+            with col3:
+                st.metric("Flesch Reading Ease", group_metrics["flesch_reading_ease"])
+            with col4:
+                st.metric("SMOG", group_metrics["smog"], help=SMOG_HELP)
+            for col, visitor in zip(st.columns(len(custom_metrics.VISITORS)), custom_metrics.VISITORS):
+                with col:
+                    st.metric(visitor.label, group_metrics[visitor.name], help=visitor.description)
+
     st.divider()
     st.header("Agency Overview")
     selected_agency = st.selectbox(
@@ -143,14 +172,22 @@ if agencies_data:
         st.subheader("CFR References")
         agency_references = selected_agency["cfr_references"]
         if len(agency_references) > 0:
-            reference_metrics = fetch_metrics_for_agency(selected_agency["slug"])
-            if reference_metrics is not None:
-                references = pd.DataFrame(reference_metrics["references"])
-                reference = references["reference"].apply(pd.Series)
-                references = pd.concat([reference, references.drop(columns=["reference"])], axis=1)
+            references = None
+            if reference_snapshot is not None:
+                references = reference_snapshot[reference_snapshot["slug"] == selected_agency["slug"]]
+            if references is not None and not references.empty:
+                unused_levels = [level for level in snapshot.LEVELS if references[level].isna().all()]
+                references = references.drop(columns=["slug", *unused_levels])
                 references.columns = [col.replace("_", " ").title() for col in references.columns]
                 st.dataframe(references, hide_index=True, use_container_width=True)
             else:
                 st.spinner("Calculating CFR Reference metrics...")
+
+            st.subheader("Historical Changes")
+            agency_history = fetch_agency_history(selected_agency)
+            if not agency_history.empty:
+                st.line_chart(agency_history["word_count"], y_label="Word Count")
+            else:
+                st.info("No history has been calculated for this Agency's Titles.")
 else:
     st.error("Failed to fetch Agencies. Try again later.")
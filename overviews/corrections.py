@@ -1,68 +1,119 @@
 import pandas as pd
 import streamlit as st
 
-from datetime import datetime
-from utils import ecfr
+from utils import dashboard
+from utils.agencies import iter_agencies
+from utils.corrections import agency_cube, corrections_store, period_start
 
 st.set_page_config(layout="wide")
 
 st.title("Corrections 📝")
 
+PERIODICITIES = {"Daily": "D", "Weekly": "W", "Monthly": "M", "Yearly": "Y"}
+# Agencies charted by default: those with the most corrections in the selected range.
+DEFAULT_AGENCIES = 5
 
-@st.cache_data
-def fetch_corrections(date=None, title=None):
-    return ecfr.fetch_corrections(date=date, title=title)
+data = dashboard.connect(st.secrets["REDIS_URL"], st.secrets["REDIS_PORT"], st.secrets["REDIS_PASSWORD"])
 
 
-@st.cache_data
-def fetch_titles():
-    return ecfr.fetch_titles()
+@st.cache_data(ttl=3600)
+def sync_corrections():
+    return corrections_store.sync()
 
 
-def graph_corrections_over_time(corrections):
-    if len(corrections) == 0:
-        return
+@st.cache_data
+def fetch_corrections(version):
+    corrections = pd.DataFrame(corrections_store.corrections())
+    if corrections.empty:
+        return corrections
 
-    corrections["Error Corrected"] = pd.to_datetime(corrections["Error Corrected"], errors="coerce")
+    corrections = corrections.rename(columns={
+        "id": "ID",
+        "cfr_references": "CFR References",
+        "corrective_action": "Corrective Action",
+        "error_corrected": "Error Corrected",
+        "error_occurred": "Error Occurred",
+        "fr_citation": "FR Citation",
+        "position": "Position",
+        "display_in_toc": "Display in TOC",
+        "title": "Title",
+        "year": "Year",
+        "last_modified": "Last Modified",
+    })
 
-    corrections_by_date = (
-        corrections.dropna(subset=["Error Corrected"])
-        .groupby(corrections["Error Corrected"].dt.to_period("M"))
-        .size()
-        .rename("Correction Count")
-        .reset_index()
+    order = [
+        "ID", "CFR References", "Corrective Action", "Error Occurred", "Error Corrected",
+        "Year", "FR Citation", "Title", "Position", "Display in TOC", "Last Modified"
+    ]
+    corrections = corrections[[col for col in order if col in corrections.columns]]
+    corrections["CFR References"] = corrections["CFR References"].map(
+        lambda references: "; ".join(
+            reference["cfr_reference"] for reference in references if reference.get("cfr_reference")
+        ) if isinstance(references, list) else None
     )
 
-    corrections_by_date["Error Corrected"] = corrections_by_date["Error Corrected"].astype(str)
+    for col in ["Error Corrected", "Error Occurred", "Last Modified"]:
+        corrections[col] = pd.to_datetime(corrections[col], errors="coerce").dt.date
+    corrections["Year"] = corrections["Year"].astype(str)
+    return corrections
+
 
-    full_date_range = pd.date_range(
-        start=corrections["Error Corrected"].min(),
-        end=datetime.today().strftime("%Y-%m-%d"),
-        freq="ME"
-    )
+@st.cache_data
+def fetch_correction_counts(version, granularity):
+    return corrections_store.cube(granularity)
 
-    full_range_df = pd.DataFrame(full_date_range, columns=["Error Corrected"])
-    full_range_df["Error Corrected"] = full_range_df["Error Corrected"].dt.strftime("%Y-%m")
-    full_range_df["Correction Count"] = 0
 
-    corrections_by_date = full_range_df.merge(corrections_by_date, on="Error Corrected", how="left").fillna(0)
+@st.cache_data
+def fetch_agency_correction_counts(generation, granularity):
+    return agency_cube(data.correction_counts(), granularity)
+
+
+def graph_corrections_over_time(counts, title, start, end, granularity):
+    column = title if title is not None else "All"
+    if column not in counts.columns:
+        return
 
-    corrections_by_date["Correction Count"] = corrections_by_date["Correction Count_y"].astype(int)
-    corrections_by_date = corrections_by_date[["Error Corrected", "Correction Count"]]
+    if start is not None:
+        counts = counts[counts.index >= pd.Timestamp(period_start(start, granularity))]
+    if end is not None:
+        counts = counts[counts.index <= pd.Timestamp(end)]
 
-    st.line_chart(corrections_by_date.set_index("Error Corrected"))
+    st.line_chart(counts[column].rename("Correction Count").rename_axis("Error Corrected"))
 
 
-titles_data = fetch_titles()
-col1, col2 = st.columns(2)
+def graph_agency_corrections_over_time(counts, agency_names, start, end, granularity):
+    if start is not None:
+        counts = counts[counts.index >= pd.Timestamp(period_start(start, granularity))]
+    if end is not None:
+        counts = counts[counts.index <= pd.Timestamp(end)]
+
+    totals = counts.sum().sort_values(ascending=False)
+    selected = st.multiselect(
+        "Agencies",
+        list(totals.index),
+        default=list(totals[totals > 0].index[:DEFAULT_AGENCIES]),
+        format_func=lambda slug: agency_names.get(slug, slug),
+        help="Corrections of the CFR content covered by each Agency, including its child Agencies.",
+        placeholder="Select Agencies",
+    )
+    if selected:
+        lines = counts[selected].rename(columns=agency_names).rename_axis("Error Corrected")
+        st.line_chart(lines, y_label="Correction Count")
+
+
+titles_data = dashboard.titles()
+col1, col2, col3 = st.columns(3)
 with col1:
-    selected_date = st.date_input(
-        "Date",
-        None,
-        help="Restrict results to eCFR corrections that occurred on or before the specified date and that were corrected on or after the specified date.",
+    selected_dates = st.date_input(
+        "Error Corrected",
+        (),
+        help="Restrict results to eCFR corrections corrected within the specified date range.",
     )
+    start_date = selected_dates[0] if len(selected_dates) > 0 else None
+    end_date = selected_dates[1] if len(selected_dates) > 1 else None
 
 with col2:
+    selected_title = None
     if titles_data:
         titles_dict = {t["number"]: t for t in titles_data}
         selected_title = st.selectbox(
@@ -76,47 +127,43 @@ with col2:
     else:
         st.error("Failed to fetch Titles", icon="🚨")
 
-with st.spinner("Fetching Corrections..."):
-    corrections_data = fetch_corrections(
-        date=str(selected_date) if selected_date is not None else None,
-        title=selected_title,
-    )
+with col3:
+    periodicity = st.selectbox("Periodicity", list(PERIODICITIES.keys()), index=2)
 
-if corrections_data and len(corrections_data["ecfr_corrections"]) > 0:
-    corrections = pd.DataFrame(corrections_data["ecfr_corrections"])
+with st.spinner("Syncing Corrections..."):
+    synced_version = sync_corrections()
+    if synced_version is None:
+        st.warning("Failed to sync Corrections. Showing previously synced Corrections.")
+    version = synced_version if synced_version is not None else corrections_store.version()
+    corrections = fetch_corrections(version)
 
-    corrections = corrections.rename(columns={
-        "id": "ID",
-        "cfr_references": "CFR References",
-        "corrective_action": "Corrective Action",
-        "error_corrected": "Error Corrected",
-        "error_occurred": "Error Occurred",
-        "fr_citation": "FR Citation",
-        "position": "Position",
-        "display_in_toc": "Display in TOC",
-        "title": "Title",
-        "year": "Year",
-        "last_modified": "Last Modified",
-    })
-
-    order = [
-        "ID", "CFR References", "Corrective Action", "Error Occurred", "Error Corrected",
-        "Year", "FR Citation", "Title", "Position", "Display in TOC", "Last Modified"
-    ]
-    corrections = corrections[[col for col in order if col in corrections.columns]]
-    corrections = corrections.drop(columns=["CFR References"])
-
-    for col in ["Error Corrected", "Error Occurred", "Last Modified"]:
-        corrections[col] = pd.to_datetime(corrections[col], errors="coerce").dt.date
-    corrections["Year"] = corrections["Year"].astype(str)
+if not corrections.empty:
+    if start_date is not None:
+        corrections = corrections[corrections["Error Corrected"] >= start_date]
+    if end_date is not None:
+        corrections = corrections[corrections["Error Corrected"] <= end_date]
+    if selected_title is not None:
+        corrections = corrections[corrections["Title"] == selected_title]
 
     st.metric("Total Corrections", len(corrections))
     st.dataframe(corrections.set_index("ID"), use_container_width=True)
 
     st.subheader("Corrections over Time")
-    graph_corrections_over_time(corrections)
+    granularity = PERIODICITIES[periodicity]
+    graph_corrections_over_time(
+        fetch_correction_counts(version, granularity), selected_title, start_date, end_date, granularity
+    )
+
+    st.subheader("Corrections per Agency")
+    agency_counts = fetch_agency_correction_counts(data.generation(), granularity)
+    agencies_data = dashboard.agencies()
+    if not agency_counts.empty and agencies_data:
+        agency_names = {agency["slug"]: agency["name"] for agency in iter_agencies(agencies_data["agencies"])}
+        graph_agency_corrections_over_time(agency_counts, agency_names, start_date, end_date, granularity)
+    else:
+        st.info("Correction counts per Agency are calculated with the Agency metrics.")
 
-elif len(corrections_data["ecfr_corrections"]) == 0:
+elif synced_version is not None:
     st.metric("Total Corrections", 0)
 else:
     st.error("Failed to fetch Corrections. Try again later.")
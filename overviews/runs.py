@@ -0,0 +1,107 @@
+import altair as alt
+import pandas as pd
+import streamlit as st
+
+from utils import dashboard
+
+st.set_page_config(layout="wide")
+
+st.title("Metrics Runs ⏱️")
+
+
+data = dashboard.connect(st.secrets["REDIS_URL"], st.secrets["REDIS_PORT"], st.secrets["REDIS_PASSWORD"])
+
+
+def stage_table(report):
+    stages = pd.DataFrame.from_dict(report["stages"], orient="index").rename_axis("Stage").reset_index()
+    stages["MB/s"] = stages["bytes"] / 1024 ** 2 / stages["total_seconds"].where(stages["total_seconds"] > 0)
+    return stages.rename(columns={
+        "count": "Spans", "total_seconds": "Total (s)", "p50_seconds": "p50 (s)", "p95_seconds": "p95 (s)",
+        "max_seconds": "Max (s)", "bytes": "Bytes", "elements": "Elements", "failed": "Failed",
+    })
+
+
+def slowest_table(entries, column, name):
+    table = pd.DataFrame([{name: entry[column], "Seconds": entry["seconds"], **entry["stages"]} for entry in entries])
+    return table.fillna(0.0)
+
+
+with st.spinner("Fetching run reports..."):
+    reports = data.run_reports()
+
+if not reports:
+    st.info("No runs have been reported yet. Generate metrics to record one.")
+else:
+    selected = st.selectbox(
+        "Select a run",
+        range(len(reports)),
+        format_func=lambda i: f"{reports[i]['started']} ({reports[i]['seconds']:.0f}s)",
+    )
+    report = reports[selected]
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Duration", f"{report['seconds']:.0f}s")
+    with col2:
+        st.metric("Titles Processed", f"{report['titles']['processed']} of {report['titles']['total']}")
+    with col3:
+        st.metric("Agencies Processed", f"{report['agencies']['processed']} of {report['agencies']['total']}")
+    with col4:
+        st.metric("Generation", report["generation"] or "None")
+
+    st.subheader("Stages")
+    if report["stages"]:
+        stages = stage_table(report)
+        st.dataframe(stages, hide_index=True, use_container_width=True)
+        chart = alt.Chart(stages).mark_bar().encode(
+            y=alt.Y("Stage:N", sort=list(stages["Stage"]), axis=alt.Axis(title=None)),
+            x=alt.X("Total (s):Q", title="Total Seconds"),
+        )
+        st.altair_chart(chart, use_container_width=True)
+    else:
+        st.write("No stages ran.")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.subheader("Slowest Titles", help="Ranked by time spent fetching, parsing, tokenizing and scoring.")
+        if report["slowest_titles"]:
+            st.dataframe(slowest_table(report["slowest_titles"], "title", "Title"), hide_index=True,
+                         use_container_width=True)
+    with col2:
+        st.subheader(
+            "Slowest References",
+            help="Each reference's share of its Title's fetch, parse, tokenize and score time, by the words it covers.",
+        )
+        if report["slowest_references"]:
+            st.dataframe(slowest_table(report["slowest_references"], "reference", "Reference"), hide_index=True,
+                         use_container_width=True)
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.subheader("Cache Hit Rates")
+        caches = pd.DataFrame.from_dict(report["caches"], orient="index").rename_axis("Cache").reset_index()
+        st.dataframe(caches, hide_index=True, use_container_width=True)
+    with col2:
+        st.subheader("eCFR Requests")
+        http = pd.DataFrame.from_dict(report["http"], orient="index").rename_axis("Endpoint").reset_index()
+        st.dataframe(http, hide_index=True, use_container_width=True)
+        # Reports of runs before adaptive concurrency have no windows.
+        if report.get("concurrency"):
+            windows = pd.DataFrame.from_dict(report["concurrency"], orient="index").rename_axis("Family").reset_index()
+            st.dataframe(windows.rename(columns={
+                "window": "Window", "minimum": "Min", "maximum": "Max", "peak": "Peak", "decreases": "Decreases",
+                "throttled": "Throttled", "mean_latency": "Mean Latency (s)",
+            }), hide_index=True, use_container_width=True)
+
+    st.subheader("Stage Time by Run")
+    history = pd.DataFrame([
+        {"Started": pd.Timestamp(run["started"]), "Stage": stage, "Seconds": stats["total_seconds"]}
+        for run in reports for stage, stats in run["stages"].items()
+    ])
+    if not history.empty:
+        chart = alt.Chart(history).mark_bar().encode(
+            x=alt.X("Started:T", title="Run Started"),
+            y=alt.Y("Seconds:Q", stack=True),
+            color=alt.Color("Stage:N"),
+        )
+        st.altair_chart(chart, use_container_width=True)
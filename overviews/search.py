@@ -0,0 +1,111 @@
+import pandas as pd
+import streamlit as st
+import time
+
+from urllib.parse import quote
+from utils import dashboard
+from utils.agencies import covered_references, reference_covers
+from utils.search import search_index
+
+st.set_page_config(layout="wide")
+
+st.title("Search 🔎")
+
+ECFR_URL = "https://www.ecfr.gov/current/"
+
+
+def ecfr_link(path):
+    """
+    eCFR URL of a section or appendix from its path. Appendix identifiers are only unique within their part, so an
+    appendix keeps its part, and they contain spaces (e.g. `Appendix A to Part 60`), so each identifier is URL-encoded.
+    """
+    components = path.split("/")
+    if components[-1].startswith("appendix-"):
+        components = [components[0], *[c for c in components[1:-1] if c.startswith("part-")], components[-1]]
+    else:
+        components = [components[0], components[-1]]
+    return ECFR_URL + "/".join(quote(component, safe="") for component in components)
+
+
+def hits_by_agency(results, agencies):
+    """
+    Total hits within each Agency's CFR references.
+
+    References are matched against the full path of each hit, so references to individual sections count too.
+    References above section level cover every section of a part or subpart alike, so they are matched once per
+    enclosing container.
+    """
+    references_by_title = {}
+    for agency in agencies:
+        for reference in covered_references(agency):
+            level = "sections" if reference.get("section") is not None else "containers"
+            references_by_title.setdefault(reference["title"], {"containers": [], "sections": []})[level].append(
+                (agency["name"], reference)
+            )
+
+    hits = {}
+    container_names = {}
+    for (title, container, path), count in results.groupby(["Title", "Container", "Path"])["Hits"].sum().items():
+        references = references_by_title.get(title)
+        if references is None:
+            continue
+        if (title, container) not in container_names:
+            container_names[title, container] = {
+                name for name, reference in references["containers"] if reference_covers(reference, container)
+            }
+        names = container_names[title, container] | {
+            name for name, reference in references["sections"] if reference_covers(reference, path)
+        }
+        for name in names:
+            hits[name] = hits.get(name, 0) + count
+    return pd.DataFrame(list(hits.items()), columns=["Agency", "Hits"]).sort_values("Hits", ascending=False)
+
+
+query = st.text_input(
+    "Search CFR text",
+    placeholder='e.g. emission "new source performance standards"',
+    help="Matches sections and appendices containing every term. Use double quotes to search for a phrase.",
+)
+
+if query:
+    start = time.perf_counter()
+    results = pd.DataFrame(search_index.search(query), columns=["Title", "Path", "Hits"])
+    elapsed = (time.perf_counter() - start) * 1000
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Matches", int(results["Hits"].sum()))
+    with col2:
+        st.metric("Sections", len(results))
+    with col3:
+        st.metric("Search Time", f"{elapsed:.0f} ms")
+
+    if results.empty:
+        if not search_index.segments():
+            st.info("The search index has not been built yet, or is not shared with this host. Generate metrics to "
+                    "build it, with `ECFR_SEARCH_DIR` set to storage the app can read.")
+    else:
+        results["Container"] = results["Path"].str.rsplit("/", n=1).str[0]
+        results["Link"] = results["Path"].map(ecfr_link)
+
+        tab1, tab2, tab3 = st.tabs(["By Agency", "By Title", "Sections"])
+        with tab1:
+            agencies_data = dashboard.agencies()
+            if agencies_data:
+                st.dataframe(hits_by_agency(results, agencies_data["agencies"]), hide_index=True,
+                             use_container_width=True)
+            else:
+                st.error("Failed to fetch Agencies. Try again later.")
+        with tab2:
+            titles_data = dashboard.titles() or []
+            title_names = {t["number"]: t["name"] for t in titles_data}
+            by_title = results.groupby("Title").agg(Hits=("Hits", "sum"), Sections=("Path", "size")).reset_index()
+            by_title.insert(1, "Name", by_title["Title"].map(title_names))
+            st.dataframe(by_title.sort_values("Hits", ascending=False), hide_index=True, use_container_width=True)
+        with tab3:
+            st.dataframe(
+                results.sort_values("Hits", ascending=False)[["Title", "Path", "Hits", "Link"]],
+                hide_index=True,
+                use_container_width=True,
+                column_config={"Link": st.column_config.LinkColumn("Link", display_text="View in CFR")},
+            )
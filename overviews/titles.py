@@ -1,21 +1,65 @@
-import natsort
 import pandas as pd
 import streamlit as st
 
-from utils import ecfr
+from datetime import date
+from utils import dashboard, history
+from utils.versions import version_index
 
 st.set_page_config(layout="wide")
 
 st.title("Code of Federal Regulations Titles 📖")
 
+PAGE_SIZES = [50, 100, 500, 1000]
+
+
+data = dashboard.connect(st.secrets["REDIS_URL"], st.secrets["REDIS_PORT"], st.secrets["REDIS_PASSWORD"])
+
+
+def fetch_title_history(title):
+    title_history = data.title_history(title)
+    return history.to_frame(title_history["title"]) if title_history is not None else None
+
+
+@st.cache_data(ttl=3600)
+def sync_versions(title, latest_issue_date):
+    return version_index.sync(title, latest_issue_date)
+
 
 @st.cache_data
-def fetch_titles():
-    return ecfr.fetch_titles()
+def fetch_versions_summary(version, title):
+    return version_index.summary(title)
+
+
+@st.cache_data
+def fetch_versions_counts(version, title, start, end, part):
+    return version_index.counts(title, start, end, part)
+
+
+@st.cache_data
+def fetch_versions_page(version, title, offset, limit, start, end, part):
+    content_versions = version_index.page(title, offset, limit, start, end, part)
+    for col in ["amendment_date", "issue_date"]:
+        content_versions[col] = pd.to_datetime(content_versions[col], errors="coerce").dt.date
+
+    content_versions["substantive"] = content_versions["substantive"].replace({True: "✅ Yes", False: "❌ No"})
+    content_versions["removed"] = content_versions["removed"].replace({True: "✅ Yes", False: "❌ No"})
+    content_versions["type"] = content_versions["type"].replace({"section": "Section", "appendix": "Appendix"})
+
+    return content_versions.rename(columns={
+        "identifier": "Identifier",
+        "amendment_date": "Amendment Date",
+        "issue_date": "Issue Date",
+        "name": "Name",
+        "part": "Part",
+        "substantive": "Substantive",
+        "removed": "Removed",
+        "subpart": "Subpart",
+        "type": "Type",
+    }).set_index("Identifier")
 
 
 with st.spinner("Fetching Titles..."):
-    titles_data = fetch_titles()
+    titles_data = dashboard.titles()
 
 if titles_data:
     titles = pd.DataFrame(titles_data).rename(columns={
@@ -50,56 +94,78 @@ if titles_data:
     )
 
     with st.spinner("Fetching Title Content Versions..."):
-        versions_data = ecfr.fetch_versions_for_title(selected_title)
-
-    meta = versions_data["meta"]
-
-    col1, col2, col3 = st.columns(3)
-    with col1:
-        st.metric(label="Total Content Versions", value=meta["result_count"])
-    with col2:
-        st.metric(label="Latest Amendment Date", value=meta["latest_amendment_date"])
-    with col3:
-        st.metric(label="Latest Issue Date", value=meta["latest_issue_date"])
-
-    content_versions = pd.DataFrame(versions_data["content_versions"]).drop(columns=["date", "title"])
-
-    if not content_versions.empty:
-        for col in ["amendment_date", "issue_date"]:
-            content_versions[col] = pd.to_datetime(content_versions[col], errors="coerce").dt.date
-
-        content_versions = content_versions.sort_values(by="identifier", key=natsort.natsort_keygen())
-        content_versions = content_versions.rename(columns={"identifier": "Identifier"})
-        content_versions = content_versions.set_index("Identifier")
-
-        content_versions["substantive"] = content_versions["substantive"].replace({True: "✅ Yes", False: "❌ No"})
-        content_versions["removed"] = content_versions["removed"].replace({True: "✅ Yes", False: "❌ No"})
-        content_versions["type"] = content_versions["type"].replace({"section": "Section", "appendix": "Appendix"})
-
-        content_versions = content_versions.rename(columns={
-            "amendment_date": "Amendment Date",
-            "issue_date": "Issue Date",
-            "name": "Name",
-            "part": "Part",
-            "substantive": "Substantive",
-            "removed": "Removed",
-            "subpart": "Subpart",
-            "type": "Type",
-        })
+        versions_version = sync_versions(selected_title, titles_dict[selected_title]["latest_issue_date"])
+        summary = fetch_versions_summary(versions_version, selected_title)
+
+    if summary is None:
+        st.error("Failed to fetch Content Versions. Try again later.")
+    elif not summary["versions"]:
+        st.warning("No content versions available for the selected Title.")
+    else:
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric(label="Total Content Versions", value=summary["versions"])
+        with col2:
+            st.metric(label="Latest Amendment Date", value=summary["latest_amendment_date"])
+        with col3:
+            st.metric(label="Latest Issue Date", value=summary["latest_issue_date"])
 
+        first_issued = date.fromisoformat(summary["first_issue_date"])
+        latest_issued = date.fromisoformat(summary["latest_issue_date"])
         col1, col2 = st.columns(2)
         with col1:
-            st.metric(label="Sections", value=(content_versions["Type"].eq("Section").sum()))
+            issued = st.date_input(
+                "Issued between", value=(first_issued, latest_issued), min_value=first_issued, max_value=latest_issued
+            )
         with col2:
-            st.metric(label="Appendices", value=(content_versions["Type"].eq("Appendix").sum()))
+            part = st.selectbox("Part", [None] + summary["parts"], format_func=lambda p: "All" if p is None else p)
+        # While a range is being picked only its start is set, and a cleared input falls back to the full range.
+        if len(issued) == 2:
+            start, end = issued
+        elif issued:
+            start, end = issued[0], latest_issued
+        else:
+            start, end = first_issued, latest_issued
+        filters = (
+            start.isoformat() if start != first_issued else None,
+            end.isoformat() if end != latest_issued else None,
+            part,
+        )
+
+        if filters == (None, None, None):
+            sections, appendices, matching = summary["sections"], summary["appendices"], summary["versions"]
+        else:
+            counts = fetch_versions_counts(versions_version, selected_title, *filters)
+            sections, appendices, matching = counts.get("section", 0), counts.get("appendix", 0), sum(counts.values())
 
-        st.dataframe(
-            content_versions,
-            use_container_width=True,
-            hide_index=False,
+        col1, col2 = st.columns(2)
+        with col1:
+            st.metric(label="Sections", value=sections)
+        with col2:
+            st.metric(label="Appendices", value=appendices)
+
+        col1, col2 = st.columns(2)
+        with col1:
+            page_size = st.selectbox("Versions per page", PAGE_SIZES, index=1)
+        pages = max(1, -(-matching // page_size))
+        with col2:
+            page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1)
+
+        content_versions = fetch_versions_page(
+            versions_version, selected_title, (page - 1) * page_size, page_size, *filters
         )
+        if content_versions.empty:
+            st.info("No content versions match the filters.")
+        else:
+            st.dataframe(content_versions, use_container_width=True, hide_index=False)
+
+    st.subheader("Historical Changes")
+    title_history = fetch_title_history(selected_title)
+    if title_history is not None and not title_history.empty:
+        st.line_chart(title_history["word_count"], y_label="Word Count")
+        st.line_chart(title_history[["flesch_kincaid", "smog"]], y_label="Grade Level")
     else:
-        st.warning("No content versions available for the selected Title.")
+        st.info("No history has been calculated for the selected Title.")
 
 else:
     st.error("Failed to fetch Titles. Try again later.")
@@ -1,215 +1,754 @@
+import argparse
+import asyncio
+import hashlib
 import json
 import logging
+import multiprocessing
 import nltk
+import numpy as np
 import os
 import redis
-import threading
-import xml.etree.ElementTree as ET
-
-from bs4 import BeautifulSoup
-from concurrent.futures import ThreadPoolExecutor
-from readability import Readability
-from utils import ecfr
-
-# This is needed for readability.
-nltk.download('punkt_tab')
+import resource
+import socket
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from utils import (concurrency, coverage, custom_metrics, ecfr, ecfr_async, generations, hierarchy, rollup, scoring,
+                   search, snapshot, tracing, work_queue)
+from utils.agencies import covered_references, iter_agencies, reference_key
+from utils.cache import iter_file, xml_key, xml_store
+from utils.corrections import corrections_store, count_by_agency
+from utils.fingerprints import counts_store
 
 logging.basicConfig(
     level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - [Thread %(threadName)s] - %(message)s",
+    format="%(asctime)s - %(levelname)s - [%(processName)s %(threadName)s] - %(message)s",
 )
 
-MAX_CONCURRENT_CALCULATIONS = 1
+# Parsing and readability scoring are CPU-bound, so they run in a process pool sized to the machine.
+MAX_PROCESS_WORKERS = os.cpu_count()
 
-r = redis.Redis(
-    host=os.getenv("REDIS_URL"),
-    port=os.getenv("REDIS_PORT"),
-    password=os.getenv("REDIS_PASSWORD"),
-    ssl=True
+# Memory budget in bytes for the process pool: its workers, and the Titles they process at once (see `MemoryBudget`).
+# Half of the machine's physical memory by default.
+MEMORY_LIMIT = (
+    int(os.getenv("METRICS_MEMORY_LIMIT", 0)) or os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // 2
 )
+# Resident memory of a pool worker once it has imported this module, and the growth of its resident memory while it
+# processes a Title: a fixed part (search index runs and readability count batches) and a part proportional to the
+# size of the Title's XML (its hierarchy index). Measured on Titles of 2.4 to 49 MB of XML, whose processing grew the
+# worker by about 10 MB plus 1.5 times their size from 150 MB, and rounded up.
+WORKER_MEMORY = 160 * 1024 ** 2
+TITLE_MEMORY_BASE = 16 * 1024 ** 2
+TITLE_MEMORY_RATIO = 2
+
+# Watermarks (issue date, XML hash and reference metrics) of each processed Title, and the reference signature of
+# each aggregated Agency, used to recompute only what changed.
+TITLE_WATERMARKS_KEY = "metrics:title-watermarks"
+AGENCY_SIGNATURES_KEY = "metrics:agency-signatures"
+# Word and readability counts of every hierarchy node, per Title (see `utils.rollup`).
+NODE_METRICS_KEY = "metrics:nodes"
+
+# Bumped whenever the shape or meaning of reference metrics changes, so watermarks from older runs are recomputed.
+METRICS_VERSION = 5
+
+# Seconds between checks of the shared work queue, by the coordinator for progress and by idle workers for jobs.
+QUEUE_POLL_INTERVAL = 5
+# Search index segments built by queue workers on other machines, shipped to the coordinator's index through Redis.
+SEARCH_SEGMENT_KEY = "metrics:search-segment:{title}:{digest}"
+SEARCH_SEGMENT_TTL_SECONDS = 7 * 24 * 3600
+
+# Redis connection, and Title jobs of queued runs (see `run_title_queue`). Both are set by `connect`, on startup rather
+# than on import, because spawned process pool workers re-import this module.
+r = None
+title_queue = None
+
+
+def connect():
+    global r, title_queue
+    r = redis.Redis(
+        host=os.getenv("REDIS_URL"),
+        port=os.getenv("REDIS_PORT"),
+        password=os.getenv("REDIS_PASSWORD"),
+        ssl=True
+    )
+    title_queue = work_queue.WorkQueue(r, "metrics")
+
+
+def calculate_agency_metrics(workers=MAX_PROCESS_WORKERS, full=False, queue=False):
+    """
+    Calculates Agency metrics, recomputing only Titles reissued since the previous run unless `full` is set.
+
+    Each processed Title's issue date, XML content hash and reference metrics are persisted as its watermark. Titles
+    whose issue date is unchanged are skipped, and reissued Titles with identical content reuse their metrics; only
+    Agencies referencing a recomputed Title (or whose references changed) are re-aggregated.
+
+    Results are written to a new metrics generation (see `utils.generations`), carrying over unaffected Agencies from
+    the current one, along with a columnar snapshot for the web application (see `utils.snapshot`). The generation is
+    published atomically with the updated watermarks once the run completes. Correction counts per Agency are part of
+    the snapshot and recomputed every run, so a new generation is also written when only they changed.
+
+    Every stage is traced (see `utils.tracing`), and a report of the run is saved to Redis for the Runs page.
+
+    With `queue`, Titles are processed through the shared work queue instead (see `run_title_queue`), so workers on
+    other machines can help and an interrupted run resumes where it stopped.
+    """
+    started = time.time()
+    tracer = tracing.Tracer()
 
-
-def calculate_agency_metrics():
     agencies_data = ecfr.fetch_agencies()
     if not agencies_data:
         logging.error("No Agency data found.")
         return
-    agencies = agencies_data["agencies"]
+    # Child Agencies are measured too, and parents cover their children's references.
+    agencies = list(iter_agencies(agencies_data["agencies"]))
+
+    titles_data = ecfr.fetch_titles()
+    if not titles_data:
+        logging.error("No Title data found.")
+        return
+    latest_issue_dates = {t["number"]: t["latest_issue_date"] for t in titles_data}
+
+    if full:
+        logging.info("Recomputing all Agency metrics...")
+        r.delete(NODE_METRICS_KEY)
+    previous_generation = None if full else generations.current_generation(r)
 
-    logging.info("Resetting Agency metrics...")
+    # Every title is parsed once, no matter how many agencies reference it.
+    references_by_title = {}
     for agency in agencies:
-        r.delete(agency["slug"])
+        for reference in agency["cfr_references"]:
+            references_by_title.setdefault(reference["title"], {})[reference_key(reference)] = reference
+
+    watermarks = {} if full else load_title_watermarks()
+    stale_titles = {
+        title: references
+        for title, references in references_by_title.items()
+        if title not in watermarks
+        or watermarks[title].get("version") != METRICS_VERSION
+        or watermarks[title]["latest_issue_date"] != latest_issue_dates[title]
+        or not references.keys() <= watermarks[title]["references"].keys()
+        # The search index is kept on local disk, so it is rebuilt on a machine that does not have it yet.
+        or search.search_index.current(title) != watermarks[title]["digest"]
+    }
+
+    tracer.cache("title_issue_dates", hit=True, count=len(references_by_title) - len(stale_titles))
+    tracer.cache("title_issue_dates", hit=False, count=len(stale_titles))
 
     logging.info("Starting word count calculation...")
-    logging.info(f"Total agencies to process: {len(agencies)}")
+    logging.info(f"Total titles to process: {len(stale_titles)} of {len(references_by_title)}")
+
+    changed_titles = set()
+    updated_watermarks = {}
+    if queue:
+        updated_watermarks = run_title_queue(
+            {title: list(references.values()) for title, references in stale_titles.items()},
+            latest_issue_dates,
+            watermarks,
+            workers,
+            tracer,
+            restart=full,
+        )
+    elif stale_titles:
+        updated_watermarks = asyncio.run(
+            process_titles(
+                {title: list(references.values()) for title, references in stale_titles.items()},
+                latest_issue_dates,
+                watermarks,
+                workers,
+                tracer,
+            )
+        )
+    for title, watermark in updated_watermarks.items():
+        previous = watermarks.get(title)
+        if previous is None or previous["digest"] != watermark["digest"] or previous["references"] != watermark[
+                "references"]:
+            changed_titles.add(title)
+        watermarks[title] = watermark
+
+    failed_titles = stale_titles.keys() - updated_watermarks.keys()
+    if failed_titles:
+        logging.warning(f"Failed to process titles {sorted(failed_titles)}; they are retried on the next run")
+
+    reference_metrics = {}
+    for watermark in watermarks.values():
+        reference_metrics.update(watermark["references"])
+    # Titles that failed keep their previous watermark, if any, so the next run retries them. Their references without
+    # metrics are measured as empty until then, like references not found in their Title.
+    for references in references_by_title.values():
+        for key, reference in references.items():
+            if key not in reference_metrics:
+                reference_metrics[key] = reference_result(
+                    reference, None, 0, scoring.TextCounts(), {}, scoring.score(scoring.TextCounts())
+                )
+
+    signatures = {} if full else {k.decode(): v.decode() for k, v in r.hgetall(AGENCY_SIGNATURES_KEY).items()}
+    affected_agencies = [
+        agency for agency in agencies
+        if signatures.get(agency["slug"]) != agency_signature(agency)
+        or any(reference["title"] in changed_titles for reference in covered_references(agency))
+    ]
+
+    logging.info(f"Total agencies to process: {len(affected_agencies)} of {len(agencies)}")
+    results = dict(process_agency(agency, reference_metrics, tracer) for agency in affected_agencies)
+
+    state = {
+        TITLE_WATERMARKS_KEY: {str(title): json.dumps(watermark) for title, watermark in updated_watermarks.items()},
+        AGENCY_SIGNATURES_KEY: {agency["slug"]: agency_signature(agency) for agency in affected_agencies},
+    }
+    previous_tables = generations.read_snapshot(r, previous_generation)
+    slugs = {agency["slug"] for agency in agencies}
+    metrics = {
+        slug: json.loads(value) for slug, value in generations.read_all_agencies(r, previous_generation).items()
+        if slug in slugs
+    }
+    metrics.update(results)
+    # Corrections change independently of Titles, so their counts are recomputed on every run.
+    corrections_table = snapshot.encode(
+        {"corrections": snapshot.build_corrections_table(count_agency_corrections(metrics, tracer))}
+    )["corrections"]
+
+    if results or previous_tables is None or previous_tables.get("corrections") != corrections_table:
+        generation = generations.new_generation()
+        with tracer.span("store", elements=len(metrics)) as span:
+            serialized = {slug: json.dumps(result) for slug, result in metrics.items()}
+            generations.write_agencies(r, generation, serialized)
+            tables = {**snapshot.encode(snapshot.build_tables(metrics)), "corrections": corrections_table}
+            generations.write_snapshot(r, generation, tables)
+            span["bytes"] = sum(map(len, serialized.values())) + sum(map(len, tables.values()))
+        logging.info(f"Publishing metrics generation {generation} ({len(metrics)} agencies)")
+    else:
+        generation = previous_generation
+    generations.publish(r, generation, state, replace_state=full)
+    if queue:
+        # The queued run is only dropped once its results are published, so a crash before this point resumes it.
+        title_queue.clear()
 
-    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_CALCULATIONS) as executor:
-        results = list(executor.map(process_agency, agencies))  # Ensure results are fully consumed
+    expired = generations.collect_garbage(r)
+    if expired:
+        logging.info(f"Deleted expired metrics generations: {', '.join(expired)}")
 
     logging.info("Word count calculation completed.")
-    return dict(results)
-
-
-semaphore = threading.Semaphore(MAX_CONCURRENT_CALCULATIONS)
-titles_data = ecfr.fetch_titles()
+    http_stats = ecfr.client.stats()
+    for endpoint, stats in http_stats.items():
+        logging.info(f"eCFR {endpoint}: {stats}")
+    concurrency_stats = concurrency.stats()
+    for family, stats in concurrency_stats.items():
+        logging.info(f"eCFR {family} concurrency: window {stats['window']} (peak {stats['peak']}), "
+                     f"{stats['throttled']} throttled responses")
+
+    report = tracing.build_report(
+        tracer, started, time.time(),
+        generation=generation,
+        titles={"total": len(references_by_title), "processed": len(stale_titles)},
+        agencies={"total": len(agencies), "processed": len(affected_agencies)},
+        http=http_stats,
+        concurrency=concurrency_stats,
+    )
+    tracing.save_report(r, report)
+    for stage, stats in report["stages"].items():
+        logging.info(
+            f"Stage {stage}: {stats['count']} spans, p50 {stats['p50_seconds']:.3f}s, p95 {stats['p95_seconds']:.3f}s"
+        )
+    return {slug: result["total_word_count"] for slug, result in results.items()}
 
 
-def process_agency(agency):
-    with semaphore:  # Ensures only `MAX_CONCURRENT_CALCULATIONS` run at a time
-        logging.info(f"🚀 Starting processing: {agency['name']}")
-        total_word_count = 0
-        total_weighted_flesch_kincaid = 0
-        total_weighted_flesch_reading_ease = 0
-        total_weighted_smog = 0
-        references = []
+def count_agency_corrections(metrics, tracer):
+    """
+    Daily correction counts of each Agency (see `corrections.count_by_agency`), from the synced Corrections and the
+    node tables of every Title.
+    """
+    with tracer.span("corrections") as span:
+        if corrections_store.sync() is None:
+            logging.warning("Failed to sync Corrections; counting previously synced Corrections")
+        corrections = corrections_store.corrections()
+        index = coverage.HierarchyIndex({
+            int(title): rollup.decode_node_paths(data) for title, data in r.hgetall(NODE_METRICS_KEY).items()
+        })
+        agency_paths = {slug: list(agency.get("nodes", {})) for slug, agency in metrics.items()}
+        counts = count_by_agency(corrections, index, agency_paths)
+        span["elements"] = len(corrections)
+    logging.info(f"Counted {counts['count'].sum()} Agency corrections of {len(corrections)} Corrections")
+    return counts
 
-        for reference in agency["cfr_references"]:
-            latest_issue_date = {t["number"]: t["latest_issue_date"] for t in titles_data}[reference["title"]]
-            reference_data = process_reference(latest_issue_date, reference)
-
-            word_count = reference_data["word_count"]
-            flesch_kincaid = reference_data.get("flesch_kincaid")
-            flesch_reading_ease = reference_data.get("flesch_reading_ease")
-            smog = reference_data.get("smog")
-
-            total_word_count += word_count
-            references.append(reference_data)
-
-            if flesch_kincaid is not None:
-                total_weighted_flesch_kincaid += flesch_kincaid * word_count
-            if flesch_reading_ease is not None:
-                total_weighted_flesch_reading_ease += flesch_reading_ease * word_count
-            if smog is not None:
-                total_weighted_smog += smog * word_count
-
-        agency_word_count = total_word_count
-        agency_flesch_kincaid = (
-            total_weighted_flesch_kincaid / total_word_count if total_word_count > 0 else None
-        )
-        agency_flesch_reading_ease = (
-            total_weighted_flesch_reading_ease / total_word_count if total_word_count > 0 else None
-        )
-        agency_smog = (
-            total_weighted_smog / total_word_count if total_word_count > 0 else None
-        )
 
-        logging.info(f"✅ Completed: {agency['name']}")
+def load_title_watermarks():
+    return {int(title): json.loads(watermark) for title, watermark in r.hgetall(TITLE_WATERMARKS_KEY).items()}
 
-        result = {
-            "total_word_count": agency_word_count,
-            "average_flesch_kincaid": agency_flesch_kincaid,
-            "average_flesch_reading_ease": agency_flesch_reading_ease,
-            "average_smog": agency_smog,
-            "references": references,
-        }
 
-        r.set(agency["slug"], json.dumps(result))
-        return agency["slug"], agency_word_count
+def agency_signature(agency):
+    return hashlib.sha256(
+        json.dumps(sorted(reference_key(reference) for reference in covered_references(agency))).encode("utf-8")
+    ).hexdigest()
 
 
-def process_reference(date, reference):
-    title_number = reference["title"]
-    subtitle = reference.get("subtitle", None)
-    chapter = reference.get("chapter", None)
-    subchapter = reference.get("subchapter", None)
-    part = reference.get("part", None)
+def run_daemon(interval, workers=MAX_PROCESS_WORKERS, queue=False):
+    """Polls for reissued Titles every `interval` seconds and recomputes what changed."""
+    while True:
+        try:
+            calculate_agency_metrics(workers=workers, queue=queue)
+        except Exception:
+            logging.exception("Incremental Agency metrics run failed.")
+        logging.info(f"Next check in {interval} seconds.")
+        time.sleep(interval)
+
+
+def title_job(title, date, references, previous):
+    """
+    The queued job for a Title. `previous_digest` lets the worker skip Titles whose content did not change, provided
+    the coordinator's search index is already built from it (`indexed`), since workers may run on other machines.
+    """
+    reusable = (
+        previous is not None and previous.get("version") == METRICS_VERSION
+        and all(reference_key(reference) in previous["references"] for reference in references)
+    )
+    return {
+        "title": title, "date": date, "references": references,
+        "previous_digest": previous["digest"] if reusable else None,
+        "indexed": reusable and search.search_index.current(title) == previous["digest"],
+    }
 
-    # Fetch XML for the given title and parameters
-    title_xml = ecfr.fetch_xml_for_title(date, title_number, subtitle=subtitle, chapter=chapter, subchapter=subchapter,
-                                         part=part)
 
-    if part is not None:
-        reference_xml = title_xml
+def job_inputs(job):
+    """
+    What the result of a Title job depends on. Whether the coordinator's index was built is left out: it changes as the
+    coordinator's local workers complete jobs, and a result obtained either way is valid.
+    """
+    return {name: value for name, value in job.items() if name != "indexed"}
+
+
+def run_title_queue(references_by_title, latest_issue_dates, watermarks, workers, tracer, restart=False):
+    """
+    Processes Titles through the shared work queue (see `utils.work_queue`) and returns the new watermark of each.
+
+    One job is queued per Title, unless an interrupted run is still in the queue (and `restart` is not set), in which
+    case that run is resumed with the results it already checkpointed. If Titles were reissued or references changed
+    since the interrupted run was queued, it is queued again with the current jobs, keeping only the results of jobs
+    that are unchanged. Jobs are worked by `workers` local processes, restarted if they die, and by `--worker`
+    processes on any other machine; jobs whose lease expires are requeued. Search index segments built on other
+    machines are installed into the local index once the run is done.
+    """
+    jobs = {
+        str(title): title_job(title, latest_issue_dates[title], references, watermarks.get(title))
+        for title, references in references_by_title.items()
+    }
+    run = None if restart else title_queue.active()
+    if run is None:
+        run = title_queue.start(jobs)
+        logging.info(f"Queued metrics run {run['id']} ({run['total']} titles)")
     else:
-        ancestry_data = ecfr.fetch_ancestry_for_title(date, title_number, subtitle, chapter, subchapter, part, None)
-        extracted_reference = extract_from_xml(ET.fromstring(title_xml), ancestry_data['ancestors'])
-        reference_xml = ET.tostring(extracted_reference, encoding="unicode", method="xml")
-
-    # Convert XML to BeautifulSoup object for text extraction
-    soup = BeautifulSoup(reference_xml, "xml")
-    p_texts = [p.get_text(strip=True) for p in soup.find_all("P")]
-
-    # Extract raw text from XML
-    reference_content = ET.tostring(ET.fromstring(reference_xml), encoding="unicode", method="text")
-    word_count = sum(len(text.split()) for text in p_texts)
+        queued = title_queue.jobs()
+        unchanged = {
+            job_id for job_id, job in jobs.items() if job_id in queued and job_inputs(queued[job_id]) == job_inputs(job)
+        }
+        if unchanged == jobs.keys() == queued.keys():
+            logging.info(f"Resuming metrics run {run['id']} ({title_queue.progress()['completed']} of {run['total']} "
+                         f"titles completed)")
+        else:
+            results = {job_id: result for job_id, result in title_queue.results().items() if job_id in unchanged}
+            run = title_queue.start(jobs, results=results)
+            logging.info(f"Titles changed since the interrupted metrics run was queued; queued metrics run {run['id']} "
+                         f"({run['total']} titles, {len(results)} completed by the interrupted run)")
+
+    context = multiprocessing.get_context("spawn")
+    processes = {}
+    while not title_queue.done():
+        for i in range(workers):
+            if i not in processes or not processes[i].is_alive():
+                if i in processes:
+                    logging.warning(f"Restarting queue worker {i} (exit code {processes[i].exitcode})")
+                processes[i] = context.Process(
+                    target=run_worker, args=(f"{socket.gethostname()}-{os.getpid()}-{i}",), daemon=True
+                )
+                processes[i].start()
+
+        requeued = title_queue.requeue_expired()
+        if requeued:
+            logging.warning(f"Requeued titles with expired leases: {', '.join(requeued)}")
+        logging.info(f"Queued metrics run {run['id']}: {title_queue.progress()}")
+        time.sleep(QUEUE_POLL_INTERVAL)
+    for process in processes.values():
+        process.join()
+
+    for job_id, error in title_queue.failures().items():
+        logging.error(f"Title {job_id} failed: {error}")
+
+    jobs = title_queue.jobs()
+    updated_watermarks = {}
+    for job_id, result in title_queue.results().items():
+        job, result = jobs[job_id], json.loads(result)
+        title = job["title"]
+        tracer.extend(result["spans"])
+        record_segment_counts(tracer, result["spans"])
+        tracer.cache("xml_store", hit=result["xml_cached"])
+        tracer.cache("title_content", hit=result["references"] is None)
+        updated_watermarks[title] = {
+            "version": METRICS_VERSION,
+            "latest_issue_date": job["date"],
+            "digest": result["digest"],
+            "references": result["references"] if result["references"] is not None else watermarks[title]["references"],
+        }
+    install_search_segments({title: watermark["digest"] for title, watermark in updated_watermarks.items()})
+    return updated_watermarks
+
+
+def ship_search_segment(title, digest):
+    """Copies a Title's search index segment to Redis, for a coordinator on another machine to install."""
+    files = search.read_title_segment(title, digest, search.search_index.directory)
+    if files is None:
+        logging.warning(f"No search index segment of Title {title} to ship")
+        return 0
+    key = SEARCH_SEGMENT_KEY.format(title=title, digest=digest)
+    with r.pipeline() as pipe:
+        pipe.hset(key, mapping=files)
+        pipe.expire(key, SEARCH_SEGMENT_TTL_SECONDS)
+        pipe.execute()
+    return sum(map(len, files.values()))
+
+
+def install_search_segments(digests):
+    """Installs the segments shipped by remote workers (see `ship_search_segment`) that the local index lacks."""
+    for title, digest in digests.items():
+        key = SEARCH_SEGMENT_KEY.format(title=title, digest=digest)
+        if search.search_index.current(title) != digest:
+            files = {name.decode(): content for name, content in r.hgetall(key).items()}
+            if files.keys() >= set(search.SEGMENT_FILES):
+                search.install_title_segment(title, digest, files, search.search_index.directory)
+            else:
+                logging.warning(f"No search index segment of Title {title} was shipped; it is rebuilt on the next run")
+        r.delete(key)
+
+
+def run_worker(worker, ship_segments=False):
+    """
+    Works jobs of the queued metrics run, renewing each job's lease while it runs, until the run is done.
+
+    Workers that do not share the coordinator's disk `ship_segments` of the search index through Redis.
+    """
+    if r is None:
+        # Spawned worker processes import this module without connecting.
+        connect()
+    logging.info(f"Queue worker {worker} started")
+    while True:
+        claimed = title_queue.claim(worker)
+        if claimed is None:
+            if title_queue.active() is None or title_queue.done():
+                logging.info(f"Queue worker {worker} finished")
+                return
+            # Jobs leased by other workers may still be requeued.
+            time.sleep(QUEUE_POLL_INTERVAL)
+            continue
+
+        job_id, job = claimed
+        try:
+            with title_queue.lease(job_id, worker):
+                result = process_title_job(job, ship_segments)
+        except Exception as error:
+            logging.exception(f"Failed to process Title {job['title']}")
+            title_queue.fail(job_id, worker, repr(error))
+            continue
+        title_queue.complete(job_id, worker, json.dumps(result))
+
+
+def process_title_job(job, ship_segments=False):
+    """
+    Processes a queued Title: fetches its XML into the local store and measures it, unless its content is unchanged
+    and the coordinator's search index is built from it. With `ship_segments`, the Title's new search index segment
+    is copied to Redis for the coordinator.
+
+    Returns the XML digest, the reference metrics (None if unchanged) and the spans of its stages.
+    """
+    title, date = job["title"], job["date"]
+    tracer = tracing.Tracer()
+    with tracer.span("fetch", title=title) as span:
+        digest = xml_store.digest(xml_key(date, title))
+        cached = digest is not None
+        if digest is None:
+            digest = ecfr.download_xml(date, title)
+            if digest is None:
+                raise RuntimeError(f"No XML available for Title {title} on {date}")
+            span["bytes"] = xml_store.raw_size(xml_key(date, title))
+
+    if digest == job["previous_digest"] and job.get("indexed"):
+        logging.info(f"⏭️ Title {title} reissued on {date} with unchanged content")
+        return {"digest": digest, "references": None, "xml_cached": cached, "spans": tracer.spans}
+
+    metrics, node_table, spans = process_title(date, title, job["references"])
+    tracer.extend(spans)
+    with tracer.span("store", title=title, bytes=len(node_table), elements=1):
+        r.hset(NODE_METRICS_KEY, str(title), node_table)
+    if ship_segments:
+        with tracer.span("store", title=title, elements=1) as span:
+            span["bytes"] = ship_search_segment(title, digest)
+    return {"digest": digest, "references": metrics, "xml_cached": cached, "spans": tracer.spans}
+
+
+class MemoryBudget:
+    """Admits work while the sum of its estimated memory fits within `limit` bytes."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.reserved = 0
+        self._condition = asyncio.Condition()
+
+    def fits(self, amount):
+        """Whether work of `amount` bytes can ever be admitted."""
+        return amount <= self.limit
+
+    @asynccontextmanager
+    async def reserve(self, amount):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.reserved + amount <= self.limit)
+            self.reserved += amount
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self.reserved -= amount
+                self._condition.notify_all()
+
+
+def title_memory(size):
+    """Estimated memory in bytes needed to process a Title of `size` bytes of XML."""
+    return TITLE_MEMORY_BASE + size * TITLE_MEMORY_RATIO
+
+
+async def process_titles(references_by_title, latest_issue_dates, watermarks, workers, tracer):
+    """
+    Pipelines title processing: XML downloads run concurrently on the event loop, and each title is handed to the
+    process pool for parsing and scoring as soon as its XML is in the local store.
+
+    Returns the new watermark for each title and stores each parsed title's node metrics. A title whose XML hash
+    matches its previous watermark (and whose search index is built from that XML) is not reparsed. Spans of every
+    stage, including those recorded in the process pool, are added to `tracer`.
+    """
+    loop = asyncio.get_running_loop()
+    updated_watermarks = {}
+    # Each worker needs room for itself and at least a small Title.
+    fitting = max(1, MEMORY_LIMIT // (WORKER_MEMORY + title_memory(0)))
+    if workers > fitting:
+        logging.warning(f"Using {fitting} of {workers} workers to stay within the memory limit of {MEMORY_LIMIT} bytes")
+        workers = fitting
+    budget = MemoryBudget(MEMORY_LIMIT - workers * WORKER_MEMORY)
+
+    async def process(client, pool, title, references):
+        date = latest_issue_dates[title]
+        with tracer.span("fetch", title=title) as span:
+            digest = await asyncio.to_thread(xml_store.digest, xml_key(date, title))
+            tracer.cache("xml_store", hit=digest is not None)
+            if digest is None:
+                digest = await client.download_xml(date, title)
+                if digest is None:
+                    logging.warning(f"Failed to prefetch XML for Title {title} on {date}")
+                    return
+                span["bytes"] = await asyncio.to_thread(xml_store.raw_size, xml_key(date, title))
+
+        previous = watermarks.get(title)
+        unchanged = (
+            previous is not None and previous.get("version") == METRICS_VERSION and previous["digest"] == digest
+            and all(reference_key(reference) in previous["references"] for reference in references)
+            and search.search_index.current(title) == digest
+        )
+        tracer.cache("title_content", hit=unchanged)
+        if unchanged:
+            logging.info(f"⏭️ Title {title} reissued on {date} with unchanged content")
+            metrics = previous["references"]
+        else:
+            # Titles are admitted to the pool while their estimated memory fits the budget. A Title that could never
+            # fit is skipped, and tried again by the next run.
+            size = await asyncio.to_thread(xml_store.raw_size, xml_key(date, title))
+            memory = title_memory(size or 0)
+            if not budget.fits(memory):
+                logging.error(f"Skipping Title {title}: processing it needs about {memory} bytes, more than the "
+                              f"{budget.limit} bytes of the memory limit left to Titles")
+                return
+            async with budget.reserve(memory):
+                metrics, node_table, spans = await loop.run_in_executor(pool, process_title, date, title, references)
+            tracer.extend(spans)
+            record_segment_counts(tracer, spans)
+            with tracer.span("store", title=title, bytes=len(node_table), elements=1):
+                await asyncio.to_thread(r.hset, NODE_METRICS_KEY, str(title), node_table)
+
+        updated_watermarks[title] = {
+            "version": METRICS_VERSION, "latest_issue_date": date, "digest": digest, "references": metrics,
+        }
 
-    # Compute readability scores only if there is enough content
-    flesch_kincaid_score = None
-    flesch_reading_ease = None
-    smog_score = None
+    # Workers are spawned rather than forked: forking while I/O threads hold XML store connections is unsafe.
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        async with ecfr_async.AsyncECFRClient() as client:
+            async with asyncio.TaskGroup() as group:
+                for title, references in references_by_title.items():
+                    group.create_task(process(client, pool, title, references))
+
+    return updated_watermarks
+
+
+def process_title(date, title, references):
+    """
+    Parses a title once, computes metrics for each of the given references into it and rebuilds its search index
+    segment (see `utils.search`).
+
+    Returns the reference metrics, the title's encoded node table (see `utils.rollup`) and the spans of its stages.
+    """
+    logging.info(f"🚀 Starting processing: Title {title}")
+    tracer = tracing.Tracer()
+
+    # The XML is streamed from the local store into the parser, and the text of its sections into the search index
+    # segment, so neither is ever held in memory as a whole.
+    start = time.perf_counter()
+    with ecfr.open_xml_for_title(date, title) as title_xml, search.SegmentWriter(title, date) as segment:
+        index = (
+            hierarchy.build_title_index(iter_file(title_xml), title, date, counts_store, segment)
+            if title_xml is not None else None
+        )
+        size = title_xml.tell() if title_xml is not None else 0
+
+        if index is None:
+            logging.error(f"Skipping Title {title}: no XML available for {date}")
+            node_table = rollup.encode_node_table(hierarchy.TitleIndex(title, date).node_table())
+        else:
+            # Readability tokenization happens during the parse, so it is timed there and reported separately.
+            tracer.record(
+                "parse", time.perf_counter() - start - index.tokenize_seconds, bytes=size, elements=len(index.nodes),
+                title=title, peak_rss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            )
+            tracer.record(
+                "tokenize", index.tokenize_seconds, bytes=index.tokenized_chars,
+                elements=sum(node.counts.words for node in index.nodes if node.parent is None), title=title,
+                segments=index.segments, cached_segments=index.cached_segments,
+            )
+            node_table = rollup.encode_node_table(index.node_table())
+            try:
+                with tracer.span("store", title=title, elements=len(index.nodes)):
+                    segment.publish(xml_store.digest(xml_key(date, title)))
+            except OSError as error:
+                logging.error(f"Failed to index Title {title} for search: {error}")
+
+    measured = [process_reference(index, reference, tracer) for reference in references]
+    with tracer.span("score", title=title, elements=len(measured)):
+        scores = scoring.score_batch([counts for _, _, counts, _ in measured])
+
+    results = {}
+    for i, (reference, (node, word_count, counts, metric_counts)) in enumerate(zip(references, measured)):
+        results[reference_key(reference)] = reference_result(
+            reference, node, word_count, counts, metric_counts,
+            {name: None if np.isnan(values[i]) else float(values[i]) for name, values in scores.items()},
+        )
 
-    if len(reference_content.split()) > 100:
-        r = Readability(reference_content)
-        flesch_kincaid_score = r.flesch_kincaid().score
-        flesch_reading_ease = r.flesch().score
+    logging.info(f"✅ Completed: Title {title} ({len(references)} references)")
+    return results, node_table, tracer.spans
 
-        try:
-            smog_score = r.smog().score
-        except Exception as e:
-            # Handle SMOG exception for texts with fewer than 30 sentences
-            # TODO: Improve robustness.
-            logging.warning(f"Skipping SMOG score for reference {reference} due to insufficient sentences: {e}")
-            smog_score = None
 
+def reference_result(reference, node, word_count, counts, metric_counts, scores):
+    """The metrics of a reference, from its node path, word count, readability and metric counts, and scores."""
     return {
         "reference": reference,
+        "node": node,
         "word_count": word_count,
-        "flesch_kincaid": flesch_kincaid_score,
-        "flesch_reading_ease": flesch_reading_ease,
-        "smog": smog_score
+        "sentence_count": counts.sentences,
+        **scores,
+        **custom_metrics.values(metric_counts, counts),
+        "counts": counts.to_dict(),
+        "metric_counts": metric_counts,
     }
 
 
-def extract_from_xml(root, ancestry_data):
-    """Parses CFR XML and extracts only the requested section using ancestry data."""
-
-    # Extract identifiers from ancestry data
-    hierarchy = {item["type"]: item["identifier"] for item in ancestry_data}
-
-    # Start at the Title level
-    title_elem = root.find(f".//DIV1[@TYPE='TITLE'][@N='{hierarchy.get('title')}']")
-    if title_elem is None:
-        return None
-
-    # Check Subtitle (if applicable)
-    if "subtitle" in hierarchy:
-        subtitle_elem = title_elem.find(f".//DIV2[@TYPE='SUBTITLE'][@N='{hierarchy['subtitle']}']")
-        if subtitle_elem is None:
-            return None
-    else:
-        subtitle_elem = title_elem
-
-    # Check Chapter (if applicable)
-    if "chapter" in hierarchy:
-        chapter_elem = subtitle_elem.find(f".//DIV3[@TYPE='CHAPTER'][@N='{hierarchy['chapter']}']")
-        if chapter_elem is None:
-            return None
-    else:
-        chapter_elem = subtitle_elem
-
-    # Check Subchapter (if applicable)
-    if "subchapter" in hierarchy:
-        subchapter_elem = chapter_elem.find(f".//DIV4[@TYPE='SUBCHAP'][@N='{hierarchy['subchapter']}']")
-        if subchapter_elem is None:
-            return None
-    else:
-        subchapter_elem = chapter_elem
+def record_segment_counts(tracer, spans):
+    """Counts text segments of processed titles whose readability counts were memoized (see `utils.fingerprints`)."""
+    for span in spans:
+        if span["stage"] == "tokenize":
+            tracer.cache("segment_counts", hit=True, count=span["cached_segments"])
+            tracer.cache("segment_counts", hit=False, count=span["segments"] - span["cached_segments"])
+
+
+def process_agency(agency, reference_metrics, tracer):
+    """
+    Aggregates an Agency from the distinct hierarchy nodes covered by its references and its children's references.
+
+    Nodes nested within another covered node are counted once, and readability and the custom metrics (see
+    `utils.custom_metrics`) are computed from the summed counts.
+    """
+    references = [reference_metrics[reference_key(reference)] for reference in agency["cfr_references"]]
+
+    covered = {}
+    for reference in covered_references(agency):
+        reference_data = reference_metrics[reference_key(reference)]
+        if reference_data["node"] is not None:
+            covered[reference_data["node"]] = {
+                "word_count": reference_data["word_count"], "counts": reference_data["counts"],
+                "metrics": reference_data["metric_counts"],
+            }
+    with tracer.span("score", agency=agency["slug"]) as span:
+        nodes = {path: covered[path] for path in rollup.distinct_nodes(covered)}
+        total_word_count, total_counts, metric_counts = rollup.rollup(nodes)
+        scores = scoring.score(total_counts)
+        span["elements"] = len(nodes)
+    result = {
+        "total_word_count": total_word_count,
+        "average_flesch_kincaid": scores["flesch_kincaid"],
+        "average_flesch_reading_ease": scores["flesch_reading_ease"],
+        "average_smog": scores["smog"],
+        **custom_metrics.values(metric_counts, total_counts),
+        "counts": total_counts.to_dict(),
+        "metric_counts": metric_counts,
+        "nodes": nodes,
+        "references": references,
+    }
 
-    # Check Part (if applicable)
-    if "part" in hierarchy:
-        part_elem = subchapter_elem.find(f".//DIV5[@TYPE='PART'][@N='{hierarchy['part']}']")
-        if part_elem is None:
-            return None
-    else:
-        part_elem = subchapter_elem
+    logging.info(f"✅ Completed: {agency['name']}")
+    return agency["slug"], result
 
-    # Check Section (final level)
-    if "section" in hierarchy:
-        section_elem = part_elem.find(f".//DIV8[@TYPE='SECTION'][@N='{hierarchy['section']}']")
-        return section_elem if section_elem is not None else None
 
-    return part_elem
+def process_reference(index, reference, tracer):
+    """
+    Looks up a reference's node in the title index and returns its path, `<P>` word count, readability counts and
+    metric counts.
+    """
+    with tracer.span("extract", title=reference["title"], reference=reference_key(reference)) as span:
+        node = index.find(reference) if index is not None else None
+        if node is None:
+            logging.warning(f"Reference {reference} not found in title index")
+            return None, 0, scoring.TextCounts(), {}
+        span["elements"] = node.word_count
+        return index.path_key(node), node.word_count, node.counts, dict(node.metrics)
 
 
 if __name__ == "__main__":
-    calculate_agency_metrics()
+    parser = argparse.ArgumentParser(description="Calculate metrics for all Agencies and persist them to Redis.")
+    parser.add_argument(
+        "--workers", type=int, default=MAX_PROCESS_WORKERS, help="Processes used for parsing and scoring Titles."
+    )
+    parser.add_argument("--full", action="store_true", help="Recompute all Titles instead of only reissued ones.")
+    parser.add_argument(
+        "--daemon", type=int, metavar="SECONDS", help="Keep running, checking for reissued Titles every SECONDS."
+    )
+    parser.add_argument(
+        "--queue", action="store_true", help="Process Titles through the shared Redis work queue, resuming any "
+                                             "interrupted queued run.",
+    )
+    parser.add_argument(
+        "--worker", action="store_true", help="Only work jobs of the queued run in progress, then exit.",
+    )
+    args = parser.parse_args()
+
+    # This is needed for sentence tokenization, and downloaded once here so that pool and queue workers reuse it.
+    nltk.download('punkt_tab')
+    connect()
+
+    if args.worker:
+        processes = [
+            multiprocessing.get_context("spawn").Process(
+                target=run_worker, args=(f"{socket.gethostname()}-{os.getpid()}-{i}", True)
+            )
+            for i in range(args.workers)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+    elif args.daemon:
+        if args.full:
+            calculate_agency_metrics(workers=args.workers, full=True, queue=args.queue)
+        run_daemon(args.daemon, workers=args.workers, queue=args.queue)
+    else:
+        calculate_agency_metrics(workers=args.workers, full=args.full, queue=args.queue)
@@ -0,0 +1,281 @@
+import argparse
+import asyncio
+import logging
+import nltk
+import os
+import redis
+
+from utils import ecfr, ecfr_async, fetch_plan, hierarchy, history
+from utils.agencies import covered_references, iter_agencies, reference_covers
+from utils.cache import iter_file, xml_key, xml_store
+from utils.fingerprints import counts_store
+
+# This is needed for sentence tokenization.
+nltk.download('punkt_tab')
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - [%(processName)s %(threadName)s] - %(message)s",
+)
+
+# Per-section counts as of the last processed issue date, so later runs only apply newer changes.
+HISTORY_STATE_KEY = "history:state:title-{title}"
+
+CONTENT_TYPES = {"section", "appendix"}
+CHECKPOINT_INTERVAL = 25
+
+r = redis.Redis(
+    host=os.getenv("REDIS_URL"),
+    port=os.getenv("REDIS_PORT"),
+    password=os.getenv("REDIS_PASSWORD"),
+    ssl=True
+)
+
+
+def calculate_title_history(titles=None, full=False):
+    """
+    Builds word count and readability time series for Titles and Agencies across all historical issue dates.
+
+    Each Title is measured in full once, at its first issue date. For every later issue date only the sections and
+    appendices listed as changed in the Title's content versions are fetched and re-scored, and their difference is
+    applied to the previous snapshot's per-section counts. Totals therefore cover section and appendix text only, not
+    headings of the Title's higher levels.
+    """
+    agencies_data = ecfr.fetch_agencies()
+    if not agencies_data:
+        logging.error("No Agency data found.")
+        return
+    agencies = list(iter_agencies(agencies_data["agencies"]))
+
+    if titles is None:
+        titles_data = ecfr.fetch_titles()
+        if not titles_data:
+            logging.error("No Title data found.")
+            return
+        titles = [t["number"] for t in titles_data if not t.get("reserved")]
+
+    for title in titles:
+        if full:
+            r.delete(history.HISTORY_KEY.format(title=title), HISTORY_STATE_KEY.format(title=title))
+        asyncio.run(process_title_history(title, agencies))
+
+
+def entry(path, node):
+    return [path, node.word_count, *node.counts.to_dict().values()]
+
+
+def index_stored_title(date, title):
+    """Builds a title's index by streaming its XML from the local XML store, or returns None if it is not stored."""
+    with xml_store.open(xml_key(date, title)) as f:
+        return hierarchy.build_title_index(iter_file(f), title, date, counts_store) if f is not None else None
+
+
+async def seed_title_history(client, title, date):
+    """Measures every section and appendix of a Title on its first issue date."""
+    if not await client.prefetch_xml(date, title):
+        return None
+    index = await asyncio.to_thread(index_stored_title, date, title)
+    if index is None:
+        return None
+
+    state = {"date": date, "parts": {}, "sections": {}}
+    for node in index.nodes:
+        if node.type == "part":
+            state["parts"][node.identifier] = index.path_key(node)
+        elif node.type in CONTENT_TYPES:
+            state["sections"][node.identifier] = entry(index.path_key(node), node)
+    return state
+
+
+async def measure_changes(client, title, date, versions, parts, sizes):
+    """
+    Re-measures changed sections and appendices on an issue date.
+
+    The changed sections are downloaded whole, by part or one by one, whichever moves the fewest bytes per their
+    `sizes` (see `utils.fetch_plan`). Returns a mapping of identifier to its new entry, or to None if it was removed.
+    Identifiers that could not be measured are left out, so their previous counts stay in effect.
+    """
+    measured = {}
+    changed = []
+    for version in versions:
+        if version["removed"]:
+            measured[version["identifier"]] = None
+        else:
+            changed.append(version)
+
+    async def measure(request, request_versions):
+        if request is None:
+            if not await client.prefetch_xml(date, title):
+                return
+            index = await asyncio.to_thread(index_stored_title, date, title)
+        else:
+            xml = await client.fetch_xml_for_title(date, title, **request)
+            if xml is None:
+                return
+            # Sections of a part fetched whole that did not change are not tokenized again.
+            index = await asyncio.to_thread(hierarchy.build_title_index, xml, title, date, counts_store)
+        if index is None:
+            return
+
+        for version in request_versions:
+            nodes = index.get(version["type"], version["identifier"])
+            if not nodes and request is not None and version["type"] in request:
+                nodes = [node for node in index.nodes if node.type in CONTENT_TYPES][:1]
+            if not nodes:
+                logging.warning(
+                    f"{version['type'].title()} {version['identifier']} not found in Title {title} on {date}"
+                )
+                continue
+            if request is None:
+                path = index.path_key(nodes[0])
+            elif version["part"] in parts:
+                path = f"{parts[version['part']]}/{version['type']}-{version['identifier']}"
+            else:
+                # Without its part's path, the section could not be attributed to the Agencies covering it.
+                logging.warning(
+                    f"Part {version['part']} of {version['type']} {version['identifier']} not found in the structure "
+                    f"of Title {title}; skipping it on {date}"
+                )
+                continue
+            measured[version["identifier"]] = entry(path, nodes[0])
+
+    requests = fetch_plan.plan(changed, sizes)
+    if requests and requests[0][0] is None:
+        logging.info(f"Title {title} on {date}: fetching the whole Title for {len(changed)} changes")
+    async with asyncio.TaskGroup() as group:
+        for request, request_versions in requests:
+            group.create_task(measure(request, request_versions))
+
+    return measured
+
+
+def structure_part_paths(node, prefix=None):
+    """Hierarchy path of every part in a Title's structure (see `TitleIndex.path_key`), by identifier."""
+    if not node:
+        return {}
+    path = f"{prefix}/{node['type']}-{node['identifier']}" if prefix else f"{node['type']}-{node['identifier']}"
+    if node["type"] == "part":
+        return {node["identifier"]: path}
+    paths = {}
+    for child in node.get("children") or []:
+        paths.update(structure_part_paths(child, path))
+    return paths
+
+
+async def process_title_history(title, agencies):
+    coverage = {
+        agency["slug"]: [reference for reference in covered_references(agency) if reference["title"] == title]
+        for agency in agencies
+    }
+    coverage = {slug: references for slug, references in coverage.items() if references}
+
+    agencies_by_path = {}
+
+    def agencies_for(path):
+        if path not in agencies_by_path:
+            agencies_by_path[path] = [
+                slug for slug, references in coverage.items()
+                if any(reference_covers(reference, path) for reference in references)
+            ]
+        return agencies_by_path[path]
+
+    async with ecfr_async.AsyncECFRClient() as client:
+        versions_data = await client.fetch_versions_for_title(title)
+        if not versions_data:
+            logging.error(f"No Content Versions found for Title {title}.")
+            return
+
+        changes_by_date = {}
+        for version in versions_data["content_versions"]:
+            if version["type"] in CONTENT_TYPES:
+                changes_by_date.setdefault(version["issue_date"], {})[version["identifier"]] = version
+        dates = sorted(changes_by_date)
+        if not dates:
+            return
+
+        state_data, history_data = r.mget(
+            [HISTORY_STATE_KEY.format(title=title), history.HISTORY_KEY.format(title=title)]
+        )
+        if state_data is None or history_data is None:
+            logging.info(f"🚀 Seeding history for Title {title} on {dates[0]}")
+            state = await seed_title_history(client, title, dates[0])
+            if state is None:
+                logging.error(f"Failed to seed history for Title {title}.")
+                return
+            series = {"title": history.empty_series(), "agencies": {slug: history.empty_series() for slug in coverage}}
+            pending = dates[1:]
+        else:
+            state = history.decode(state_data)
+            series = history.decode(history_data)
+            pending = [date for date in dates if date > state["date"]]
+
+        sections = state["sections"]
+        title_totals = [0] * len(history.MEASURES)
+        agency_totals = {slug: [0] * len(history.MEASURES) for slug in coverage}
+        for path, *values in sections.values():
+            for totals in [title_totals] + [agency_totals[slug] for slug in agencies_for(path)]:
+                for i, value in enumerate(values):
+                    totals[i] += value
+
+        if not series["title"]["dates"]:
+            history.append(series["title"], state["date"], title_totals)
+            for slug, totals in agency_totals.items():
+                history.append(series["agencies"].setdefault(slug, history.empty_series()), state["date"], totals)
+
+        logging.info(f"Title {title}: {len(pending)} issue dates to apply")
+        # Sizes as of the latest issue date stand in for those of earlier dates, which differ little.
+        structure = await client.fetch_structure_for_title(pending[-1], title) if pending else None
+        sizes = fetch_plan.StructureSizes(structure)
+        # Parts added since the Title was seeded are located by the latest structure.
+        for part, path in structure_part_paths(structure).items():
+            state["parts"].setdefault(part, path)
+        for i, date in enumerate(pending, start=1):
+            measured = await measure_changes(
+                client, title, date, changes_by_date[date].values(), state["parts"], sizes
+            )
+
+            touched = set()
+            for identifier, new_entry in measured.items():
+                for sign, changed in ((-1, sections.pop(identifier, None)), (1, new_entry)):
+                    if changed is None:
+                        continue
+                    path, *values = changed
+                    affected = agencies_for(path)
+                    touched.update(affected)
+                    for totals in [title_totals] + [agency_totals[slug] for slug in affected]:
+                        for j, value in enumerate(values):
+                            totals[j] += sign * value
+                if new_entry is not None:
+                    sections[identifier] = new_entry
+
+            history.append(series["title"], date, title_totals)
+            for slug in touched:
+                history.append(series["agencies"].setdefault(slug, history.empty_series()), date, agency_totals[slug])
+            state["date"] = date
+
+            if i % CHECKPOINT_INTERVAL == 0 or i == len(pending):
+                save_title_history(title, state, series)
+
+        if not pending:
+            save_title_history(title, state, series)
+
+    logging.info(f"✅ Completed history for Title {title} through {state['date']}")
+
+
+def save_title_history(title, state, series):
+    with r.pipeline(transaction=True) as pipe:
+        pipe.mset({
+            HISTORY_STATE_KEY.format(title=title): history.encode(state),
+            history.HISTORY_KEY.format(title=title): history.encode(series),
+        })
+        pipe.incr(history.HISTORY_VERSION_KEY)
+        pipe.execute()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build historical word count and readability time series.")
+    parser.add_argument("titles", type=int, nargs="*", help="Titles to process (default: all).")
+    parser.add_argument("--full", action="store_true", help="Discard stored history and rebuild it.")
+    args = parser.parse_args()
+
+    calculate_title_history(titles=args.titles or None, full=args.full)
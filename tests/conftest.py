@@ -0,0 +1,25 @@
+import os
+import tempfile
+
+# Stores and indexes default to a directory under the home directory, so tests get their own before anything imports
+# `utils.cache`.
+os.environ.setdefault("ECFR_CACHE_DIR", tempfile.mkdtemp(prefix="ecfr-tests-"))
+
+import fakeredis
+import nltk
+import pytest
+
+
+@pytest.fixture
+def r():
+    return fakeredis.FakeRedis()
+
+
+@pytest.fixture(scope="session")
+def punkt():
+    """NLTK's sentence tokenizer data, needed for readability counts, as the metrics job downloads it."""
+    nltk.download("punkt_tab", quiet=True)
+    try:
+        nltk.data.find("tokenizers/punkt_tab/english/")
+    except LookupError:
+        pytest.skip("NLTK punkt_tab data is not available")
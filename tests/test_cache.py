@@ -0,0 +1,130 @@
+import os
+import threading
+
+import pytest
+
+from utils.cache import XMLStore, iter_file, xml_key
+
+
+@pytest.fixture
+def store(tmp_path):
+    return XMLStore(str(tmp_path), max_bytes=10 * 1024 ** 2)
+
+
+def xml(n, size=2000):
+    # Random-looking content so compressed payloads keep a predictable size.
+    return f"<ECFR N=\"{n}\">" + os.urandom(size).hex() + "</ECFR>"
+
+
+def blobs(store):
+    return [name for _, _, names in os.walk(os.path.join(store.directory, "blobs")) for name in names
+            if not name.startswith(".")]
+
+
+def test_put_and_get_round_trip(store):
+    content = xml(1)
+    digest = store.put(xml_key("2025-01-02", 40), content)
+
+    assert store.get(xml_key("2025-01-02", 40)) == content
+    assert store.digest(xml_key("2025-01-02", 40)) == digest
+    assert store.raw_size(xml_key("2025-01-02", 40)) == len(content)
+    with store.open(xml_key("2025-01-02", 40)) as f:
+        assert b"".join(iter_file(f, chunk_size=1000)).decode("utf-8") == content
+    assert store.get(xml_key("2025-01-02", 41)) is None
+    with store.open(xml_key("2025-01-02", 41)) as f:
+        assert f is None
+
+
+def test_identical_payloads_are_stored_once(store):
+    content = xml(1)
+    first = store.put(xml_key("2025-01-02", 40), content)
+    second = store.put(xml_key("2025-02-03", 40, part="60"), content)
+    other = store.put(xml_key("2025-01-02", 41), xml(2))
+
+    assert first == second != other
+    assert len(blobs(store)) == 2
+    assert store.get(xml_key("2025-02-03", 40, part="60")) == content
+
+
+def test_least_recently_used_payloads_are_evicted(store):
+    for title in (1, 2, 3):
+        store.put(xml_key("2025-01-02", title), xml(title))
+    size = os.path.getsize(store._blob_path(store.digest(xml_key("2025-01-02", 1))))
+    # Reading Title 1 makes Title 2 the least recently used.
+    store.get(xml_key("2025-01-02", 1))
+
+    store.max_bytes = 3 * size + size // 2
+    store.put(xml_key("2025-01-02", 4), xml(4))
+
+    assert store.digest(xml_key("2025-01-02", 2)) is None
+    assert store.get(xml_key("2025-01-02", 2)) is None
+    assert all(store.get(xml_key("2025-01-02", title)) is not None for title in (1, 3, 4))
+    assert len(blobs(store)) == 3
+
+
+def test_payload_evicted_after_lookup_is_a_miss(store):
+    store.put(xml_key("2025-01-02", 1), xml(1))
+    digest = store.digest(xml_key("2025-01-02", 1))
+
+    store.max_bytes = 0
+    store.evict()
+
+    assert store.get_by_digest(digest) is None
+    assert store.get(xml_key("2025-01-02", 1)) is None
+    assert store.raw_size(xml_key("2025-01-02", 1)) is None
+
+
+def test_missing_payload_stored_again_is_not_forgotten(store):
+    content = xml(1)
+    digest = store.put(xml_key("2025-01-02", 1), content)
+    os.remove(store._blob_path(digest))
+    store.put(xml_key("2025-01-02", 1), content)
+
+    # A reader that found the payload missing before it was stored again.
+    store._forget(digest)
+
+    assert store.get(xml_key("2025-01-02", 1)) == content
+
+
+def test_concurrent_reads_and_writes_during_eviction(store):
+    contents = {title: xml(title) for title in range(8)}
+    for title, content in contents.items():
+        store.put(xml_key("2025-01-02", title), content)
+    size = os.path.getsize(store._blob_path(store.digest(xml_key("2025-01-02", 0))))
+    store.max_bytes = 3 * size
+
+    errors = []
+    done = threading.Event()
+
+    def read():
+        reader = XMLStore(store.directory, store.max_bytes)
+        try:
+            while not done.is_set():
+                for title, content in contents.items():
+                    assert reader.get(xml_key("2025-01-02", title)) in (None, content)
+                    with reader.open(xml_key("2025-01-02", title)) as f:
+                        assert f is None or f.read().decode("utf-8") == content
+        except Exception as error:
+            errors.append(error)
+
+    def write():
+        writer = XMLStore(store.directory, store.max_bytes)
+        try:
+            for _ in range(5):
+                for title, content in contents.items():
+                    writer.put(xml_key("2025-01-02", title), content)
+        except Exception as error:
+            errors.append(error)
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    writers = [threading.Thread(target=write) for _ in range(2)]
+    for thread in readers + writers:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    done.set()
+    for thread in readers:
+        thread.join()
+
+    assert errors == []
+    assert len(blobs(store)) <= 3
@@ -0,0 +1,236 @@
+import asyncio
+import json
+import threading
+
+import pytest
+
+from types import SimpleNamespace
+
+from scripts import calculate_agency_metrics as job
+from utils import tracing
+from utils.corrections import CorrectionsStore
+
+AGENCIES = [
+    {"name": "A", "slug": "a", "cfr_references": [{"title": 1, "chapter": "I"}], "children": []},
+    {"name": "B", "slug": "b", "cfr_references": [{"title": 2, "chapter": "II"}], "children": []},
+]
+
+
+class FailingClient:
+    """An `AsyncECFRClient` whose XML downloads all fail."""
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def download_xml(self, date, title):
+        return None
+
+
+class EmptyStore:
+    def digest(self, key):
+        return None
+
+
+class FullStore:
+    """An XML store holding every Title, with `size` bytes of XML each."""
+
+    def __init__(self, size):
+        self.size = size
+
+    def digest(self, key):
+        return "digest"
+
+    def raw_size(self, key):
+        return self.size
+
+
+def watermark(date, references, digest="digest"):
+    return {"version": job.METRICS_VERSION, "latest_issue_date": date, "digest": digest, "references": references}
+
+
+def measured(reference, word_count):
+    scores = {"flesch_kincaid": None, "flesch_reading_ease": None, "smog": None}
+    node = f"title-{reference['title']}"
+    return job.reference_result(reference, node, word_count, job.scoring.TextCounts(), {}, scores)
+
+
+@pytest.fixture
+def metrics_job(r, tmp_path, monkeypatch):
+    """The metrics job against fakeredis, with Title 1 processed and Title 2 failing to download."""
+    monkeypatch.setattr(job, "r", r)
+    monkeypatch.setattr(job.ecfr, "fetch_agencies", lambda: {"agencies": AGENCIES})
+    monkeypatch.setattr(job.ecfr, "fetch_titles", lambda: [
+        {"number": 1, "latest_issue_date": "2025-01-02"}, {"number": 2, "latest_issue_date": "2025-01-02"},
+    ])
+    monkeypatch.setattr(job.ecfr, "fetch_corrections", lambda: {"ecfr_corrections": []})
+    monkeypatch.setattr(job, "corrections_store", CorrectionsStore(str(tmp_path)))
+    monkeypatch.setattr(job.search.search_index, "current", lambda title: "digest")
+
+    processed = []
+
+    async def process_titles(references_by_title, latest_issue_dates, watermarks, workers, tracer):
+        processed.append(sorted(references_by_title))
+        return {
+            title: watermark(latest_issue_dates[title], {
+                job.reference_key(reference): measured(reference, 100) for reference in references
+            })
+            for title, references in references_by_title.items() if title == 1
+        }
+
+    monkeypatch.setattr(job, "process_titles", process_titles)
+    return processed
+
+
+def test_failed_download_records_no_watermark(monkeypatch):
+    monkeypatch.setattr(job.ecfr_async, "AsyncECFRClient", FailingClient)
+    monkeypatch.setattr(job, "xml_store", EmptyStore())
+
+    references = {2: [{"title": 2, "chapter": "II"}]}
+    assert asyncio.run(job.process_titles(references, {2: "2025-01-02"}, {}, 1, tracing.Tracer())) == {}
+
+
+def test_title_too_large_for_the_memory_limit_is_skipped(monkeypatch):
+    monkeypatch.setattr(job.ecfr_async, "AsyncECFRClient", FailingClient)
+    monkeypatch.setattr(job, "xml_store", FullStore(1024 ** 3))
+    monkeypatch.setattr(job.search.search_index, "current", lambda title: None)
+    monkeypatch.setattr(job, "MEMORY_LIMIT", 2 * job.WORKER_MEMORY + job.title_memory(0))
+
+    references = {2: [{"title": 2, "chapter": "II"}]}
+    assert asyncio.run(job.process_titles(references, {2: "2025-01-02"}, {}, 4, tracing.Tracer())) == {}
+
+
+def test_memory_budget_admits_work_while_it_fits():
+    async def run():
+        budget = job.MemoryBudget(100)
+        admitted = []
+
+        async def work(name, amount, seconds):
+            async with budget.reserve(amount):
+                admitted.append((name, budget.reserved))
+                await asyncio.sleep(seconds)
+
+        async with asyncio.TaskGroup() as group:
+            group.create_task(work("a", 60, 0.05))
+            group.create_task(work("b", 60, 0))
+            group.create_task(work("c", 40, 0))
+        return budget, admitted
+
+    budget, admitted = asyncio.run(run())
+    # `b` waits for `a` to finish, while `c` fits alongside `a`.
+    assert admitted == [("a", 60), ("c", 100), ("b", 60)]
+    assert budget.reserved == 0
+    assert not budget.fits(101)
+
+
+def test_run_completes_with_a_failed_title(r, metrics_job):
+
+    assert job.calculate_agency_metrics(workers=1) == {"a": 100, "b": 0}
+    agencies = job.generations.read_all_agencies(r, job.generations.current_generation(r))
+    assert job.json.loads(agencies["b"])["references"][0]["node"] is None
+    # The failed Title has no watermark, so the next run retries it.
+    assert job.load_title_watermarks().keys() == {1}
+    job.calculate_agency_metrics(workers=1)
+    assert metrics_job == [[1, 2], [2]]
+
+
+def test_failed_title_keeps_its_previous_watermark(r, metrics_job):
+    reference = AGENCIES[1]["cfr_references"][0]
+    previous = watermark("2025-01-01", {job.reference_key(reference): measured(reference, 50)})
+    r.hset(job.TITLE_WATERMARKS_KEY, "2", job.json.dumps(previous))
+
+    assert job.calculate_agency_metrics(workers=1) == {"a": 100, "b": 50}
+    assert job.load_title_watermarks()[2] == previous
+
+
+@pytest.fixture
+def title_queue(r, monkeypatch):
+    monkeypatch.setattr(job, "r", r)
+    monkeypatch.setattr(job, "title_queue", job.work_queue.WorkQueue(r, "metrics"))
+    monkeypatch.setattr(job, "QUEUE_POLL_INTERVAL", 0.01)
+    monkeypatch.setattr(job.search.search_index, "current", lambda title: None)
+    return job.title_queue
+
+
+def run_queue(references_by_title, dates, processed, monkeypatch):
+    """
+    Runs the coordinator of a queued run with one local worker, in a thread rather than a process, and adds the Titles
+    it processes to `processed`.
+    """
+
+    def process_title_job(queued, ship_segments=False):
+        processed.append(queued["title"])
+        return {"digest": f"digest-{queued['date']}", "references": {}, "xml_cached": True, "spans": []}
+
+    monkeypatch.setattr(job, "process_title_job", process_title_job)
+    monkeypatch.setattr(job.multiprocessing, "get_context", lambda method: SimpleNamespace(Process=threading.Thread))
+    return job.run_title_queue(references_by_title, dates, {}, 1, tracing.Tracer())
+
+
+def test_interrupted_queued_run_resumes(title_queue, monkeypatch):
+    references = {1: [{"title": 1, "chapter": "I"}], 2: [{"title": 2, "chapter": "II"}]}
+    dates = {1: "2025-01-02", 2: "2025-01-02"}
+    title_queue.start({str(title): job.title_job(title, dates[title], references[title], None) for title in references})
+    title_queue.claim("crashed")
+    title_queue.complete("1", "crashed", json.dumps(
+        {"digest": "digest-2025-01-02", "references": {}, "xml_cached": True, "spans": []}
+    ))
+
+    processed = []
+    watermarks = run_queue(references, dates, processed, monkeypatch)
+    assert processed == [2]
+    assert {title: watermark["digest"] for title, watermark in watermarks.items()} == {
+        1: "digest-2025-01-02", 2: "digest-2025-01-02",
+    }
+
+
+def test_interrupted_queued_run_is_requeued_when_titles_are_reissued(title_queue, monkeypatch):
+    references = {1: [{"title": 1, "chapter": "I"}], 2: [{"title": 2, "chapter": "II"}]}
+    dates = {1: "2025-01-02", 2: "2025-01-02"}
+    title_queue.start({str(title): job.title_job(title, dates[title], references[title], None) for title in references})
+    for _ in references:
+        job_id, _ = title_queue.claim("crashed")
+        title_queue.complete(job_id, "crashed", json.dumps(
+            {"digest": "digest-2025-01-02", "references": {}, "xml_cached": True, "spans": []}
+        ))
+
+    processed = []
+    watermarks = run_queue(references, {1: "2025-01-02", 2: "2025-02-01"}, processed, monkeypatch)
+    assert processed == [2]
+    assert watermarks[2] == {
+        "version": job.METRICS_VERSION, "latest_issue_date": "2025-02-01", "digest": "digest-2025-02-01",
+        "references": {},
+    }
+
+
+def test_segments_of_remote_workers_are_installed(r, tmp_path, monkeypatch):
+    monkeypatch.setattr(job, "r", r)
+    worker_index = job.search.SearchIndex(str(tmp_path / "worker"))
+    with job.search.SegmentWriter(7, "2025-01-02", worker_index.directory) as segment:
+        segment.add("title-7/part-1/section-1.1", "Emission standards apply.")
+        segment.publish("digest")
+    monkeypatch.setattr(job.search, "search_index", worker_index)
+    assert job.ship_search_segment(7, "digest") > 0
+
+    coordinator_index = job.search.SearchIndex(str(tmp_path / "coordinator"))
+    monkeypatch.setattr(job.search, "search_index", coordinator_index)
+    job.install_search_segments({7: "digest"})
+    assert coordinator_index.current(7) == "digest"
+    assert coordinator_index.search("emission") == [(7, "title-7/part-1/section-1.1", 1)]
+    assert r.keys(job.SEARCH_SEGMENT_KEY.format(title="*", digest="*")) == []
+
+
+def test_unchanged_title_is_only_skipped_when_the_coordinator_has_its_segment(monkeypatch):
+    previous = watermark("2025-01-01", {job.reference_key(AGENCIES[0]["cfr_references"][0]): {}}, digest="digest")
+    references = AGENCIES[0]["cfr_references"]
+
+    monkeypatch.setattr(job.search.search_index, "current", lambda title: None)
+    assert job.title_job(1, "2025-01-02", references, previous)["indexed"] is False
+    monkeypatch.setattr(job.search.search_index, "current", lambda title: "digest")
+    queued = job.title_job(1, "2025-01-02", references, previous)
+    assert queued["indexed"] is True
+
+    monkeypatch.setattr(job, "xml_store", SimpleNamespace(digest=lambda key: "digest"))
+    assert job.process_title_job(queued)["references"] is None
@@ -0,0 +1,108 @@
+import pytest
+import requests
+
+from utils import client as client_module
+from utils.client import ECFRClient
+
+URL = "https://www.ecfr.gov/api/versioner/v1/titles.json"
+
+
+def response(status, body=b"", headers=None):
+    response = requests.Response()
+    response.status_code = status
+    response._content = body
+    response._content_consumed = True
+    response.headers.update(headers or {})
+    return response
+
+
+class ScriptedSession:
+    """Answers each request with the next response (or raises the next error) of a script, and records the requests."""
+
+    def __init__(self, *script):
+        self.script = list(script)
+        self.requests = []
+
+    def get(self, url, params=None, headers=None, **kwargs):
+        self.requests.append({"url": url, "params": params, "headers": headers})
+        outcome = self.script.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(client_module.time, "sleep", sleeps.append)
+    # Full jitter draws each delay uniformly below its cap; the cap is used so delays are deterministic.
+    monkeypatch.setattr(client_module.random, "uniform", lambda low, high: high)
+    return sleeps
+
+
+def scripted_client(*script, **kwargs):
+    client = ECFRClient(backoff_base=0.5, backoff_max=4, **kwargs)
+    client.session = ScriptedSession(*script)
+    return client
+
+
+def test_server_errors_are_retried_with_exponential_backoff(sleeps):
+    client = scripted_client(response(503), response(500), response(502), response(200, b"ok"))
+
+    assert client.get(URL).content == b"ok"
+    assert sleeps == [0.5, 1.0, 2.0]
+    stats = client.stats()["versioner/v1/titles.json"]
+    assert (stats["requests"], stats["retries"], stats["errors"]) == (1, 3, 0)
+
+
+def test_backoff_is_capped_and_honors_retry_after(sleeps):
+    client = scripted_client(
+        *[response(503)] * 4, response(429, headers={"Retry-After": "3"}), response(200), max_retries=5,
+    )
+
+    assert client.get(URL).status_code == 200
+    assert sleeps == [0.5, 1.0, 2.0, 4, 3.0]
+
+
+def test_connection_errors_are_retried_until_attempts_run_out(sleeps):
+    client = scripted_client(requests.exceptions.ConnectionError("reset"), response(200, b"ok"), max_retries=2)
+    assert client.get(URL).content == b"ok"
+    assert sleeps == [0.5]
+
+    client = scripted_client(*[requests.exceptions.ConnectTimeout("timed out")] * 3, max_retries=2)
+    with pytest.raises(requests.exceptions.ConnectTimeout):
+        client.get(URL)
+    stats = client.stats()["versioner/v1/titles.json"]
+    assert (stats["requests"], stats["retries"], stats["errors"]) == (1, 2, 1)
+
+
+def test_server_error_is_returned_once_retries_run_out(sleeps):
+    client = scripted_client(*[response(503)] * 3, max_retries=2)
+
+    assert client.get(URL).status_code == 503
+    assert client.stats()["versioner/v1/titles.json"]["errors"] == 1
+
+
+def test_not_modified_reuses_the_cached_body(sleeps):
+    headers = {"ETag": '"v1"', "Last-Modified": "Thu, 02 Jan 2025 00:00:00 GMT"}
+    client = scripted_client(response(200, b'{"titles": []}', headers), response(304))
+
+    first = client.get(URL, revalidate=True)
+    second = client.get(URL, revalidate=True)
+
+    assert second is first
+    assert second.json() == {"titles": []}
+    assert client.session.requests[0]["headers"] == {}
+    assert client.session.requests[1]["headers"] == {
+        "If-None-Match": '"v1"', "If-Modified-Since": "Thu, 02 Jan 2025 00:00:00 GMT",
+    }
+    assert client.stats()["versioner/v1/titles.json"]["not_modified"] == 1
+
+
+def test_requests_are_only_revalidated_when_asked(sleeps):
+    headers = {"ETag": '"v1"'}
+    client = scripted_client(response(200, b"one", headers), response(200, b"two", headers))
+
+    assert client.get(URL).content == b"one"
+    assert client.get(URL, revalidate=True).content == b"two"
+    assert client.session.requests[1]["headers"] == {}
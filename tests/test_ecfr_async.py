@@ -0,0 +1,101 @@
+import asyncio
+
+import aiohttp
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from utils import ecfr_async
+from utils.cache import xml_key, xml_store
+from utils.client import ECFRClient
+
+TITLES = "versioner/v1/titles.json"
+XML = "versioner/v1/full"
+
+
+@pytest.fixture
+def stats(monkeypatch):
+    client = ECFRClient()
+    monkeypatch.setattr(ecfr_async, "client", client)
+    # Retries are not delayed.
+    monkeypatch.setattr(ecfr_async.random, "uniform", lambda low, high: 0)
+    return client.stats
+
+
+def serve(routes, monkeypatch, read_timeout=5, max_retries=2):
+    """Runs `routes` (path -> handler) on a local server and returns a coroutine function to call the client with."""
+    async def run(call):
+        app = web.Application()
+        for path, handler in routes.items():
+            app.router.add_get(path, handler)
+        async with TestServer(app) as server:
+            monkeypatch.setattr(ecfr_async, "BASE_URL", str(server.make_url("")).rstrip("/"))
+            async with ecfr_async.AsyncECFRClient(read_timeout=read_timeout, max_retries=max_retries) as client:
+                return await call(client)
+    return run
+
+
+def test_requests_and_retries_are_counted(stats, monkeypatch):
+    responses = [web.Response(status=503), web.json_response({"titles": [{"number": 40}]})]
+
+    async def titles(request):
+        return responses.pop(0)
+
+    async def full(request):
+        return web.Response(body=b"<ECFR/>")
+
+    run = serve({"/api/versioner/v1/titles.json": titles, "/api/versioner/v1/full/{date}/{title}": full}, monkeypatch)
+
+    async def call(client):
+        return await client.fetch_titles(), await client.download_xml("2025-01-02", 40)
+
+    titles_data, digest = asyncio.run(run(call))
+
+    assert titles_data == [{"number": 40}]
+    assert digest == xml_store.digest(xml_key("2025-01-02", 40))
+    assert (stats()[TITLES]["requests"], stats()[TITLES]["retries"], stats()[TITLES]["errors"]) == (1, 1, 0)
+    assert (stats()[XML]["requests"], stats()[XML]["errors"]) == (1, 0)
+
+
+def test_server_error_is_counted_once_retries_run_out(stats, monkeypatch):
+    async def titles(request):
+        return web.Response(status=503)
+
+    run = serve({"/api/versioner/v1/titles.json": titles}, monkeypatch, max_retries=1)
+
+    assert asyncio.run(run(lambda client: client.fetch_titles())) is None
+    assert (stats()[TITLES]["requests"], stats()[TITLES]["retries"], stats()[TITLES]["errors"]) == (1, 1, 1)
+
+
+def test_timed_out_title_is_skipped_without_cancelling_the_others(stats, monkeypatch):
+    async def full(request):
+        if request.match_info["title"] == "title-1.xml":
+            await asyncio.sleep(5)
+        return web.Response(body=b"<ECFR/>")
+
+    run = serve({"/api/versioner/v1/full/{date}/{title}": full}, monkeypatch, read_timeout=0.2, max_retries=1)
+
+    async def call(client):
+        async with asyncio.TaskGroup() as group:
+            slow = group.create_task(client.download_xml("2025-01-02", 1))
+            fast = group.create_task(client.download_xml("2025-01-02", 2))
+        return slow.result(), fast.result()
+
+    slow, fast = asyncio.run(run(call))
+
+    assert slow is None
+    assert fast == xml_store.digest(xml_key("2025-01-02", 2))
+    assert (stats()[XML]["requests"], stats()[XML]["retries"], stats()[XML]["errors"]) == (2, 1, 1)
+
+
+@pytest.mark.parametrize("error", [asyncio.TimeoutError(), aiohttp.ServerDisconnectedError()])
+def test_failed_fetch_is_logged_and_returns_none(error, caplog):
+    client = ecfr_async.AsyncECFRClient()
+
+    async def get(url, params=None, body="json", key=None):
+        raise error
+
+    client._get = get
+
+    assert asyncio.run(client.fetch_titles()) is None
+    assert "Failed to fetch Titles" in caplog.text
@@ -0,0 +1,108 @@
+import random
+
+import pytest
+
+from readability import Readability
+from readability.exceptions import ReadabilityException
+
+from utils import scoring
+
+SENTENCES = [
+    "The owner or operator of each affected facility shall maintain records of the monitoring data.",
+    "Each report must be submitted to the Administrator within thirty days.",
+    "An application for approval shall include a description of the proposed alternative.",
+    "The permit holder keeps a copy of the plan at the site.",
+    "Notwithstanding the requirements of this paragraph, the Regional Administrator may approve an equivalent "
+    "methodology.",
+    "Samples are taken each day.",
+    "The determination of compliance with the emission limitation shall be based on the average of three consecutive "
+    "runs.",
+    "This section applies to new sources.",
+    "Records shall be retained for at least five years following the date of each occurrence.",
+    "A facility that is not subject to this subpart is exempt.",
+    "Continuous monitoring systems shall be calibrated, maintained and operated according to the manufacturer's "
+    "specifications.",
+    "Fees are due on the first day of the month.",
+]
+
+# Upper bound of the difference between SMOG from every sentence and the library's default 30-sentence sample that
+# `utils.scoring` documents (90th percentile on long texts).
+SMOG_SAMPLE_TOLERANCE = 2.6
+
+
+def sample_text(sentences=72, seed=0):
+    # Shuffled so the library's sample of the first, middle and last 10 sentences differs from the whole text.
+    text = [SENTENCES[i % len(SENTENCES)] for i in range(sentences)]
+    random.Random(seed).shuffle(text)
+    return " ".join(text)
+
+
+def words(n):
+    return " ".join(["regulation"] * n) + "."
+
+
+@pytest.fixture
+def text(punkt):
+    return sample_text()
+
+
+def test_flesch_scores_match_the_library(text):
+    library = Readability(text)
+    scores = scoring.score(scoring.count_text(text))
+
+    assert scores["flesch_kincaid"] == pytest.approx(library.flesch_kincaid().score)
+    assert scores["flesch_reading_ease"] == pytest.approx(library.flesch().score)
+
+
+def test_smog_matches_the_library_over_all_sentences(text):
+    library = Readability(text)
+    smog = scoring.score(scoring.count_text(text))["smog"]
+
+    assert smog == pytest.approx(library.smog(all_sentences=True).score)
+    assert smog != pytest.approx(library.smog().score)
+    assert abs(smog - library.smog().score) <= SMOG_SAMPLE_TOLERANCE
+
+
+def test_counts_match_the_library(text):
+    statistics = Readability(text).statistics()
+    counts = scoring.count_text(text)
+
+    assert (counts.sentences, counts.words, counts.polysyllables) == (
+        statistics["num_sentences"], statistics["num_words"], statistics["num_polysyllabic_words"],
+    )
+
+
+def test_texts_are_scored_from_the_library_minimum_of_100_words(punkt):
+    with pytest.raises(ReadabilityException):
+        Readability(words(99)).flesch_kincaid()
+    assert scoring.score(scoring.count_text(words(99))) == {
+        "flesch_kincaid": None, "flesch_reading_ease": None, "smog": None,
+    }
+
+    scores = scoring.score(scoring.count_text(words(100)))
+    assert scores["flesch_kincaid"] == pytest.approx(Readability(words(100)).flesch_kincaid().score)
+    assert scores["smog"] is None
+
+
+def test_smog_needs_30_sentences(punkt):
+    text = sample_text(sentences=29)
+    with pytest.raises(ReadabilityException):
+        Readability(text).smog(all_sentences=True)
+    assert scoring.score(scoring.count_text(text))["smog"] is None
+
+    text = sample_text(sentences=30)
+    assert scoring.score(scoring.count_text(text))["smog"] == pytest.approx(
+        Readability(text).smog(all_sentences=True).score
+    )
+
+
+def test_sentence_split_between_pieces_is_counted_twice(text):
+    # A piece boundary inside the first sentence, as between two DIV segments of a section.
+    tokens = text.split(" ")
+    pieces = scoring.count_text(" ".join(tokens[:3])) + scoring.count_text(" ".join(tokens[3:]))
+    whole = scoring.count_text(text)
+
+    assert (pieces.words, pieces.syllables, pieces.polysyllables) == (
+        whole.words, whole.syllables, whole.polysyllables,
+    )
+    assert pieces.sentences == whole.sentences + 1
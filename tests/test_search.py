@@ -0,0 +1,47 @@
+from utils import hierarchy, search
+
+XML = """<ECFR><DIV1 N="40" TYPE="TITLE"><DIV5 N="60" TYPE="PART"><HEAD>PART 60</HEAD>
+<DIV8 N="60.1" TYPE="SECTION"><HEAD>§ 60.1 Applicability.</HEAD><P>Emission standards apply to each facility.</P></DIV8>
+<DIV8 N="60.2" TYPE="SECTION"><HEAD>§ 60.2 Definitions.</HEAD><P>Facility means any emission source.</P>
+<DIV>Standards of performance.</DIV></DIV8>
+<DIV9 N="Appendix A to Part 60" TYPE="APPENDIX"><P>Test methods for emission standards.</P></DIV9>
+</DIV5></DIV1></ECFR>"""
+
+
+def build(directory, xml=XML):
+    with search.SegmentWriter(40, "2025-01-02", str(directory)) as segment:
+        index = hierarchy.build_title_index(xml, 40, "2025-01-02", segment=segment)
+        segment.publish("digest")
+    return index, search.SearchIndex(str(directory))
+
+
+def test_sections_are_indexed_while_parsing(tmp_path, punkt):
+    index, search_index = build(tmp_path)
+
+    assert sorted(search_index.search("emission standards")) == [
+        (40, "title-40/part-60/appendix-Appendix A to Part 60", 2),
+        (40, "title-40/part-60/section-60.1", 2),
+        (40, "title-40/part-60/section-60.2", 2),
+    ]
+    assert search_index.search('"standards of performance"') == [(40, "title-40/part-60/section-60.2", 1)]
+    # Node spans are offsets into the title's text, which is not kept.
+    section = index.get("section", "60.2")[0]
+    assert section.end - section.start == len("§ 60.2 Definitions.Facility means any emission source.\n"
+                                              "Standards of performance.")
+    assert not [name for name in (tmp_path / "title-40").iterdir() if name.name.startswith(".")]
+
+
+def test_spilled_runs_merge_into_the_same_segment(tmp_path, monkeypatch, punkt):
+    xml = XML.replace("</DIV5>", "".join(
+        f'<DIV8 N="60.{i}" TYPE="SECTION"><P>Section {i} limits emission of pollutant {i % 7}.</P></DIV8>'
+        for i in range(10, 200)
+    ) + "</DIV5>")
+    build(tmp_path / "one", xml)
+    monkeypatch.setattr(search, "RUN_TOKENS", 16)
+    monkeypatch.setattr(hierarchy, "COUNT_BATCH_CHARS", 64)
+    build(tmp_path / "runs", xml)
+
+    one = search.read_title_segment(40, "digest", str(tmp_path / "one"))
+    runs = search.read_title_segment(40, "digest", str(tmp_path / "runs"))
+    assert one == runs
+    assert len(search.SearchIndex(str(tmp_path / "runs")).search('"pollutant 3"')) == 28
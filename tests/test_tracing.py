@@ -0,0 +1,34 @@
+import pytest
+
+from utils import tracing
+
+
+def spans():
+    tracer = tracing.Tracer()
+    tracer.record("fetch", 2.0, title=1)
+    tracer.record("parse", 5.0, title=1)
+    tracer.record("tokenize", 1.0, title=1)
+    tracer.record("store", 30.0, title=1)
+    tracer.record("extract", 0.001, elements=300, title=1, reference="1/chapter-I")
+    tracer.record("extract", 0.002, elements=100, title=1, reference="1/chapter-II")
+    tracer.record("fetch", 1.0, title=2)
+    tracer.record("parse", 3.0, title=2)
+    tracer.record("extract", 0.5, elements=None, title=2, reference="2/chapter-III")
+    tracer.record("score", 4.0, agency="a")
+    return tracer.spans
+
+
+def test_titles_are_ranked_by_their_work():
+    slowest = tracing.slowest(spans(), "title")
+
+    assert [entry["title"] for entry in slowest] == [1, 2]
+    assert slowest[0]["seconds"] == pytest.approx(8.0)
+    assert slowest[0]["stages"] == {"fetch": 2.0, "parse": 5.0, "tokenize": 1.0}
+
+
+def test_references_share_their_titles_work_by_words():
+    slowest = tracing.slowest_references(spans())
+
+    assert [entry["reference"] for entry in slowest] == ["1/chapter-I", "2/chapter-III", "1/chapter-II"]
+    assert [entry["seconds"] for entry in slowest] == pytest.approx([6.0, 4.0, 2.0])
+    assert slowest[0]["stages"] == pytest.approx({"fetch": 1.5, "parse": 3.75, "tokenize": 0.75})
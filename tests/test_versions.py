@@ -0,0 +1,48 @@
+import pytest
+
+from types import SimpleNamespace
+from utils import versions
+from utils.versions import VersionIndex
+
+
+def version(identifier, issue_date, part="60"):
+    return {
+        "identifier": identifier, "name": f"§ {identifier}", "part": part, "subpart": None, "type": "section",
+        "amendment_date": issue_date, "issue_date": issue_date, "substantive": True, "removed": False,
+    }
+
+
+@pytest.fixture
+def fetches(monkeypatch):
+    """The published versions, and the `gte` of each fetch, which is answered with the versions issued since then."""
+    fetches = SimpleNamespace(published=[version("60.1", "2025-01-02"), version("60.2", "2025-02-03")], since=[])
+
+    def fetch_versions_for_title(title, gte=None):
+        fetches.since.append(gte)
+        return {"content_versions": [v for v in fetches.published if gte is None or v["issue_date"] >= gte]}
+
+    monkeypatch.setattr(versions.ecfr, "fetch_versions_for_title", fetch_versions_for_title)
+    return fetches
+
+
+def test_title_synced_against_a_later_issue_date_is_not_fetched_again(tmp_path, fetches):
+    index = VersionIndex(str(tmp_path))
+
+    # The Titles list reports an issue date later than every content version.
+    first = index.sync(40, "2025-03-04")
+    assert index.sync(40, "2025-03-04") == first
+    assert fetches.since == [None]
+    assert index.summary(40)["latest_issue_date"] == "2025-02-03"
+
+
+def test_reissued_title_fetches_versions_since_the_newest_indexed(tmp_path, fetches):
+    index = VersionIndex(str(tmp_path))
+    index.sync(40, "2025-03-04")
+
+    fetches.published.append(version("60.10", "2025-04-05"))
+    index.sync(40, "2025-04-05")
+
+    assert fetches.since == [None, "2025-02-03"]
+    assert list(index.page(40)["identifier"]) == ["60.1", "60.2", "60.10"]
+    assert index.sync(40, "2025-04-05") == index.version()
+    assert len(fetches.since) == 2
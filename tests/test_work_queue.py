@@ -0,0 +1,100 @@
+import time
+
+from utils.work_queue import WorkQueue
+
+
+def test_claim_in_order_until_drained(r):
+    queue = WorkQueue(r, "test")
+    run = queue.start({"a": {"n": 1}, "b": {"n": 2}})
+
+    assert queue.active() == run
+    assert queue.claim("w1") == ("a", {"n": 1})
+    assert queue.claim("w2") == ("b", {"n": 2})
+    assert queue.claim("w3") is None
+    assert queue.progress() == {"total": 2, "completed": 0, "failed": 0, "pending": 0, "processing": 2}
+
+    queue.complete("a", "w1", "result-a")
+    queue.complete("b", "w2", "result-b")
+    assert queue.done()
+    assert queue.results() == {"a": b"result-a", "b": b"result-b"}
+
+
+def test_expired_lease_is_requeued_and_reclaimed(r):
+    queue = WorkQueue(r, "test", lease_seconds=0.1)
+    queue.start({"a": {"n": 1}})
+    assert queue.claim("dead")[0] == "a"
+    assert queue.requeue_expired() == []
+
+    time.sleep(0.2)
+    assert queue.requeue_expired() == ["a"]
+    assert queue.heartbeat("a", "dead") is False
+    assert queue.claim("w2") == ("a", {"n": 1})
+
+    # The dead worker no longer owns the job, so its failure is ignored.
+    queue.fail("a", "dead", "boom")
+    assert queue.progress()["processing"] == 1
+    queue.complete("a", "w2", "result")
+    assert queue.done()
+    assert queue.failures() == {}
+
+
+def test_lease_is_renewed_while_working(r):
+    queue = WorkQueue(r, "test", lease_seconds=0.3)
+    queue.start({"a": {"n": 1}})
+    queue.claim("w1")
+    with queue.lease("a", "w1") as lease:
+        time.sleep(0.6)
+        assert queue.requeue_expired() == []
+    assert not lease.lost.is_set()
+
+
+def test_late_result_is_kept_and_not_claimed_again(r):
+    queue = WorkQueue(r, "test", lease_seconds=0.1)
+    queue.start({"a": {"n": 1}})
+    queue.claim("slow")
+    time.sleep(0.2)
+    queue.requeue_expired()
+
+    queue.complete("a", "slow", "late")
+    assert queue.claim("w2") is None
+    assert queue.done()
+    assert queue.results() == {"a": b"late"}
+
+
+def test_job_fails_after_max_attempts(r):
+    queue = WorkQueue(r, "test", max_attempts=2)
+    queue.start({"a": {"n": 1}})
+    queue.claim("w1")
+    queue.fail("a", "w1", "first")
+    assert queue.progress()["pending"] == 1
+
+    queue.claim("w2")
+    queue.fail("a", "w2", "second")
+    assert queue.done()
+    assert queue.failures() == {"a": "second"}
+
+
+def test_restarted_coordinator_resumes_the_run(r):
+    queue = WorkQueue(r, "test", lease_seconds=0.1)
+    run = queue.start({"a": {"n": 1}, "b": {"n": 2}, "c": {"n": 3}})
+    queue.claim("w1")
+    queue.complete("a", "w1", "result-a")
+    queue.claim("dead")
+
+    # A new coordinator (e.g. after a crash) sees the same run and requeues the job of the dead worker.
+    resumed = WorkQueue(r, "test", lease_seconds=0.1)
+    assert resumed.active() == run
+    assert resumed.results() == {"a": b"result-a"}
+    time.sleep(0.2)
+    assert resumed.requeue_expired() == ["b"]
+    assert [resumed.claim("w2")[0], resumed.claim("w2")[0]] == ["c", "b"]
+
+
+def test_start_carries_over_completed_results(r):
+    queue = WorkQueue(r, "test")
+    queue.start({"a": {"n": 1}, "b": {"n": 2}}, results={"a": "result-a", "gone": "result"})
+
+    assert queue.progress() == {"total": 2, "completed": 1, "failed": 0, "pending": 1, "processing": 0}
+    assert queue.claim("w1") == ("b", {"n": 2})
+    assert queue.claim("w1") is None
+    assert queue.active()["total"] == 2
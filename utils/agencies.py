@@ -0,0 +1,35 @@
+import json
+
+from utils.hierarchy import REFERENCE_LEVELS
+
+
+def iter_agencies(agencies):
+    """Agencies and, recursively, their children."""
+    for agency in agencies:
+        yield agency
+        yield from iter_agencies(agency.get("children", []))
+
+
+def covered_references(agency):
+    """References of an Agency and, recursively, of its children."""
+    references = list(agency["cfr_references"])
+    for child in agency.get("children", []):
+        references.extend(covered_references(child))
+    return references
+
+
+def reference_key(reference):
+    return json.dumps(reference, sort_keys=True)
+
+
+def parse_path(path):
+    """Splits a hierarchy path key (e.g. `title-40/chapter-I/part-60`) into a mapping of level to identifier."""
+    return dict(component.split("-", 1) for component in path.split("/"))
+
+
+def reference_covers(reference, path):
+    """Whether a CFR reference covers the node with the given hierarchy path key."""
+    levels = parse_path(path)
+    return all(
+        levels.get(level) == str(reference[level]) for level in REFERENCE_LEVELS if reference.get(level) is not None
+    )
@@ -0,0 +1,226 @@
+import gzip
+import hashlib
+import logging
+import os
+import sqlite3
+import struct
+import time
+import uuid
+
+from contextlib import contextmanager
+
+CACHE_DIR = os.getenv("ECFR_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "ecfr-analyzer"))
+CACHE_MAX_BYTES = int(os.getenv("ECFR_CACHE_MAX_BYTES", 10 * 1024 ** 3))
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+def xml_key(date, title, subtitle=None, chapter=None, subchapter=None, part=None, section=None, appendix=None):
+    """Canonical cache key for a title (or hierarchy slice of a title) on an issue date."""
+    key = f"{date}/title-{title}"
+    for name, value in (("subtitle", subtitle), ("chapter", chapter), ("subchapter", subchapter), ("part", part),
+                        ("section", section), ("appendix", appendix)):
+        if value:
+            key += f"/{name}-{value}"
+    return key
+
+
+class XMLStore:
+    """
+    Persistent, content-addressed store for eCFR XML.
+
+    Payloads are gzip-compressed on disk and named by their SHA-256 digest, so identical XML issued on different dates
+    (or requested through different hierarchy slices) is stored once. A SQLite catalog maps keys to digests and tracks
+    last access so the least recently used payloads are evicted once the store exceeds `max_bytes`.
+
+    Payloads can be written and read as streams (see `writer` and `open`), so a title never has to be held in memory.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._initialized = False
+
+    @contextmanager
+    def _connect(self):
+        if not self._initialized:
+            os.makedirs(os.path.join(self.directory, "blobs"), exist_ok=True)
+        conn = sqlite3.connect(os.path.join(self.directory, "catalog.sqlite"), timeout=60)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS refs (key TEXT PRIMARY KEY, digest TEXT NOT NULL)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS blobs (digest TEXT PRIMARY KEY, size INTEGER NOT NULL, last_access REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS refs_digest ON refs (digest)")
+            conn.commit()
+            self._initialized = True
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _blob_path(self, digest):
+        return os.path.join(self.directory, "blobs", digest[:2], f"{digest}.xml.gz")
+
+    def digest(self, key):
+        """Content hash currently stored for `key`, or None."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT digest FROM refs WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def get(self, key):
+        """Returns the cached XML for `key`, or None on a miss."""
+        digest = self.digest(key)
+        return self.get_by_digest(digest) if digest else None
+
+    def _forget(self, digest):
+        # The payload may have been stored again since it was found missing, so its entries are only removed if it
+        # still is.
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if not os.path.exists(self._blob_path(digest)):
+                conn.execute("DELETE FROM refs WHERE digest = ?", (digest,))
+                conn.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+
+    def get_by_digest(self, digest):
+        """Returns the cached XML with content hash `digest`, or None if it is not (or no longer) stored."""
+        try:
+            with gzip.open(self._blob_path(digest), "rb") as f:
+                content = f.read().decode("utf-8")
+        except FileNotFoundError:
+            self._forget(digest)
+            return None
+
+        with self._connect() as conn:
+            conn.execute("UPDATE blobs SET last_access = ? WHERE digest = ?", (time.time(), digest))
+        return content
+
+    @contextmanager
+    def open(self, key):
+        """Yields the XML for `key` as a binary file object that decompresses as it is read, or None on a miss."""
+        digest = self.digest(key)
+        try:
+            f = gzip.open(self._blob_path(digest), "rb") if digest else None
+        except FileNotFoundError:
+            self._forget(digest)
+            f = None
+        if f is None:
+            yield None
+            return
+
+        with self._connect() as conn:
+            conn.execute("UPDATE blobs SET last_access = ? WHERE digest = ?", (time.time(), digest))
+        with f:
+            yield f
+
+    def raw_size(self, key):
+        """Uncompressed size of the XML for `key` (modulo 4 GiB, as recorded by gzip), or None on a miss."""
+        digest = self.digest(key)
+        if digest is None:
+            return None
+        try:
+            with open(self._blob_path(digest), "rb") as f:
+                f.seek(-4, os.SEEK_END)
+                return struct.unpack("<I", f.read(4))[0]
+        except (FileNotFoundError, OSError):
+            return None
+
+    def writer(self, key):
+        """A `BlobWriter` that stores XML written to it in chunks under `key` once committed."""
+        return BlobWriter(self, key)
+
+    def _commit(self, key, digest, tmp_path):
+        path = self._blob_path(digest)
+        # Payloads are published and evicted while holding the catalog's write lock, so an eviction cannot remove a
+        # payload between the check that it exists and the catalog entries that refer to it.
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            exists = conn.execute("SELECT 1 FROM blobs WHERE digest = ?", (digest,)).fetchone()
+            if not exists or not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+            else:
+                os.remove(tmp_path)
+
+            conn.execute(
+                "INSERT OR REPLACE INTO blobs (digest, size, last_access) VALUES (?, ?, ?)",
+                (digest, os.path.getsize(path), time.time()),
+            )
+            conn.execute("INSERT OR REPLACE INTO refs (key, digest) VALUES (?, ?)", (key, digest))
+
+        self.evict()
+
+    def put(self, key, content):
+        """Stores `content` under `key` and returns its content hash."""
+        writer = self.writer(key)
+        writer.write(content.encode("utf-8") if isinstance(content, str) else content)
+        return writer.commit()
+
+    def evict(self):
+        """
+        Removes least recently used payloads until the store fits in `max_bytes`.
+
+        A reader that looked up a payload just before it was evicted finds it missing, which is a cache miss.
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+
+            for digest, size in conn.execute("SELECT digest, size FROM blobs ORDER BY last_access ASC").fetchall():
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(self._blob_path(digest))
+                except FileNotFoundError:
+                    pass
+                conn.execute("DELETE FROM refs WHERE digest = ?", (digest,))
+                conn.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+                total -= size
+                logging.info(f"Evicted cached XML {digest} ({size} bytes)")
+
+
+class BlobWriter:
+    """
+    Spills XML to a compressed temporary file in the store as it arrives, hashing it on the way.
+
+    `commit` publishes the payload under its digest; `abort` discards it.
+    """
+
+    def __init__(self, store, key):
+        self.store = store
+        self.key = key
+        self.size = 0
+        self._hash = hashlib.sha256()
+        os.makedirs(os.path.join(store.directory, "blobs"), exist_ok=True)
+        self._tmp_path = os.path.join(store.directory, "blobs", f".{uuid.uuid4().hex}.tmp")
+        self._file = gzip.open(self._tmp_path, "wb", compresslevel=6)
+
+    def write(self, chunk):
+        self._hash.update(chunk)
+        self._file.write(chunk)
+        self.size += len(chunk)
+
+    def commit(self):
+        """Stores the payload and returns its content hash."""
+        self._file.close()
+        digest = self._hash.hexdigest()
+        self.store._commit(self.key, digest, self._tmp_path)
+        return digest
+
+    def abort(self):
+        self._file.close()
+        try:
+            os.remove(self._tmp_path)
+        except FileNotFoundError:
+            pass
+
+
+def iter_file(f, chunk_size=READ_CHUNK_SIZE):
+    """Reads a file object in chunks."""
+    return iter(lambda: f.read(chunk_size), b"")
+
+
+xml_store = XMLStore()
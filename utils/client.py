@@ -0,0 +1,158 @@
+import email.utils
+import logging
+import os
+import random
+import threading
+import time
+
+import requests
+
+from cachetools import LRUCache
+from requests.adapters import HTTPAdapter
+from utils import concurrency
+
+# Overridable so the batch job, pages and benchmarks can run against a local stand-in (see `benchmarks.stub`).
+BASE_URL = os.getenv("ECFR_BASE_URL", "https://www.ecfr.gov").rstrip("/")
+CONNECT_TIMEOUT = float(os.getenv("ECFR_CONNECT_TIMEOUT", 10))
+READ_TIMEOUT = float(os.getenv("ECFR_READ_TIMEOUT", 300))
+MAX_RETRIES = int(os.getenv("ECFR_MAX_RETRIES", 5))
+BACKOFF_BASE = float(os.getenv("ECFR_BACKOFF_BASE", 0.5))
+BACKOFF_MAX = float(os.getenv("ECFR_BACKOFF_MAX", 60))
+POOL_SIZE = int(os.getenv("ECFR_POOL_SIZE", 16))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def endpoint_name(url):
+    """Groups a URL by API endpoint, e.g. `versioner/v1/full` or `admin/v1/agencies.json`."""
+    path = url.split("/api/", 1)[-1].split("?", 1)[0]
+    return "/".join(path.split("/")[:3])
+
+
+def retry_after(response):
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    if value.isdigit():
+        return float(value)
+    parsed = email.utils.parsedate_to_datetime(value)
+    return max(0.0, parsed.timestamp() - time.time()) if parsed else None
+
+
+class ECFRClient:
+    """
+    Shared HTTP client for the eCFR API.
+
+    Requests go through one keep-alive connection pool with connect/read timeouts. Connection errors and 429/5xx
+    responses are retried with exponential backoff and full jitter (honoring `Retry-After`). Revalidated requests send
+    `If-None-Match` / `If-Modified-Since` from the previous response, and a 304 returns that cached response.
+    Requests in flight are kept within the adaptive window of their endpoint family (see `utils.concurrency`).
+    Latency, retry and revalidation counters are kept per endpoint.
+    """
+
+    def __init__(self, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT, max_retries=MAX_RETRIES,
+                 backoff_base=BACKOFF_BASE, backoff_max=BACKOFF_MAX, pool_size=POOL_SIZE, validator_cache_size=512):
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._limiters = {family: concurrency.Limiter(window) for family, window in concurrency.windows.items()}
+        self._validated = LRUCache(maxsize=validator_cache_size)
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, latency=0.0, retried=False, not_modified=False, failed=False):
+        """Counts a request to `endpoint`, or a retry of one. Requests of `utils.ecfr_async` are counted here too."""
+        with self._lock:
+            stats = self._stats.setdefault(endpoint, {
+                "requests": 0, "retries": 0, "not_modified": 0, "errors": 0, "total_latency": 0.0, "max_latency": 0.0,
+            })
+            if retried:
+                stats["retries"] += 1
+                return
+            stats["requests"] += 1
+            stats["total_latency"] += latency
+            stats["max_latency"] = max(stats["max_latency"], latency)
+            if not_modified:
+                stats["not_modified"] += 1
+            if failed:
+                stats["errors"] += 1
+
+    def stats(self):
+        """Per-endpoint request, retry, 304 and error counts with mean and max latency in seconds."""
+        with self._lock:
+            return {
+                endpoint: {**s, "mean_latency": s["total_latency"] / s["requests"] if s["requests"] else None}
+                for endpoint, s in self._stats.items()
+            }
+
+    def _backoff(self, attempt, response=None):
+        delay = retry_after(response) if response is not None else None
+        if delay is None:
+            delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        time.sleep(min(delay, self.backoff_max))
+
+    def get(self, url, params=None, revalidate=False, **kwargs):
+        """GET with retries; when `revalidate` is set, unchanged resources are served from the previous response."""
+        endpoint = endpoint_name(url)
+        family = concurrency.endpoint_family(url)
+        cache_key = (url, tuple(sorted((params or {}).items())))
+        headers = dict(kwargs.pop("headers", None) or {})
+
+        cached = None
+        if revalidate:
+            with self._lock:
+                cached = self._validated.get(cache_key)
+        if cached is not None:
+            if cached.headers.get("ETag"):
+                headers["If-None-Match"] = cached.headers["ETag"]
+            if cached.headers.get("Last-Modified"):
+                headers["If-Modified-Since"] = cached.headers["Last-Modified"]
+
+        kwargs.setdefault("timeout", self.timeout)
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                # Streamed responses leave the window once their headers arrive.
+                with self._limiters[family].slot():
+                    response = self.session.get(url, params=params, headers=headers, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as error:
+                if attempt >= self.max_retries:
+                    self.record(endpoint, time.perf_counter() - started, failed=True)
+                    raise
+                logging.warning(f"Retrying {endpoint} after {error}")
+                self.record(endpoint, retried=True)
+                self._backoff(attempt)
+                attempt += 1
+                continue
+
+            latency = time.perf_counter() - started
+            concurrency.windows[family].record(latency, response.status_code)
+            if response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                logging.warning(f"Retrying {endpoint} after HTTP {response.status_code}")
+                self.record(endpoint, retried=True)
+                response.close()
+                self._backoff(attempt, response)
+                attempt += 1
+                continue
+
+            if response.status_code == 304 and cached is not None:
+                self.record(endpoint, latency, not_modified=True)
+                return cached
+
+            self.record(endpoint, latency, failed=response.status_code >= 400)
+            if revalidate and response.status_code == 200 and (
+                    response.headers.get("ETag") or response.headers.get("Last-Modified")):
+                with self._lock:
+                    self._validated[cache_key] = response
+            return response
+
+
+client = ECFRClient()
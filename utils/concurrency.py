@@ -0,0 +1,163 @@
+"""
+Adaptive concurrency limits for requests to the eCFR API.
+
+Each endpoint family (see `FAMILIES`) has a concurrency window shared by every client in the process. The window grows
+by about one request per round trip while responses are healthy (additive increase). It is multiplied by
+`BACKOFF_FACTOR` when the API throttles (HTTP 429 or 503) or when latency rises above `LATENCY_TOLERANCE` times its
+long-term average (multiplicative decrease), at most once per round trip. Each client keeps its requests of a family
+in flight within the family's window (see `Limiter` and `AsyncLimiter`).
+"""
+import asyncio
+import os
+import threading
+import time
+
+from contextlib import asynccontextmanager, contextmanager
+
+
+def _limits(family, initial, maximum):
+    prefix = f"ECFR_{family.upper()}_CONCURRENCY"
+    return {
+        "initial": float(os.getenv(f"{prefix}_INITIAL", initial)),
+        "minimum": float(os.getenv(f"{prefix}_MIN", 1)),
+        "maximum": float(os.getenv(f"{prefix}_MAX", maximum)),
+    }
+
+
+# Full XML responses are large and expensive to produce, so their window starts and is capped lower than JSON's.
+FAMILIES = {
+    "xml": _limits("xml", initial=4, maximum=16),
+    "json": _limits("json", initial=8, maximum=32),
+}
+THROTTLE_STATUSES = {429, 503}
+BACKOFF_FACTOR = float(os.getenv("ECFR_CONCURRENCY_BACKOFF", 0.5))
+LATENCY_TOLERANCE = float(os.getenv("ECFR_LATENCY_TOLERANCE", 2.0))
+# Responses observed before latency is compared against its long-term average.
+LATENCY_WARMUP = 10
+SHORT_LATENCY_WEIGHT = 0.3
+LONG_LATENCY_WEIGHT = 0.02
+
+
+def endpoint_family(url):
+    return "xml" if "/api/versioner/v1/full/" in url else "json"
+
+
+class AIMDWindow:
+    """A concurrency window adjusted by additive increase and multiplicative decrease. Thread-safe."""
+
+    def __init__(self, initial, minimum, maximum, backoff_factor=BACKOFF_FACTOR, latency_tolerance=LATENCY_TOLERANCE):
+        self.window = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff_factor = backoff_factor
+        self.latency_tolerance = latency_tolerance
+        self.short_latency = None
+        self.long_latency = None
+        self.samples = 0
+        self.last_decrease = float("-inf")
+        self.peak = initial
+        self.decreases = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    @property
+    def limit(self):
+        """Requests that may be in flight."""
+        return max(1, int(self.window))
+
+    def record(self, latency, status):
+        """Adjusts the window for a response, given its latency (to the response headers) and HTTP status."""
+        with self._lock:
+            now = time.monotonic()
+            if status in THROTTLE_STATUSES:
+                self.throttled += 1
+                self._decrease(now)
+                return
+            if status >= 500:
+                # Other server errors say nothing about capacity; the window is held.
+                return
+
+            self.samples += 1
+            if self.samples == 1:
+                self.short_latency = self.long_latency = latency
+            else:
+                self.short_latency += SHORT_LATENCY_WEIGHT * (latency - self.short_latency)
+                self.long_latency += LONG_LATENCY_WEIGHT * (latency - self.long_latency)
+
+            if self.samples > LATENCY_WARMUP and self.short_latency > self.latency_tolerance * self.long_latency:
+                self._decrease(now)
+            else:
+                self.window = min(self.maximum, self.window + 1 / self.window)
+                self.peak = max(self.peak, self.window)
+
+    def _decrease(self, now):
+        # Responses to requests sent before the last decrease reflect the old window, so they do not decrease it again.
+        if now - self.last_decrease < (self.short_latency or 0.0):
+            return
+        self.window = max(self.minimum, self.window * self.backoff_factor)
+        self.last_decrease = now
+        self.decreases += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "window": self.limit,
+                "minimum": int(self.minimum),
+                "maximum": int(self.maximum),
+                "peak": int(self.peak),
+                "decreases": self.decreases,
+                "throttled": self.throttled,
+                "mean_latency": self.long_latency,
+            }
+
+
+windows = {family: AIMDWindow(**limits) for family, limits in FAMILIES.items()}
+
+
+def stats():
+    """Current window, peak window, decreases and throttled responses of each endpoint family."""
+    return {family: window.stats() for family, window in windows.items()}
+
+
+class Limiter:
+    """Keeps a client's requests of one family in flight within its window, across threads."""
+
+    def __init__(self, window):
+        self.window = window
+        self.in_flight = 0
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def slot(self):
+        with self._condition:
+            while self.in_flight >= self.window.limit:
+                self._condition.wait()
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.in_flight -= 1
+                self._condition.notify_all()
+
+
+class AsyncLimiter:
+    """Keeps a client's requests of one family in flight within its window, across tasks of one event loop."""
+
+    def __init__(self, window):
+        self.window = window
+        self.in_flight = 0
+        self._condition = asyncio.Condition()
+
+    @asynccontextmanager
+    async def slot(self):
+        async with self._condition:
+            while self.in_flight >= self.window.limit:
+                await self._condition.wait()
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self.in_flight -= 1
+                self._condition.notify_all()
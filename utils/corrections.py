@@ -0,0 +1,218 @@
+import json
+import logging
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from contextlib import contextmanager
+from datetime import date, timedelta
+from utils import ecfr
+from utils.cache import CACHE_DIR
+
+# Period granularities of the correction count cubes, with the pandas frequency of each period's start.
+GRANULARITIES = {"D": "D", "W": "W-MON", "M": "MS", "Y": "YS"}
+# The pandas period of each granularity, whose start is `period_start`.
+PERIODS = {"D": "D", "W": "W-SUN", "M": "M", "Y": "Y"}
+
+
+def period_start(day, granularity):
+    """Start date of the period of `granularity` containing `day`."""
+    if granularity == "D":
+        return day
+    if granularity == "W":
+        return day - timedelta(days=day.weekday())
+    if granularity == "M":
+        return day.replace(day=1)
+    if granularity == "Y":
+        return day.replace(month=1, day=1)
+    raise ValueError(f"Unknown granularity: {granularity}")
+
+
+class CorrectionsStore:
+    """
+    Local copy of eCFR corrections with pre-aggregated count cubes.
+
+    `sync` fetches the corrections list and applies only corrections that are new, have a newer `last_modified`, or
+    were removed. The same delta is applied to the count cubes, which hold the number of corrections per Title and
+    period (by error corrected date) at daily, weekly, monthly and yearly granularity, so reading a cube never regroups
+    the corrections.
+    """
+
+    def __init__(self, directory=CACHE_DIR):
+        self.directory = directory
+        self._initialized = False
+
+    @contextmanager
+    def _connect(self):
+        if not self._initialized:
+            os.makedirs(self.directory, exist_ok=True)
+        conn = sqlite3.connect(os.path.join(self.directory, "corrections.sqlite"), timeout=60)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS corrections (id INTEGER PRIMARY KEY, title INTEGER, error_occurred TEXT, "
+                "error_corrected TEXT, last_modified TEXT, data TEXT NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cubes (granularity TEXT NOT NULL, period TEXT NOT NULL, "
+                "title INTEGER NOT NULL, count INTEGER NOT NULL, PRIMARY KEY (granularity, period, title))"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            conn.commit()
+            self._initialized = True
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def version(self):
+        """Increases every time a sync changes the store, for use as a cache key."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return int(row[0]) if row else 0
+
+    def sync(self):
+        """Brings the store up to date with the eCFR. Returns the store version, or None if the fetch failed."""
+        data = ecfr.fetch_corrections()
+        if data is None:
+            return None
+        corrections = {c["id"]: c for c in data["ecfr_corrections"]}
+
+        with self._connect() as conn:
+            stored = dict(conn.execute("SELECT id, last_modified FROM corrections"))
+            changed = [
+                correction for correction_id, correction in corrections.items()
+                if correction_id not in stored or (correction["last_modified"] or "") > (stored[correction_id] or "")
+            ]
+            removed = stored.keys() - corrections.keys()
+            if not changed and not removed:
+                logging.info("Corrections are up to date")
+            else:
+                previous = list(removed) + [c["id"] for c in changed if c["id"] in stored]
+                for title, error_corrected in self._select(conn, previous):
+                    self._count(conn, title, error_corrected, -1)
+                conn.executemany(
+                    "DELETE FROM corrections WHERE id = ?", [(correction_id,) for correction_id in previous]
+                )
+
+                for correction in changed:
+                    conn.execute(
+                        "INSERT INTO corrections (id, title, error_occurred, error_corrected, last_modified, data) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (
+                            correction["id"], correction.get("title"), correction.get("error_occurred"),
+                            correction.get("error_corrected"), correction.get("last_modified"), json.dumps(correction),
+                        ),
+                    )
+                    self._count(conn, correction.get("title"), correction.get("error_corrected"), 1)
+                conn.execute("DELETE FROM cubes WHERE count = 0")
+                conn.execute(
+                    "INSERT INTO meta (key, value) VALUES ('version', 1) "
+                    "ON CONFLICT (key) DO UPDATE SET value = value + 1"
+                )
+                logging.info(f"Synced Corrections: {len(changed)} new or updated, {len(removed)} removed")
+
+        return self.version()
+
+    @staticmethod
+    def _select(conn, ids):
+        rows = []
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            rows += conn.execute(
+                f"SELECT title, error_corrected FROM corrections WHERE id IN ({', '.join('?' * len(batch))})", batch
+            ).fetchall()
+        return rows
+
+    @staticmethod
+    def _count(conn, title, error_corrected, delta):
+        if title is None or not error_corrected:
+            return
+        day = date.fromisoformat(error_corrected)
+        for granularity in GRANULARITIES:
+            conn.execute(
+                "INSERT INTO cubes (granularity, period, title, count) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (granularity, period, title) DO UPDATE SET count = count + excluded.count",
+                (granularity, period_start(day, granularity).isoformat(), title, delta),
+            )
+
+    def corrections(self):
+        """All stored corrections, as returned by the eCFR."""
+        with self._connect() as conn:
+            return [json.loads(data) for data, in conn.execute("SELECT data FROM corrections ORDER BY id")]
+
+    def cube(self, granularity):
+        """
+        Correction counts indexed by period start, with one column per Title and an `All` column.
+
+        Periods run from the earliest correction through today, with zero for periods without corrections.
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT period, title, count FROM cubes WHERE granularity = ?", (granularity,)
+            ).fetchall()
+
+        counts = pd.DataFrame(rows, columns=["period", "title", "count"])
+        if counts.empty:
+            return pd.DataFrame(columns=["All"], dtype=int)
+
+        cube = counts.pivot(index="period", columns="title", values="count")
+        cube.index = pd.to_datetime(cube.index)
+        periods = pd.date_range(
+            cube.index.min(), period_start(date.today(), granularity), freq=GRANULARITIES[granularity]
+        )
+        cube = cube.reindex(periods).fillna(0).astype(int)
+        cube["All"] = cube.sum(axis=1)
+        return cube
+
+
+def count_by_agency(corrections, index, agency_paths):
+    """
+    Daily correction counts of each Agency, as a DataFrame of `slug`, `error_corrected` (a date) and `count`.
+
+    A correction is counted once for every Agency covering any of its `cfr_references`, as joined by a
+    `coverage.HierarchyIndex` to the nodes each Agency covers (`agency_paths`). Corrections without references are
+    located at their Title.
+    """
+    dates, locations, owners = [], [], []
+    for correction in corrections:
+        if not correction.get("error_corrected"):
+            continue
+        hierarchies = [reference.get("hierarchy") or {} for reference in correction.get("cfr_references") or []]
+        for hierarchy in hierarchies or [{"title": correction.get("title")}]:
+            title = hierarchy.get("title") or correction.get("title")
+            if title is None:
+                continue
+            locations.append((int(title), hierarchy))
+            owners.append(len(dates))
+        dates.append(date.fromisoformat(correction["error_corrected"]))
+
+    pairs = index.join(agency_paths, locations)
+    pairs["correction"] = np.array(owners, dtype=np.int64)[pairs["location"].to_numpy()]
+    pairs = pairs.drop_duplicates(["correction", "slug"])
+    pairs["error_corrected"] = np.array(dates, dtype=object)[pairs["correction"].to_numpy()]
+    counts = pairs.groupby(["slug", "error_corrected"]).size().rename("count").reset_index()
+    return counts.sort_values(["slug", "error_corrected"], ignore_index=True)
+
+
+def agency_cube(counts, granularity):
+    """
+    Correction counts indexed by period start, with one column per Agency, from daily counts (see `count_by_agency`).
+
+    Periods run from the earliest correction through today, with zero for periods without corrections.
+    """
+    if counts is None or counts.empty:
+        return pd.DataFrame(dtype=int)
+
+    periods = pd.to_datetime(counts["error_corrected"]).dt.to_period(PERIODS[granularity]).dt.start_time
+    cube = counts.assign(period=periods).pivot_table(index="period", columns="slug", values="count", aggfunc="sum")
+    periods = pd.date_range(
+        cube.index.min(), period_start(date.today(), granularity), freq=GRANULARITIES[granularity]
+    )
+    return cube.reindex(periods).fillna(0).astype(int)
+
+
+corrections_store = CorrectionsStore()
@@ -0,0 +1,105 @@
+"""
+Assignment of CFR hierarchy locations (e.g. the `cfr_references` of corrections) to the Agencies covering them.
+
+The nodes of every Title are numbered in document order, the order of its node table (see `TitleIndex.node_table`),
+with each Title after the previous one. A node and its descendants then form one interval of numbers, and an Agency
+covers the intervals of the nodes its references resolve to. `HierarchyIndex.join` resolves every location to a node
+number and finds the Agency intervals containing each with sorted searches. It takes O((locations + intervals) log
+locations) plus the size of the result, instead of comparing every location with every Agency reference.
+"""
+import numpy as np
+import pandas as pd
+
+from utils.agencies import parse_path
+
+# Hierarchy levels a location may name, outermost first.
+LEVELS = ["title", "subtitle", "chapter", "subchapter", "part", "subpart", "subject_group", "section", "appendix"]
+
+
+class HierarchyIndex:
+    """Interval index of the hierarchy nodes of Titles, built from the node paths of each (in document order)."""
+
+    def __init__(self, paths_by_title):
+        self._offsets = {}
+        self._positions = {}
+        self._keys = {}
+        lasts = []
+        offset = 0
+        for title, paths in paths_by_title.items():
+            self._offsets[title] = offset
+            open_nodes = []
+            for i, path in enumerate(paths):
+                depth = path.count("/")
+                while open_nodes and open_nodes[-1][1] >= depth:
+                    lasts[open_nodes.pop()[0]] = offset + i - 1
+                open_nodes.append((offset + i, depth))
+                lasts.append(offset + i)
+                self._positions[path] = offset + i
+                node_type, identifier = path.rsplit("/", 1)[-1].split("-", 1)
+                self._keys.setdefault((title, node_type, identifier), []).append(path)
+            for position, _ in open_nodes:
+                lasts[position] = offset + len(paths) - 1
+            offset += len(paths)
+        self._lasts = np.array(lasts, dtype=np.int64)
+
+    def interval(self, path):
+        """First and last node number of a node and its descendants, or None if the path is unknown."""
+        position = self._positions.get(path)
+        return (position, int(self._lasts[position])) if position is not None else None
+
+    def locate(self, title, hierarchy):
+        """
+        Node number of a location in a Title, given as a mapping of level to identifier, or None.
+
+        The deepest level is looked up and the others disambiguate candidates. A location not found (e.g. a section
+        since removed) resolves to its closest enclosing node that is.
+        """
+        levels = [level for level in LEVELS if hierarchy.get(level) not in (None, "")]
+        while levels:
+            deepest = levels[-1]
+            if deepest == "title":
+                paths = [f"title-{title}"]
+            else:
+                paths = self._keys.get((title, deepest, str(hierarchy[deepest])), [])
+            for path in paths:
+                parts = parse_path(path)
+                if all(parts.get(level, str(hierarchy[level])) == str(hierarchy[level]) for level in levels):
+                    return self._positions.get(path)
+            levels.pop()
+        return None
+
+    def join(self, agency_paths, locations):
+        """
+        Pairs every location with each Agency covering it.
+
+        `agency_paths` maps Agency slugs to the paths of the nodes they cover, and `locations` is a list of
+        `(title, hierarchy)`. Returns a DataFrame of `location` (index into `locations`) and `slug`, one row per
+        covering Agency. Locations that cannot be resolved are left out.
+        """
+        slugs, starts, ends = [], [], []
+        for slug, paths in agency_paths.items():
+            for path in paths:
+                interval = self.interval(path)
+                if interval is not None:
+                    slugs.append(slug)
+                    starts.append(interval[0])
+                    ends.append(interval[1])
+
+        located = [(i, self.locate(title, hierarchy)) for i, (title, hierarchy) in enumerate(locations)]
+        located = [(i, position) for i, position in located if position is not None]
+        if not located or not slugs:
+            return pd.DataFrame({"location": pd.Series(dtype=np.int64), "slug": pd.Series(dtype=object)})
+        location_ids, positions = (np.array(values, dtype=np.int64) for values in zip(*located))
+
+        order = np.argsort(positions, kind="stable")
+        positions = positions[order]
+        lo = np.searchsorted(positions, np.array(starts, dtype=np.int64), side="left")
+        hi = np.searchsorted(positions, np.array(ends, dtype=np.int64), side="right")
+        lengths = hi - lo
+
+        # For each interval, the run of sorted positions lo..hi-1 that it contains.
+        intervals = np.repeat(np.arange(len(starts)), lengths)
+        runs = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths) + np.repeat(lo, lengths)
+        pairs = pd.DataFrame({"location": location_ids[order[runs]], "slug": np.array(slugs, dtype=object)[intervals]})
+        # An Agency covering a location through several of its nodes is only paired with it once.
+        return pairs.drop_duplicates(ignore_index=True)
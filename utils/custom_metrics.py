@@ -0,0 +1,114 @@
+"""
+Custom metrics computed in the same pass as word and readability counts.
+
+Each metric is a `MetricVisitor` in `VISITORS`. While a Title is parsed (see `utils.hierarchy`), every visitor sees each
+run of text between hierarchy elements once, and each XML element it names, and emits integer counts. Like
+`TextCounts`, the counts add up: they are rolled up to every enclosing node, summed over the distinct nodes of a
+group (see `utils.rollup`), and each metric's value is computed from the sums.
+
+A metric added to `VISITORS` is stored with the reference and Agency metrics and shown in the Agencies table.
+"""
+import re
+
+
+class MetricVisitor:
+    """
+    A custom metric. `counts` names the counts it emits.
+
+    `visit` returns the counts of a run of text (with whitespace collapsed), and each XML element whose tag is in
+    `elements` adds one to the count it maps to. `value` computes the metric from summed counts.
+    """
+
+    name = None
+    label = None
+    description = None
+    counts = ()
+    elements = {}
+
+    def visit(self, text):
+        return {}
+
+    def value(self, counts, text_counts):
+        """The metric from a mapping of count name to sum and the summed `TextCounts`, or None."""
+        return counts.get(self.counts[0], 0)
+
+
+class TermCount(MetricVisitor):
+    """Occurrences of any of a list of words or phrases, ignoring case."""
+
+    def __init__(self, name, label, description, terms):
+        self.name = name
+        self.label = label
+        self.description = description
+        self.counts = (name,)
+        self._pattern = re.compile(rf"\b(?:{'|'.join(map(re.escape, terms))})\b", re.IGNORECASE)
+
+    def visit(self, text):
+        return {self.name: len(self._pattern.findall(text))}
+
+
+class CrossReferences(MetricVisitor):
+    name = "cross_references"
+    label = "Cross-References"
+    description = "Citations of CFR sections (`§ 60.1`) and of other Titles (`40 CFR 60`)."
+    counts = ("cross_references",)
+
+    _pattern = re.compile(r"§§? ?\d|\d CFR \d")
+
+    def visit(self, text):
+        # A section's text starts with its own heading (`§ 60.1 Applicability.`), which is not a reference.
+        return {self.name: sum(1 for match in self._pattern.finditer(text) if match.start() > 0)}
+
+
+class ElementCount(MetricVisitor):
+    """Occurrences of XML elements."""
+
+    def __init__(self, name, label, description, tags):
+        self.name = name
+        self.label = label
+        self.description = description
+        self.counts = (name,)
+        self.elements = dict.fromkeys(tags, name)
+
+
+class AverageSentenceLength(MetricVisitor):
+    """Words per sentence, from the readability counts, which already add up."""
+
+    name = "average_sentence_length"
+    label = "Average Sentence Length"
+    description = "Words per sentence."
+
+    def value(self, counts, text_counts):
+        return text_counts.words / text_counts.sentences if text_counts.sentences else None
+
+
+VISITORS = [
+    TermCount(
+        "restrictive_terms", "Restrictive Terms", "Occurrences of “shall”, “must”, “may not”, “required” and "
+        "“prohibited”, which create obligations or prohibitions.",
+        ["shall", "must", "may not", "required", "prohibited"],
+    ),
+    CrossReferences(),
+    ElementCount("tables", "Tables", "Tables, including GPO tables.", ["GPOTABLE", "TABLE", "table"]),
+    ElementCount("figures", "Figures", "Graphics and images.", ["GPH", "img"]),
+    AverageSentenceLength(),
+]
+
+# Every count emitted by a visitor, and the XML tags counted, mapped to their count.
+COUNTS = [count for visitor in VISITORS for count in visitor.counts]
+ELEMENTS = {tag: count for visitor in VISITORS for tag, count in visitor.elements.items()}
+# Counts of text, which are memoized with the readability counts of each text segment (see `utils.fingerprints`).
+TEXT_COUNTS = [count for count in COUNTS if count not in ELEMENTS.values()]
+
+
+def visit(text):
+    """Counts of a run of text from every visitor."""
+    counts = {}
+    for visitor in VISITORS:
+        counts.update(visitor.visit(text))
+    return counts
+
+
+def values(counts, text_counts):
+    """Every metric, keyed by name, from summed counts (missing counts are zero) and the summed `TextCounts`."""
+    return {visitor.name: visitor.value(counts, text_counts) for visitor in VISITORS}
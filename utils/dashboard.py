@@ -0,0 +1,222 @@
+"""
+In-process cache of the data shown by the dashboard pages, shared by every page and session.
+
+Metrics, history and run reports are read through one `Dashboard` per Redis server (see `connect`). Its data is keyed
+by the versions published in Redis: the current metrics generation, `history.HISTORY_VERSION_KEY` and
+`tracing.RUN_REPORTS_VERSION_KEY`. A background thread reads the three in one round trip every `POLL_SECONDS` and
+loads whatever changed before swapping it in, so once the data is warm, page interactions never wait on Redis.
+
+The Agency and Title lists of the eCFR (see `agencies` and `titles`) are kept in memory too, and refreshed in the
+background once they are older than `ECFR_TTL_SECONDS`.
+
+Returned data is shared between sessions and must not be modified.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+import redis
+
+from utils import ecfr, generations, history, snapshot, tracing
+
+POLL_SECONDS = float(os.getenv("DASHBOARD_POLL_SECONDS", 30))
+ECFR_TTL_SECONDS = float(os.getenv("DASHBOARD_ECFR_TTL_SECONDS", 6 * 3600))
+
+_lists = {}
+_lists_lock = threading.Lock()
+_refreshing = set()
+
+
+def _refresh_list(name, fetch):
+    try:
+        value = fetch()
+        if value is not None:
+            with _lists_lock:
+                _lists[name] = (time.monotonic(), value)
+        else:
+            logging.warning(f"Failed to refresh {name}; serving the previous list")
+    finally:
+        with _lists_lock:
+            _refreshing.discard(name)
+
+
+def _cached_list(name, fetch):
+    with _lists_lock:
+        cached = _lists.get(name)
+        stale = cached is not None and time.monotonic() - cached[0] > ECFR_TTL_SECONDS and name not in _refreshing
+        if stale:
+            _refreshing.add(name)
+    if cached is None:
+        # Only the first request waits on the eCFR; failures are not cached, so the next request tries again.
+        value = fetch()
+        if value is not None:
+            with _lists_lock:
+                _lists.setdefault(name, (time.monotonic(), value))
+        return value
+    if stale:
+        threading.Thread(target=_refresh_list, args=(name, fetch), daemon=True).start()
+    return cached[1]
+
+
+def agencies():
+    """The eCFR Agencies list, or None if it has never been fetched successfully."""
+    return _cached_list("agencies", ecfr.fetch_agencies)
+
+
+def titles():
+    """The eCFR Titles list, or None if it has never been fetched successfully."""
+    return _cached_list("titles", ecfr.fetch_titles)
+
+
+class _Generation:
+    """The snapshot frames and serialized Agency metrics of one metrics generation."""
+
+    def __init__(self, generation, agencies, references, corrections, metrics):
+        self.generation = generation
+        self.agencies = agencies
+        self.references = references
+        self.corrections = corrections
+        self.metrics = metrics
+        self.decoded = {}
+
+
+class _Histories:
+    """The serialized histories of one history version, by Title."""
+
+    def __init__(self, histories):
+        self.histories = histories
+        self.decoded = {}
+
+
+class Dashboard:
+    def __init__(self, r, poll_seconds=POLL_SECONDS):
+        self.r = r
+        self.poll_seconds = poll_seconds
+        self._versions = None
+        self._generation = _Generation(None, None, None, None, {})
+        self._histories = _Histories({})
+        self._reports = []
+        self._start_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._thread = None
+
+    def _start(self):
+        """Loads the data on first use and starts the background refresh."""
+        if self._versions is not None and self._thread is not None:
+            return
+        with self._start_lock:
+            if self._versions is None:
+                try:
+                    self.refresh()
+                except redis.RedisError as error:
+                    logging.error(f"Failed to load dashboard data: {error}")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._poll, daemon=True, name="dashboard-refresh")
+                self._thread.start()
+
+    def _poll(self):
+        while True:
+            time.sleep(self.poll_seconds)
+            try:
+                self.refresh()
+            except redis.RedisError as error:
+                logging.error(f"Failed to refresh dashboard data: {error}")
+
+    def refresh(self):
+        """Loads the data whose published version changed since the last refresh. Returns whether anything did."""
+        with self._refresh_lock:
+            keys = [generations.CURRENT_GENERATION_KEY, history.HISTORY_VERSION_KEY, tracing.RUN_REPORTS_VERSION_KEY]
+            versions = tuple(v.decode() if v is not None else None for v in self.r.mget(keys))
+            if versions == self._versions:
+                return False
+            previous = self._versions or (object(),) * len(versions)
+            generation, history_version, reports_version = versions
+
+            # Everything is loaded before anything is swapped in, so readers never wait on a partial load.
+            loaded_generation = self._generation
+            if generation != previous[0]:
+                loaded_generation = self._load_generation(generation)
+            histories = self._histories
+            if history_version != previous[1]:
+                histories = self._load_histories()
+                if histories is None:
+                    # Histories are found through the Titles list; without it they are loaded on the next refresh.
+                    histories, history_version = self._histories, previous[1] if self._versions else None
+            reports = tracing.read_reports(self.r) if reports_version != previous[2] else self._reports
+
+            self._generation, self._histories, self._reports = loaded_generation, histories, reports
+            self._versions = (generation, history_version, reports_version)
+            logging.info(f"Loaded dashboard data of generation {generation}, history version {history_version} and "
+                         f"run reports version {reports_version}")
+            return True
+
+    def _load_generation(self, generation):
+        tables = generations.read_snapshot(self.r, generation) or {}
+        agency_frame, reference_frame, correction_frame = (
+            snapshot.decode(tables[name]) if name in tables else None
+            for name in ["agencies", "references", "corrections"]
+        )
+        return _Generation(
+            generation, agency_frame, reference_frame, correction_frame,
+            generations.read_all_agencies(self.r, generation),
+        )
+
+    def _load_histories(self):
+        titles_data = titles()
+        if not titles_data:
+            return None
+        numbers = [t["number"] for t in titles_data]
+        values = self.r.mget([history.HISTORY_KEY.format(title=number) for number in numbers])
+        return _Histories({number: v for number, v in zip(numbers, values) if v is not None})
+
+    def generation(self):
+        """The published metrics generation the data is from."""
+        self._start()
+        return self._generation.generation
+
+    def snapshot(self):
+        """The Agency and reference snapshot frames of the current generation, or None for each if it has none."""
+        self._start()
+        current = self._generation
+        return current.agencies, current.references
+
+    def correction_counts(self):
+        """Daily correction counts of each Agency in the current generation (see `snapshot`), or None."""
+        self._start()
+        return self._generation.corrections
+
+    def agency_metrics(self, slugs):
+        """Metrics of each Agency in the current generation, or None for Agencies it does not have."""
+        self._start()
+        current = self._generation
+        for slug in slugs:
+            if slug not in current.decoded and slug in current.metrics:
+                current.decoded[slug] = json.loads(current.metrics[slug])
+        return [current.decoded.get(slug) for slug in slugs]
+
+    def title_history(self, title):
+        """A Title's history (see `utils.history`), or None if none has been calculated."""
+        self._start()
+        current = self._histories
+        if title not in current.decoded and title in current.histories:
+            current.decoded[title] = history.decode(current.histories[title])
+        return current.decoded.get(title)
+
+    def run_reports(self):
+        """The newest run reports, most recent first."""
+        self._start()
+        return self._reports
+
+
+_dashboards = {}
+_dashboards_lock = threading.Lock()
+
+
+def connect(host, port, password):
+    """The shared `Dashboard` of a Redis server."""
+    with _dashboards_lock:
+        if (host, port) not in _dashboards:
+            _dashboards[host, port] = Dashboard(redis.Redis(host=host, port=port, password=password, ssl=True))
+        return _dashboards[host, port]
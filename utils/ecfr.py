@@ -1,10 +1,14 @@
 import logging
 import requests
 
+from contextlib import contextmanager
+from utils.cache import READ_CHUNK_SIZE, xml_key, xml_store
+from utils.client import BASE_URL, client
+
 
 def fetch_agencies():
     try:
-        response = requests.get("https://www.ecfr.gov/api/admin/v1/agencies.json")
+        response = client.get(f"{BASE_URL}/api/admin/v1/agencies.json", revalidate=True)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as error:
@@ -13,7 +17,7 @@ def fetch_agencies():
 
 
 def fetch_corrections(date=None, title=None):
-    url = "https://www.ecfr.gov/api/admin/v1/corrections.json"
+    url = f"{BASE_URL}/api/admin/v1/corrections.json"
 
     params = {}
     if date is not None:
@@ -22,7 +26,7 @@ def fetch_corrections(date=None, title=None):
         params["title"] = str(title)
 
     try:
-        response = requests.get(url, params=params)
+        response = client.get(url, params=params, revalidate=True)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as error:
@@ -32,7 +36,7 @@ def fetch_corrections(date=None, title=None):
 
 def fetch_ancestry_for_title(date, title, subtitle=None, chapter=None, subchapter=None, part=None, section=None):
     """Fetches the full ancestry for a given CFR reference."""
-    url = f"https://www.ecfr.gov/api/versioner/v1/ancestry/{date}/title-{title}.json"
+    url = f"{BASE_URL}/api/versioner/v1/ancestry/{date}/title-{title}.json"
     params = {}
 
     if subtitle is not None:
@@ -46,43 +50,80 @@ def fetch_ancestry_for_title(date, title, subtitle=None, chapter=None, subchapte
     if section is not None:
         params["section"] = section
 
-    response = requests.get(url, params=params)
+    response = client.get(url, params=params)
     if response.status_code == 200:
         return response.json()
     return None
 
 
-def fetch_xml_for_title(date, title, subtitle=None, chapter=None, subchapter=None, part=None):
+def fetch_xml_for_title(date, title, subtitle=None, chapter=None, subchapter=None, part=None, section=None,
+                        appendix=None):
     """
     Source XML for a title or subset of a title.
 
     Requests can be for entire titles or part level and below.
     - Downloadable XML document is returned for title requests.
     - Processed XML is returned if part, subpart, section, or appendix is requested.
+
+    Responses are kept in the local XML store, keyed by issue date and hierarchy slice, so repeated requests for an
+    unchanged title are served from disk. Use `open_xml_for_title` to read large titles without loading them whole.
     """
-    url = f"https://www.ecfr.gov/api/versioner/v1/full/{date}/title-{title}.xml"
+    hierarchy = {"subtitle": subtitle, "chapter": chapter, "subchapter": subchapter, "part": part, "section": section,
+                 "appendix": appendix}
+    key = xml_key(date, title, **hierarchy)
+    cached = xml_store.get(key)
+    if cached is not None:
+        return cached
+
+    if download_xml(date, title, **hierarchy) is None:
+        return None
+    return xml_store.get(key)
 
-    params = {}
-    if subtitle:
-        params["subtitle"] = subtitle
-    if chapter:
-        params["chapter"] = chapter
-    if subchapter:
-        params["subchapter"] = subchapter
-    if part:
-        params["part"] = part
 
+def download_xml(date, title, subtitle=None, chapter=None, subchapter=None, part=None, section=None, appendix=None):
+    """
+    Streams XML into the local XML store chunk by chunk, so the response is never held in memory.
+
+    Returns the content hash of the stored XML, or None on failure.
+    """
+    hierarchy = {"subtitle": subtitle, "chapter": chapter, "subchapter": subchapter, "part": part, "section": section,
+                 "appendix": appendix}
+    url = f"{BASE_URL}/api/versioner/v1/full/{date}/title-{title}.xml"
+    params = {name: value for name, value in hierarchy.items() if value}
+
+    writer = xml_store.writer(xml_key(date, title, **hierarchy))
     try:
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-        return response.text
+        with client.get(url, params=params, stream=True) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=READ_CHUNK_SIZE):
+                writer.write(chunk)
+        return writer.commit()
     except requests.exceptions.RequestException as error:
+        writer.abort()
         logging.error(f"Failed to fetch XML for title {title} on {date}: {error}")
         return None
+    except BaseException:
+        writer.abort()
+        raise
+
+
+@contextmanager
+def open_xml_for_title(date, title):
+    """
+    Yields a title's XML as a binary file object read from the local XML store, downloading it first on a miss.
+
+    Yields None if the XML could not be fetched.
+    """
+    key = xml_key(date, title)
+    if xml_store.digest(key) is None and download_xml(date, title) is None:
+        yield None
+        return
+    with xml_store.open(key) as f:
+        yield f
 
 
 def fetch_titles():
-    response = requests.get("https://www.ecfr.gov/api/versioner/v1/titles.json")
+    response = client.get(f"{BASE_URL}/api/versioner/v1/titles.json", revalidate=True)
     if response.status_code == 200:
         return response.json().get("titles", [])
     else:
@@ -108,7 +149,9 @@ def fetch_versions_for_title(title, gte=None, lte=None, on=None, subtitle=None,
         params["part"] = part
 
     try:
-        response = requests.get(f"https://www.ecfr.gov/api/versioner/v1/versions/title-{title}.json", params=params)
+        response = client.get(
+            f"{BASE_URL}/api/versioner/v1/versions/title-{title}.json", params=params, revalidate=True
+        )
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as error:
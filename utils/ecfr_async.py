@@ -0,0 +1,191 @@
+import asyncio
+import logging
+import random
+import time
+
+import aiohttp
+
+from utils import concurrency
+from utils.cache import xml_key, xml_store
+from utils.client import (BACKOFF_BASE, BACKOFF_MAX, BASE_URL, CONNECT_TIMEOUT, MAX_RETRIES, READ_TIMEOUT,
+                          RETRY_STATUSES, client, endpoint_name, retry_after)
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class AsyncECFRClient:
+    """
+    Asyncio counterpart to `utils.ecfr` for fetching many independent resources concurrently.
+
+    Use as an async context manager. Requests in flight, including reading their bodies, are kept within the adaptive
+    window of their endpoint family (see `utils.concurrency`); bodies are read in chunks; failed requests are retried
+    with the same backoff policy as the synchronous client, and counted in its per-endpoint stats. Cancelling a task
+    closes its connection.
+    """
+
+    def __init__(self, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT, max_retries=MAX_RETRIES):
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.max_retries = max_retries
+        self.session = None
+        self._limiters = {family: concurrency.AsyncLimiter(window) for family, window in concurrency.windows.items()}
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession(
+            # The windows limit requests in flight, so the connection pool only needs to fit them at their maximum.
+            connector=aiohttp.TCPConnector(limit=sum(int(w.maximum) for w in concurrency.windows.values())),
+            timeout=self.timeout,
+            raise_for_status=False,
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    async def _get(self, url, params=None, body="json", key=None):
+        """
+        Returns `(status, body)`, where body is parsed JSON or raw bytes depending on `body`.
+
+        With `body="store"`, the response is streamed into the local XML store under `key` as it arrives and the body
+        returned is its content hash.
+        """
+        endpoint = endpoint_name(url)
+        family = concurrency.endpoint_family(url)
+        params = {k: str(v) for k, v in (params or {}).items() if v is not None}
+        attempt = 0
+        while True:
+            delay = None
+            try:
+                async with self._limiters[family].slot():
+                    started = time.perf_counter()
+                    async with self.session.get(url, params=params) as response:
+                        latency = time.perf_counter() - started
+                        concurrency.windows[family].record(latency, response.status)
+                        if response.status in RETRY_STATUSES and attempt < self.max_retries:
+                            delay = retry_after(response)
+                            logging.warning(f"Retrying {endpoint} after HTTP {response.status}")
+                            client.record(endpoint, retried=True)
+                        elif response.status >= 400:
+                            client.record(endpoint, latency, failed=True)
+                            return response.status, None
+                        else:
+                            content = await self._read(response, body, key)
+                            client.record(endpoint, time.perf_counter() - started)
+                            return response.status, content
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as error:
+                if attempt >= self.max_retries:
+                    client.record(endpoint, time.perf_counter() - started, failed=True)
+                    raise
+                logging.warning(f"Retrying {endpoint} after {error!r}")
+                client.record(endpoint, retried=True)
+            except aiohttp.ClientError:
+                client.record(endpoint, time.perf_counter() - started, failed=True)
+                raise
+
+            if delay is None:
+                delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+            await asyncio.sleep(min(delay, BACKOFF_MAX))
+            attempt += 1
+
+    async def _read(self, response, body, key):
+        if body == "json":
+            return await response.json(content_type=None)
+        if body == "store":
+            return await self._store(response, key)
+        chunks = []
+        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    @staticmethod
+    async def _store(response, key):
+        writer = await asyncio.to_thread(xml_store.writer, key)
+        try:
+            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                await asyncio.to_thread(writer.write, chunk)
+        except BaseException:
+            await asyncio.to_thread(writer.abort)
+            raise
+        return await asyncio.to_thread(writer.commit)
+
+    async def _get_or_log(self, description, url, params=None, body="json", key=None):
+        # Failures are logged and return None, so one failed fetch does not cancel the task group it runs in.
+        try:
+            status, content = await self._get(url, params=params, body=body, key=key)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            logging.error(f"Failed to fetch {description}: {error!r}")
+            return None
+        if content is None:
+            logging.error(f"Failed to fetch {description}: HTTP {status}")
+        return content
+
+    async def fetch_agencies(self):
+        return await self._get_or_log("Agencies", f"{BASE_URL}/api/admin/v1/agencies.json")
+
+    async def fetch_corrections(self, date=None, title=None):
+        return await self._get_or_log(
+            "Corrections", f"{BASE_URL}/api/admin/v1/corrections.json", params={"date": date, "title": title}
+        )
+
+    async def fetch_titles(self):
+        data = await self._get_or_log("Titles", f"{BASE_URL}/api/versioner/v1/titles.json")
+        return data.get("titles", []) if data is not None else None
+
+    async def fetch_versions_for_title(self, title, gte=None, lte=None, on=None, subtitle=None, chapter=None,
+                                       subchapter=None, part=None):
+        params = {"subtitle": subtitle, "chapter": chapter, "subchapter": subchapter, "part": part}
+        if on is not None:
+            params["issue_date[on]"] = on
+        else:
+            params["issue_date[gte]"] = gte
+            params["issue_date[lte]"] = lte
+
+        return await self._get_or_log(
+            f"Content Versions for title {title}",
+            f"{BASE_URL}/api/versioner/v1/versions/title-{title}.json",
+            params=params,
+        )
+
+    async def fetch_structure_for_title(self, date, title):
+        """Hierarchy of a title on a date, with the `size` of each node's XML."""
+        return await self._get_or_log(
+            f"Structure for title {title} on {date}",
+            f"{BASE_URL}/api/versioner/v1/structure/{date}/title-{title}.json",
+        )
+
+    async def fetch_xml_for_title(self, date, title, subtitle=None, chapter=None, subchapter=None, part=None,
+                                  section=None, appendix=None):
+        """Source XML for a title or subset of a title, read through the local XML store."""
+        hierarchy = {"subtitle": subtitle, "chapter": chapter, "subchapter": subchapter, "part": part,
+                     "section": section, "appendix": appendix}
+        key = xml_key(date, title, **hierarchy)
+        cached = await asyncio.to_thread(xml_store.get, key)
+        if cached is not None:
+            return cached
+
+        if await self.download_xml(date, title, **hierarchy) is None:
+            return None
+        return await asyncio.to_thread(xml_store.get, key)
+
+    async def download_xml(self, date, title, subtitle=None, chapter=None, subchapter=None, part=None, section=None,
+                           appendix=None):
+        """
+        Streams XML into the local XML store as it arrives, so the response is never held in memory.
+
+        Returns the content hash of the stored XML, or None on failure.
+        """
+        hierarchy = {"subtitle": subtitle, "chapter": chapter, "subchapter": subchapter, "part": part,
+                     "section": section, "appendix": appendix}
+        return await self._get_or_log(
+            f"XML for title {title} on {date}",
+            f"{BASE_URL}/api/versioner/v1/full/{date}/title-{title}.xml",
+            params=hierarchy,
+            body="store",
+            key=xml_key(date, title, **hierarchy),
+        )
+
+    async def prefetch_xml(self, date, title):
+        """Ensures the XML for a title is in the local XML store. Returns False if it could not be fetched."""
+        if await asyncio.to_thread(xml_store.digest, xml_key(date, title)) is not None:
+            return True
+        return await self.download_xml(date, title) is not None
+
@@ -0,0 +1,81 @@
+"""
+Plans the XML downloads that cover a set of sections and appendices of a Title on one issue date with the fewest bytes.
+
+Sizes come from the Title's structure (see the eCFR structure endpoint), which gives the `size` of every node's XML.
+Each request also costs `REQUEST_OVERHEAD_BYTES`, so many small requests can lose to one larger one. Every part is
+fetched either whole or section by section, whichever is smaller, and the whole Title is fetched instead if it is
+smaller than all of that together.
+"""
+import os
+
+# What a request costs beyond its body (round trip, server work and the per-request index), in bytes of XML.
+REQUEST_OVERHEAD_BYTES = int(os.getenv("ECFR_REQUEST_OVERHEAD_BYTES", 64 * 1024))
+# Estimates for sizes a structure does not give.
+DEFAULT_UNIT_BYTES = 8 * 1024
+DEFAULT_PART_BYTES = 32 * 1024
+
+
+class StructureSizes:
+    """XML sizes of a Title and of its parts, sections and appendices, from its structure (which may be None)."""
+
+    def __init__(self, structure=None):
+        self.title = None
+        self.parts = {}
+        self.units = {}
+        if structure:
+            self._walk(structure)
+            if self.title is None and self.parts:
+                self.title = sum(self.parts.values())
+
+        # Sizes that are not known (e.g. of sections added after the structure's date) are estimated by the mean.
+        self.unit_default = sum(self.units.values()) / len(self.units) if self.units else DEFAULT_UNIT_BYTES
+        self.part_default = sum(self.parts.values()) / len(self.parts) if self.parts else DEFAULT_PART_BYTES
+
+    def _walk(self, node):
+        node_type, identifier, size = node.get("type"), node.get("identifier"), node.get("size")
+        if size:
+            if node_type == "title":
+                self.title = size
+            elif node_type == "part":
+                self.parts[identifier] = size
+            elif node_type in ("section", "appendix"):
+                self.units[(node_type, identifier)] = size
+        for child in node.get("children") or []:
+            self._walk(child)
+
+    def unit(self, version):
+        return self.units.get((version["type"], version["identifier"]), self.unit_default)
+
+    def part(self, part, versions):
+        # A part is at least as large as the sections requested from it.
+        return self.parts.get(part) or max(self.part_default, sum(self.unit(version) for version in versions))
+
+
+def plan(versions, sizes, overhead=REQUEST_OVERHEAD_BYTES):
+    """
+    Requests that cover the given content versions, as (hierarchy parameters, versions) pairs.
+
+    The parameters are those of `fetch_xml_for_title`, e.g. `{"part": "60", "section": "60.1"}`. A single pair with
+    parameters of None means the whole Title.
+    """
+    by_part = {}
+    for version in versions:
+        by_part.setdefault(version["part"], []).append(version)
+
+    requests = []
+    total = 0
+    for part, part_versions in by_part.items():
+        units = sum(sizes.unit(version) + overhead for version in part_versions)
+        whole = sizes.part(part, part_versions) + overhead
+        if whole < units:
+            requests.append(({"part": part}, part_versions))
+            total += whole
+        else:
+            requests.extend(
+                ({"part": part, version["type"]: version["identifier"]}, [version]) for version in part_versions
+            )
+            total += units
+
+    if sizes.title is not None and sizes.title + overhead < total:
+        return [(None, list(versions))]
+    return requests
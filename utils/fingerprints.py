@@ -0,0 +1,101 @@
+"""
+Readability and metric counts of text segments memoized by content hash.
+
+Most sections are byte-identical across issue dates and reruns, so the counts of each segment of text (see
+`utils.hierarchy`) are kept in a persistent store keyed by a fingerprint of its normalized text, and only segments
+whose fingerprint is new are tokenized and visited by the custom metrics (see `utils.custom_metrics`).
+"""
+import hashlib
+import json
+import os
+import sqlite3
+
+from contextlib import contextmanager
+from utils import custom_metrics
+from utils.cache import CACHE_DIR
+from utils.scoring import TextCounts
+
+# Part of every fingerprint; increase it when `scoring.count_text` or a metric's `visit` changes so stale counts are
+# not reused.
+COUNTS_VERSION = 1
+
+
+def normalize(text):
+    """Collapses runs of whitespace, which separate tokens and sentences the same way whatever their length."""
+    return " ".join(text.split())
+
+
+def fingerprint(text):
+    """Fingerprint of a normalized text."""
+    return hashlib.blake2b(f"{COUNTS_VERSION}\0{text}".encode("utf-8"), digest_size=16).digest()
+
+
+class CountsStore:
+    """Persistent mapping of text fingerprints to `TextCounts` and metric counts."""
+
+    def __init__(self, directory=CACHE_DIR):
+        self.directory = directory
+        self._initialized = False
+
+    @contextmanager
+    def _connect(self):
+        if not self._initialized:
+            os.makedirs(self.directory, exist_ok=True)
+        conn = sqlite3.connect(os.path.join(self.directory, "counts.sqlite"), timeout=60)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS counts (fingerprint BLOB PRIMARY KEY, sentences INTEGER NOT NULL, "
+                "words INTEGER NOT NULL, syllables INTEGER NOT NULL, polysyllables INTEGER NOT NULL) WITHOUT ROWID"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS metric_counts (fingerprint BLOB PRIMARY KEY, counts TEXT NOT NULL) "
+                "WITHOUT ROWID"
+            )
+            conn.commit()
+            self._initialized = True
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get_many(self, fingerprints):
+        """
+        Stored `(TextCounts, metric counts)` of the given fingerprints, keyed by fingerprint.
+
+        Unknown fingerprints are left out, as are those stored before a metric's text counts were added.
+        """
+        fingerprints = list(fingerprints)
+        found = {}
+        with self._connect() as conn:
+            for start in range(0, len(fingerprints), 500):
+                batch = fingerprints[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT fingerprint, sentences, words, syllables, polysyllables, metric_counts.counts FROM counts "
+                    f"JOIN metric_counts USING (fingerprint) WHERE fingerprint IN ({', '.join('?' * len(batch))})",
+                    batch,
+                )
+                for row in rows:
+                    metric_counts = json.loads(row[5])
+                    if all(count in metric_counts for count in custom_metrics.TEXT_COUNTS):
+                        found[row[0]] = (TextCounts(*row[1:5]), metric_counts)
+        return found
+
+    def put_many(self, counts):
+        """Stores `(TextCounts, metric counts)` keyed by fingerprint."""
+        if not counts:
+            return
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO counts (fingerprint, sentences, words, syllables, polysyllables) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(key, c.sentences, c.words, c.syllables, c.polysyllables) for key, (c, _) in counts.items()],
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO metric_counts (fingerprint, counts) VALUES (?, ?)",
+                [(key, json.dumps(m, separators=(",", ":"))) for key, (_, m) in counts.items()],
+            )
+
+
+counts_store = CountsStore()
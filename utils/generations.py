@@ -0,0 +1,109 @@
+"""
+Generational storage of published Agency metrics in Redis.
+
+Each metrics run writes every Agency's metrics into a new generation, a single hash of slug to JSON, using pipelined
+batch writes. Readers only ever follow `CURRENT_GENERATION_KEY`, which `publish` swaps in one transaction once the
+generation is complete, so they always see the full output of a single run. The newest `GENERATION_RETENTION`
+generations are kept and older ones are deleted by `collect_garbage`.
+
+A generation can also carry a columnar snapshot of its metrics (see `utils.snapshot`), stored as Parquet bytes.
+"""
+import json
+import os
+import time
+import uuid
+
+CURRENT_GENERATION_KEY = "metrics:generation"
+# Every generation written, scored by creation time.
+GENERATIONS_KEY = "metrics:generations"
+
+GENERATION_RETENTION = int(os.getenv("METRICS_GENERATION_RETENTION", 3))
+WRITE_BATCH_SIZE = 100
+
+
+def agencies_key(generation):
+    return f"metrics:agencies:{generation}"
+
+
+def snapshot_key(generation):
+    return f"metrics:snapshot:{generation}"
+
+
+def new_generation():
+    return f"{time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())}-{uuid.uuid4().hex[:8]}"
+
+
+def current_generation(r):
+    generation = r.get(CURRENT_GENERATION_KEY)
+    return generation.decode() if generation is not None else None
+
+
+def read_agencies(r, generation, slugs):
+    """Metrics of each Agency in a generation, or None for Agencies it does not have."""
+    if generation is None or not slugs:
+        return [None] * len(slugs)
+    return [json.loads(v) if v is not None else None for v in r.hmget(agencies_key(generation), slugs)]
+
+
+def read_all_agencies(r, generation):
+    """Raw (serialized) metrics of every Agency in a generation."""
+    if generation is None:
+        return {}
+    return {slug.decode(): v for slug, v in r.hgetall(agencies_key(generation)).items()}
+
+
+def write_agencies(r, generation, metrics, batch_size=WRITE_BATCH_SIZE):
+    """
+    Writes serialized metrics (slug to JSON) into a generation in one round trip, `batch_size` Agencies per command.
+
+    The generation is registered first so it is garbage-collected even if it is never published.
+    """
+    items = list(metrics.items())
+    with r.pipeline(transaction=False) as pipe:
+        pipe.zadd(GENERATIONS_KEY, {generation: time.time()})
+        for start in range(0, len(items), batch_size):
+            pipe.hset(agencies_key(generation), mapping=dict(items[start:start + batch_size]))
+        pipe.execute()
+
+
+def write_snapshot(r, generation, tables):
+    """Stores encoded snapshot tables (name to Parquet bytes) for a generation."""
+    r.hset(snapshot_key(generation), mapping=tables)
+
+
+def read_snapshot(r, generation):
+    """Encoded snapshot tables of a generation, or None if it has no snapshot."""
+    if generation is None:
+        return None
+    tables = r.hgetall(snapshot_key(generation))
+    return {name.decode(): data for name, data in tables.items()} or None
+
+
+def publish(r, generation, state=None, replace_state=False):
+    """
+    Atomically makes `generation` current, together with any job state that must match it.
+
+    `state` maps hash keys to fields to set in the same transaction; with `replace_state` those hashes are cleared
+    first.
+    """
+    with r.pipeline(transaction=True) as pipe:
+        for key, mapping in (state or {}).items():
+            if replace_state:
+                pipe.delete(key)
+            if mapping:
+                pipe.hset(key, mapping=mapping)
+        pipe.set(CURRENT_GENERATION_KEY, generation)
+        pipe.execute()
+
+
+def collect_garbage(r, retain=GENERATION_RETENTION):
+    """Deletes all but the newest `retain` generations, never the current one. Returns the deleted generations."""
+    current = current_generation(r)
+    generations = [g.decode() for g in r.zrevrange(GENERATIONS_KEY, 0, -1)]
+    expired = [g for g in generations[retain:] if g != current]
+    if expired:
+        with r.pipeline(transaction=False) as pipe:
+            pipe.delete(*[agencies_key(g) for g in expired], *[snapshot_key(g) for g in expired])
+            pipe.zrem(GENERATIONS_KEY, *expired)
+            pipe.execute()
+    return expired
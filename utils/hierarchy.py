@@ -0,0 +1,270 @@
+import time
+import xml.etree.ElementTree as ET
+
+from utils import custom_metrics
+from utils.fingerprints import fingerprint, normalize
+from utils.scoring import TextCounts, count_text
+from utils.text import HIERARCHY_ELEMENTS, iter_chunks
+
+# Source XML `TYPE` attributes mapped to the hierarchy level names used by the eCFR API.
+DIV_TYPES = {
+    "TITLE": "title",
+    "SUBTITLE": "subtitle",
+    "CHAPTER": "chapter",
+    "SUBCHAP": "subchapter",
+    "PART": "part",
+    "SUBPART": "subpart",
+    "SUBJGRP": "subject_group",
+    "SECTION": "section",
+    "APPENDIX": "appendix",
+}
+
+REFERENCE_LEVELS = [level for level, _, _ in HIERARCHY_ELEMENTS]
+
+# Characters of text segments counted together, so their counts are looked up in the counts store in batches.
+COUNT_BATCH_CHARS = 1024 * 1024
+
+
+class HierarchyNode:
+    """A `DIV` element of a title with its text span, `<P>` word count, readability counts and metric counts."""
+
+    __slots__ = (
+        "id", "type", "identifier", "parent", "depth", "start", "end", "last", "word_count", "counts", "metrics",
+    )
+
+    def __init__(self, id, type, identifier, parent, depth, start):
+        self.id = id
+        self.type = type
+        self.identifier = identifier
+        self.parent = parent
+        self.depth = depth
+        # Span of the node's text, as character offsets into the text of the title.
+        self.start = start
+        self.end = start
+        self.last = id
+        self.word_count = 0
+        self.counts = TextCounts()
+        # Counts of the custom metrics (see `utils.custom_metrics`) by name; counts that are zero are left out.
+        self.metrics = {}
+
+
+class TitleIndex:
+    """
+    Index of every hierarchy node in a title's XML, built from a single streaming parse.
+
+    The text itself is not kept: each node records the span of the title's text it covers along with its counts, which
+    are taken as the text streams past. Nodes are also indexed by `(type, identifier)` so CFR references resolve by
+    lookup.
+    """
+
+    def __init__(self, title=None, date=None):
+        self.title = title
+        self.date = date
+        self.nodes = []
+        self._by_key = {}
+        # Time spent tokenizing text for readability counts while building, and the characters tokenized.
+        self.tokenize_seconds = 0.0
+        self.tokenized_chars = 0
+        # Distinct text segments, and those whose counts were found in the counts store.
+        self.segments = 0
+        self.cached_segments = 0
+
+    def _add(self, node):
+        self.nodes.append(node)
+        self._by_key.setdefault((node.type, node.identifier), []).append(node.id)
+
+    def ancestors(self, node):
+        """Nodes enclosing `node`, outermost first."""
+        ancestors = []
+        while node.parent is not None:
+            node = self.nodes[node.parent]
+            ancestors.append(node)
+        return ancestors[::-1]
+
+    def path(self, node):
+        """Hierarchy of `node` as a mapping of level to identifier, e.g. `{"title": "40", "chapter": "I"}`."""
+        return {n.type: n.identifier for n in self.ancestors(node) + [node]}
+
+    def path_key(self, node):
+        """Stable key for `node` across runs, e.g. `title-40/chapter-I/subchapter-C/part-60`."""
+        return "/".join(f"{n.type}-{n.identifier}" for n in self.ancestors(node) + [node])
+
+    def node_table(self):
+        """Word, readability and metric counts of every node, keyed by path, as compact columns."""
+        return {
+            "paths": [self.path_key(node) for node in self.nodes],
+            "word_count": [node.word_count for node in self.nodes],
+            **{
+                name: [getattr(node.counts, name) for node in self.nodes]
+                for name in ("sentences", "words", "syllables", "polysyllables")
+            },
+            **{name: [node.metrics.get(name, 0) for node in self.nodes] for name in custom_metrics.COUNTS},
+        }
+
+    def get(self, type, identifier):
+        """All nodes of the given type and identifier, in document order."""
+        return [self.nodes[i] for i in self._by_key.get((type, str(identifier)), [])]
+
+    def find(self, reference):
+        """
+        Resolves a CFR reference (as found in `cfr_references`) to its node, or None.
+
+        The deepest level present in the reference is looked up directly; the other levels disambiguate candidates.
+        """
+        levels = [level for level in REFERENCE_LEVELS if reference.get(level) is not None]
+        if not levels:
+            return None
+
+        deepest = levels[-1]
+        for node in self.get(deepest, reference[deepest]):
+            path = self.path(node)
+            if all(path.get(level) == str(reference[level]) for level in levels):
+                return node
+        return None
+
+
+class _TitleIndexTarget:
+    def __init__(self, index, counts_store=None, segment=None):
+        self.index = index
+        self.counts_store = counts_store
+        self.segment = segment
+        self.offset = 0
+        self.open_nodes = []
+        self.open_divs = []
+        self.paragraphs = []
+        self.pending = []
+        # Text of the current segment, and of the search documents (see `utils.search`) being read, with the position
+        # in `document_parts` at which each starts.
+        self.segment_parts = []
+        self.document_parts = []
+        self.open_documents = []
+        # Segments waiting to be counted, as (fingerprint, text, enclosing node ids), and their characters.
+        self.batch = []
+        self.batch_chars = 0
+        # Counts of the distinct segments of the title counted so far, by fingerprint.
+        self.known = {}
+
+    def _flush(self):
+        if not self.pending:
+            return
+        text = "".join(self.pending)
+        self.pending = []
+        self.offset += len(text)
+        self.segment_parts.append(text)
+        if self.open_documents:
+            self.document_parts.append(text)
+        stripped = text.strip()
+        if stripped:
+            for paragraph in self.paragraphs:
+                paragraph.append(stripped)
+
+    def _close_segment(self):
+        # Readability and metric counts are taken per run of text between DIV boundaries and rolled up to every
+        # enclosing node, so each character of the title is tokenized and visited at most once. Segments are counted
+        # in batches, so their counts are looked up in the counts store together, and their text is then dropped.
+        if self.segment_parts:
+            text = normalize("".join(self.segment_parts))
+            self.segment_parts = []
+            if text:
+                self.batch.append((fingerprint(text), text, [node.id for node in self.open_nodes]))
+                self.batch_chars += len(text)
+                if self.batch_chars >= COUNT_BATCH_CHARS:
+                    self._count()
+
+    def _count(self):
+        """Counts and visits new segments of the batch not found in the counts store and rolls up their counts."""
+        new = {key: text for key, text, _ in self.batch if key not in self.known}
+        cached = self.counts_store.get_many(new) if self.counts_store is not None and new else {}
+        start = time.perf_counter()
+        counted = {}
+        for key, text in new.items():
+            if key not in cached:
+                counted[key] = (count_text(text), custom_metrics.visit(text))
+                self.index.tokenized_chars += len(text)
+        self.index.tokenize_seconds += time.perf_counter() - start
+        self.index.segments += len(new)
+        self.index.cached_segments += len(cached)
+        if self.counts_store is not None:
+            self.counts_store.put_many(counted)
+        for key, (counts, metric_counts) in (cached | counted).items():
+            self.known[key] = (counts, [(name, value) for name, value in metric_counts.items() if value])
+
+        for key, _, node_ids in self.batch:
+            counts, metric_counts = self.known[key]
+            for node_id in node_ids:
+                node = self.index.nodes[node_id]
+                node.counts += counts
+                for name, value in metric_counts:
+                    node.metrics[name] = node.metrics.get(name, 0) + value
+        self.batch = []
+        self.batch_chars = 0
+
+    def start(self, tag, attrib):
+        self._flush()
+        if tag in custom_metrics.ELEMENTS:
+            count = custom_metrics.ELEMENTS[tag]
+            for node in self.open_nodes:
+                node.metrics[count] = node.metrics.get(count, 0) + 1
+        if tag.startswith("DIV"):
+            self.open_divs.append("TYPE" in attrib)
+        if tag.startswith("DIV") and "TYPE" in attrib:
+            self._close_segment()
+            div_type = attrib["TYPE"]
+            node = HierarchyNode(
+                id=len(self.index.nodes),
+                type=DIV_TYPES.get(div_type, div_type.lower()),
+                identifier=attrib.get("N"),
+                parent=self.open_nodes[-1].id if self.open_nodes else None,
+                depth=len(self.open_nodes),
+                start=self.offset,
+            )
+            self.index._add(node)
+            self.open_nodes.append(node)
+            if self.segment is not None and node.type in self.segment.types:
+                self.open_documents.append((node, len(self.document_parts)))
+        elif tag == "P":
+            self.paragraphs.append([])
+
+    def end(self, tag):
+        self._flush()
+        if tag == "P":
+            word_count = len("".join(self.paragraphs.pop()).split())
+            for node in self.open_nodes:
+                node.word_count += word_count
+        elif tag.startswith("DIV") and self.open_divs.pop():
+            self._close_segment()
+            node = self.open_nodes.pop()
+            node.end = self.offset
+            node.last = len(self.index.nodes) - 1
+            if self.open_documents and self.open_documents[-1][0] is node:
+                _, start = self.open_documents.pop()
+                self.segment.add(self.index.path_key(node), "".join(self.document_parts[start:]))
+                if not self.open_documents:
+                    self.document_parts = []
+
+    def data(self, data):
+        self.pending.append(data)
+
+    def close(self):
+        self._flush()
+        self._close_segment()
+        self._count()
+
+
+def build_title_index(source, title=None, date=None, counts_store=None, segment=None):
+    """
+    Builds a `TitleIndex` from title XML given as a string, bytes, or an iterable of chunks.
+
+    With a `counts_store` (see `utils.fingerprints`), only text segments it does not hold yet are tokenized and visited
+    by the custom metrics (see `utils.custom_metrics`). With a `segment` (see `utils.search.SegmentWriter`), the text
+    of every node of a type it indexes is added to it as the node closes.
+
+    Only the text of the segments and documents being read is held, so memory does not grow with the size of the
+    title beyond its nodes and their counts.
+    """
+    index = TitleIndex(title, date)
+    parser = ET.XMLParser(target=_TitleIndexTarget(index, counts_store, segment))
+    for chunk in iter_chunks(source):
+        parser.feed(chunk)
+    parser.close()
+    return index
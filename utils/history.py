@@ -0,0 +1,76 @@
+"""
+Compact time series of word and readability counts over a Title's issue dates.
+
+A series is stored column-wise: `dates` plus one column per measure in `MEASURES`. Each row holds the totals in effect
+from that date until the next row, so series only need rows for dates on which something changed.
+"""
+import json
+import zlib
+
+import pandas as pd
+
+from utils.scoring import TextCounts, score_batch
+
+MEASURES = ["word_count", "sentences", "words", "syllables", "polysyllables"]
+
+# Redis key of a Title's time series and its Agencies' shares of it: {"title": series, "agencies": {slug: series}}.
+HISTORY_KEY = "history:title-{title}"
+# Increased every time a Title's history is saved, so readers know when to reload.
+HISTORY_VERSION_KEY = "history:version"
+
+
+def empty_series():
+    return {"dates": [], **{measure: [] for measure in MEASURES}}
+
+
+def append(series, date, totals):
+    """Appends `totals` (a list of values in `MEASURES` order) at `date`, replacing a row already at that date."""
+    if series["dates"] and series["dates"][-1] == date:
+        for measure in MEASURES:
+            series[measure].pop()
+        series["dates"].pop()
+    series["dates"].append(date)
+    for measure, value in zip(MEASURES, totals):
+        series[measure].append(value)
+
+
+def encode(data):
+    return zlib.compress(json.dumps(data, separators=(",", ":")).encode("utf-8"))
+
+
+def decode(data):
+    return json.loads(zlib.decompress(data))
+
+
+def to_frame(series):
+    """A DataFrame indexed by date with the counts and the readability scores computed from them."""
+    frame = pd.DataFrame({measure: series[measure] for measure in MEASURES}, index=pd.to_datetime(series["dates"]))
+    frame.index.name = "date"
+    if frame.empty:
+        return frame
+    counts = [TextCounts(*row) for row in frame[["sentences", "words", "syllables", "polysyllables"]].itertuples(
+        index=False)]
+    for name, values in score_batch(counts).items():
+        frame[name] = values
+    return frame
+
+
+def combine(series_list):
+    """
+    Adds up step series with different dates (e.g. one Agency's series from each Title).
+
+    Each series is carried forward to the union of all dates before summing.
+    """
+    frames = [
+        pd.DataFrame({measure: s[measure] for measure in MEASURES}, index=pd.to_datetime(s["dates"]))
+        for s in series_list if s["dates"]
+    ]
+    if not frames:
+        return empty_series()
+
+    dates = sorted(set().union(*(frame.index for frame in frames)))
+    total = sum(frame.reindex(dates).ffill().fillna(0) for frame in frames)
+    return {
+        "dates": [date.strftime("%Y-%m-%d") for date in dates],
+        **{measure: total[measure].astype(int).tolist() for measure in MEASURES},
+    }
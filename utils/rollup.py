@@ -0,0 +1,63 @@
+"""
+Overlap-aware aggregation of hierarchy node metrics.
+
+Metrics are computed once per hierarchy node and identified by path keys such as
+`title-40/chapter-I/subchapter-C/part-60` (see `TitleIndex.path_key`). A group of nodes (an Agency's references, an
+Agency together with its children, or any ad-hoc selection) is measured by keeping only nodes not already covered by
+an ancestor in the group and summing their counts, so nested or shared references are never double-counted.
+"""
+import json
+import zlib
+
+from utils import custom_metrics
+from utils.scoring import TextCounts
+
+
+def ancestors(path):
+    parts = path.split("/")
+    return ["/".join(parts[:i]) for i in range(1, len(parts))]
+
+
+def distinct_nodes(paths):
+    """The subset of `paths` not nested within another path of the set."""
+    paths = set(paths)
+    return {path for path in paths if not any(ancestor in paths for ancestor in ancestors(path))}
+
+
+def rollup(nodes):
+    """
+    Rolls up a mapping of path to `{"word_count": ..., "counts": {...}, "metrics": {...}}`.
+
+    Returns `(word_count, TextCounts, metric counts)` over the distinct covered nodes.
+    """
+    word_count = 0
+    counts = TextCounts()
+    metric_counts = dict.fromkeys(custom_metrics.COUNTS, 0)
+    for path in distinct_nodes(nodes):
+        word_count += nodes[path]["word_count"]
+        counts += TextCounts.from_dict(nodes[path]["counts"])
+        for name, value in nodes[path].get("metrics", {}).items():
+            metric_counts[name] = metric_counts.get(name, 0) + value
+    return word_count, counts, metric_counts
+
+
+def encode_node_table(table):
+    return zlib.compress(json.dumps(table, separators=(",", ":")).encode("utf-8"))
+
+
+def decode_node_paths(data):
+    """Decodes only the paths of a node table, in document order."""
+    return json.loads(zlib.decompress(data))["paths"]
+
+
+def decode_node_table(data):
+    """Decodes a node table into a mapping of path to `{"word_count": ..., "counts": {...}, "metrics": {...}}`."""
+    table = json.loads(zlib.decompress(data))
+    return {
+        path: {
+            "word_count": table["word_count"][i],
+            "counts": {name: table[name][i] for name in ("sentences", "words", "syllables", "polysyllables")},
+            "metrics": {name: table[name][i] for name in custom_metrics.COUNTS if name in table},
+        }
+        for i, path in enumerate(table["paths"])
+    }
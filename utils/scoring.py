@@ -0,0 +1,150 @@
+"""
+Readability scoring from mergeable text counts.
+
+Texts are reduced in one pass to sentence, word, syllable and polysyllable counts. Counts add up, so the score of any
+combination of texts (e.g., all references of an Agency) is computed from summed counts rather than by averaging
+scores. Scores for a batch of counts are computed together with NumPy.
+
+Tokenization, punctuation filtering and syllable counting follow py-readability-metrics, so for the same text:
+
+- Flesch-Kincaid Grade Level and Flesch Reading Ease match `Readability.flesch_kincaid()` and `Readability.flesch()`
+  exactly (up to floating point rounding).
+- SMOG matches `Readability.smog(all_sentences=True)` exactly. The library's default instead samples 30 sentences
+  (10 each from the start, middle and end of the text), so it differs from ours by that sampling error alone: about
+  1.2 grades on average (90th percentile 2.6) on long, heterogeneous English texts. Using every sentence is the more
+  stable estimate and is what makes SMOG mergeable across texts.
+
+When counts are rolled up from separately tokenized pieces of text (see `utils.hierarchy`), a sentence that spans two
+pieces is counted twice, which slightly lowers words per sentence compared to tokenizing the concatenated text.
+
+Texts with fewer than `MIN_WORDS` words get no scores, and SMOG is only computed for at least `MIN_SMOG_SENTENCES`
+sentences, mirroring the library's requirements without raising. Words are counted as the library counts them (tokens
+other than punctuation), so a text of exactly 100 words is scored, where the metrics job previously also required more
+than 100 whitespace-separated tokens.
+
+These tolerances are checked against the library in `tests/test_scoring.py`.
+"""
+import re
+
+import numpy as np
+
+from functools import lru_cache
+from nltk.tokenize import TweetTokenizer, sent_tokenize
+
+MIN_WORDS = 100
+MIN_SMOG_SENTENCES = 30
+
+_tokenizer = TweetTokenizer()
+_punctuation = re.compile(r"^[.,\/#!$%'\^&\*;:{}=\-_`~()]$")
+_silent_e = re.compile(r"(?:[^laeiouy]es|[^laeiouy]e)$")
+_vowel_groups = re.compile(r"[aeiouy]{1,2}")
+
+
+@lru_cache(maxsize=262144)
+def count_syllables(word):
+    word = word.lower()
+    if len(word) <= 3:
+        return 1
+    word = _silent_e.sub("", word)
+    if word.startswith("y"):
+        word = word[1:]
+    return len(_vowel_groups.findall(word))
+
+
+class TextCounts:
+    """Sentence, word, syllable and polysyllable (3+ syllables) counts of a text. Counts can be added together."""
+
+    __slots__ = ("sentences", "words", "syllables", "polysyllables")
+
+    def __init__(self, sentences=0, words=0, syllables=0, polysyllables=0):
+        self.sentences = sentences
+        self.words = words
+        self.syllables = syllables
+        self.polysyllables = polysyllables
+
+    def __add__(self, other):
+        return TextCounts(
+            self.sentences + other.sentences,
+            self.words + other.words,
+            self.syllables + other.syllables,
+            self.polysyllables + other.polysyllables,
+        )
+
+    def __iadd__(self, other):
+        self.sentences += other.sentences
+        self.words += other.words
+        self.syllables += other.syllables
+        self.polysyllables += other.polysyllables
+        return self
+
+    def __eq__(self, other):
+        return isinstance(other, TextCounts) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return f"TextCounts({self.to_dict()})"
+
+    def to_dict(self):
+        return {
+            "sentences": self.sentences,
+            "words": self.words,
+            "syllables": self.syllables,
+            "polysyllables": self.polysyllables,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["sentences"], data["words"], data["syllables"], data["polysyllables"])
+
+
+def count_text(text):
+    """Counts a text in a single tokenization pass."""
+    counts = TextCounts()
+    if not text or text.isspace():
+        return counts
+
+    for token in _tokenizer.tokenize(text):
+        if _punctuation.match(token):
+            continue
+        syllables = count_syllables(token)
+        counts.words += 1
+        counts.syllables += syllables
+        if syllables >= 3:
+            counts.polysyllables += 1
+
+    counts.sentences = len(sent_tokenize(text))
+    return counts
+
+
+def score_batch(counts):
+    """
+    Scores a batch of `TextCounts` at once.
+
+    Returns a mapping of `flesch_kincaid`, `flesch_reading_ease` and `smog` to float arrays, with NaN where a text is
+    too short to score.
+    """
+    sentences = np.array([c.sentences for c in counts], dtype=float)
+    words = np.array([c.words for c in counts], dtype=float)
+    syllables = np.array([c.syllables for c in counts], dtype=float)
+    polysyllables = np.array([c.polysyllables for c in counts], dtype=float)
+
+    scorable = (words >= MIN_WORDS) & (sentences > 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        words_per_sentence = np.where(scorable, words / sentences, np.nan)
+        syllables_per_word = np.where(scorable, syllables / words, np.nan)
+        smog = np.where(
+            scorable & (sentences >= MIN_SMOG_SENTENCES),
+            1.0430 * np.sqrt(30 * polysyllables / sentences) + 3.1291,
+            np.nan,
+        )
+
+    return {
+        "flesch_kincaid": 0.38 * words_per_sentence + 11.8 * syllables_per_word - 15.59,
+        "flesch_reading_ease": 206.835 - 1.015 * words_per_sentence - 84.6 * syllables_per_word,
+        "smog": smog,
+    }
+
+
+def score(counts):
+    """Scores a single `TextCounts`, with None for scores the text is too short for."""
+    scores = score_batch([counts])
+    return {name: None if np.isnan(values[0]) else float(values[0]) for name, values in scores.items()}
@@ -0,0 +1,392 @@
+"""
+On-disk inverted index over the section and appendix text of each Title.
+
+Every Title is a separate segment, rebuilt on its own whenever the Title's XML changes. A segment holds:
+
+- `docs.json`: the hierarchy path of each indexed section or appendix (its document id is its position).
+- `terms.bin` and `lexicon.bin`: the sorted vocabulary, and for each term the byte spans of the term and its postings.
+- `postings.bin`: for each term, a zlib-compressed block of little-endian uint32 values: the number of documents,
+  the delta-encoded document ids, the term frequency in each document and the delta-encoded word positions within
+  each document.
+
+Segments are written by a `SegmentWriter` while the Title is parsed, to `SEARCH_DIR/title-<N>/<digest>/`, and published
+by atomically replacing `title-<N>/CURRENT`. Readers memory-map the lexicon and postings, so a query only touches the
+pages of the terms it looks up. A segment built on another machine is copied with `read_title_segment` and
+`install_title_segment`.
+"""
+import heapq
+import itertools
+import json
+import logging
+import os
+import re
+import shutil
+import uuid
+import zlib
+
+import numpy as np
+
+from array import array
+from collections import defaultdict
+from utils.cache import CACHE_DIR
+
+SEARCH_DIR = os.getenv("ECFR_SEARCH_DIR", os.path.join(CACHE_DIR, "search"))
+DOCUMENT_TYPES = {"section", "appendix"}
+SEGMENT_FILES = ["docs.json", "terms.bin", "lexicon.bin", "postings.bin"]
+# Tokens buffered by a `SegmentWriter` before they are sorted and spilled to disk as a run.
+RUN_TOKENS = 512 * 1024
+
+_token = re.compile(r"[a-z0-9]+")
+_clause = re.compile(r'"([^"]*)"|(\S+)')
+
+
+def tokenize(text):
+    return _token.findall(text.lower())
+
+
+def parse_query(query):
+    """Splits a query into clauses: each quoted phrase is one clause, and so is every other term."""
+    clauses = []
+    for phrase, term in _clause.findall(query):
+        tokens = tokenize(phrase or term)
+        if tokens:
+            clauses.append(tokens)
+    return clauses
+
+
+def _mmap(path, dtype):
+    if os.path.getsize(path) == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r")
+
+
+class SegmentWriter:
+    """
+    Writes a Title's segment from the text of its sections and appendices, added in document order as they are parsed
+    (see `utils.hierarchy.build_title_index`).
+
+    Tokens are buffered and spilled to disk as runs of postings sorted by term every `RUN_TOKENS` tokens, and `publish`
+    merges the runs into the segment, so memory stays bounded however large the Title. Used as a context manager, it
+    removes its runs and anything left unpublished.
+    """
+
+    # Hierarchy node types indexed as documents.
+    types = DOCUMENT_TYPES
+
+    def __init__(self, title, date=None, directory=SEARCH_DIR):
+        self.title = title
+        self.date = date
+        self.title_directory = os.path.join(directory, f"title-{title}")
+        self.runs_directory = os.path.join(self.title_directory, f".{uuid.uuid4().hex}.runs")
+        self.docs = []
+        self.runs = 0
+        # An error spilling a run, raised by `publish` rather than interrupting the parse that adds documents.
+        self.error = None
+        self._reset()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        shutil.rmtree(self.runs_directory, ignore_errors=True)
+
+    def _reset(self):
+        # Terms get ids in order of first occurrence within a run.
+        self._term_ids = defaultdict(itertools.count().__next__)
+        self._terms_column = array("I")
+        self._lengths = []
+
+    def add(self, path, text):
+        """Adds the document with the given hierarchy path and text."""
+        if self.error is not None:
+            return
+        tokens = tokenize(text)
+        self.docs.append(path)
+        self._terms_column.extend(map(self._term_ids.__getitem__, tokens))
+        self._lengths.append(len(tokens))
+        if len(self._terms_column) >= RUN_TOKENS:
+            try:
+                self._spill()
+            except OSError as error:
+                self.error = error
+
+    def _spill(self):
+        """Writes the buffered postings as a run: its sorted terms and the documents, frequencies and positions."""
+        # Terms are numbered in sorted order, the order of the run and of the segment's lexicon.
+        terms = sorted(self._term_ids)
+        rank = np.empty(len(terms), dtype=np.uint32)
+        rank[[self._term_ids[term] for term in terms]] = np.arange(len(terms), dtype=np.uint32)
+
+        lengths = np.array(self._lengths, dtype=np.int64)
+        first_doc = len(self.docs) - len(lengths)
+        term = (
+            rank[np.frombuffer(self._terms_column, dtype=np.uint32)] if len(self._terms_column)
+            else np.empty(0, dtype=np.uint32)
+        )
+        self._reset()
+
+        # Tokens are generated in (document, position) order, so a stable sort by term alone orders the postings.
+        order = np.argsort(term, kind="stable")
+        term = term[order]
+        doc = np.repeat(np.arange(first_doc, first_doc + len(lengths), dtype=np.uint32), lengths)[order]
+        position = np.arange(len(order), dtype=np.uint32)
+        position -= np.repeat((np.cumsum(lengths) - lengths).astype(np.uint32), lengths)
+        position = position[order]
+        del order
+
+        new_doc = np.ones(len(term), dtype=bool)
+        new_doc[1:] = (term[1:] != term[:-1]) | (doc[1:] != doc[:-1])
+        pairs = np.flatnonzero(new_doc)
+        freqs = np.diff(np.append(pairs, len(term)))
+        # For each term, the span of its (term, document) pairs and of its positions.
+        bounds = np.searchsorted(term, np.arange(len(terms) + 1, dtype=np.uint32))
+        pair_bounds = np.searchsorted(pairs, bounds)
+
+        os.makedirs(self.runs_directory, exist_ok=True)
+        run = os.path.join(self.runs_directory, str(self.runs))
+        with open(f"{run}.terms", "w") as f:
+            f.writelines(f"{name}\n" for name in terms)
+        np.stack((pair_bounds, bounds), axis=1).astype("<u8").tofile(f"{run}.lexicon")
+        doc[pairs].astype("<u4").tofile(f"{run}.docs")
+        freqs.astype("<u4").tofile(f"{run}.freqs")
+        position.astype("<u4").tofile(f"{run}.positions")
+        self.runs += 1
+
+    def _run_terms(self, run):
+        with open(os.path.join(self.runs_directory, f"{run}.terms")) as f:
+            for i, line in enumerate(f):
+                yield line[:-1], run, i
+
+    def publish(self, digest):
+        """Merges the runs into the segment and publishes it as the Title's current segment."""
+        if self.error is not None:
+            raise self.error
+        if self._lengths or not self.runs:
+            self._spill()
+
+        runs = []
+        for i in range(self.runs):
+            run = os.path.join(self.runs_directory, str(i))
+            runs.append((
+                _mmap(f"{run}.lexicon", "<u8").reshape(-1, 2), _mmap(f"{run}.docs", "<u4"),
+                _mmap(f"{run}.freqs", "<u4"), _mmap(f"{run}.positions", "<u4"),
+            ))
+
+        tmp_directory = os.path.join(self.title_directory, f".{uuid.uuid4().hex}.tmp")
+        os.makedirs(tmp_directory)
+        lexicon = []
+        with open(os.path.join(tmp_directory, "terms.bin"), "wb") as terms_file, \
+                open(os.path.join(tmp_directory, "postings.bin"), "wb") as postings_file:
+            term_offset = postings_offset = 0
+            # Runs hold consecutive documents, so the postings of a term are those of each run in turn.
+            merged = heapq.merge(*(self._run_terms(i) for i in range(self.runs)))
+            for name, entries in itertools.groupby(merged, key=lambda entry: entry[0]):
+                docs, freqs, positions = [], [], []
+                for _, run, i in entries:
+                    run_lexicon, run_docs, run_freqs, run_positions = runs[run]
+                    (pair_start, start), (pair_end, end) = run_lexicon[i], run_lexicon[i + 1]
+                    docs.append(run_docs[pair_start:pair_end])
+                    freqs.append(run_freqs[pair_start:pair_end])
+                    positions.append(run_positions[start:end])
+                docs = np.concatenate(docs).astype(np.int64)
+                freqs = np.concatenate(freqs).astype(np.int64)
+                positions = np.concatenate(positions).astype(np.int64)
+
+                # Document ids are delta-encoded per term and positions per (term, document) pair.
+                doc_delta = np.diff(docs, prepend=0)
+                position_delta = np.diff(positions, prepend=0)
+                pair_starts = np.cumsum(freqs) - freqs
+                position_delta[pair_starts] = positions[pair_starts]
+
+                encoded = name.encode("utf-8")
+                terms_file.write(encoded)
+                block = zlib.compress(
+                    np.concatenate(([len(docs)], doc_delta, freqs, position_delta)).astype("<u4").tobytes(), 1
+                )
+                postings_file.write(block)
+
+                lexicon.append((term_offset, term_offset + len(encoded), postings_offset, postings_offset + len(block)))
+                term_offset += len(encoded)
+                postings_offset += len(block)
+        del runs
+        np.array(lexicon, dtype="<u8").reshape(-1, 4).tofile(os.path.join(tmp_directory, "lexicon.bin"))
+
+        with open(os.path.join(tmp_directory, "docs.json"), "w") as f:
+            json.dump({"title": self.title, "date": self.date, "digest": digest, "docs": self.docs}, f)
+
+        _publish_segment(self.title_directory, tmp_directory, digest)
+        shutil.rmtree(self.runs_directory, ignore_errors=True)
+        logging.info(f"Indexed Title {self.title}: {len(self.docs)} documents, {len(lexicon)} terms")
+
+
+def read_title_segment(title, digest, directory=SEARCH_DIR):
+    """The files of a Title's segment built from the XML with `digest`, by name, or None if there is no such segment."""
+    files = {}
+    try:
+        for name in SEGMENT_FILES:
+            with open(os.path.join(directory, f"title-{title}", digest, name), "rb") as f:
+                files[name] = f.read()
+    except FileNotFoundError:
+        return None
+    return files
+
+
+def install_title_segment(title, digest, files, directory=SEARCH_DIR):
+    """Publishes a segment read on another machine (see `read_title_segment`) as the Title's current segment."""
+    title_directory = os.path.join(directory, f"title-{title}")
+    tmp_directory = os.path.join(title_directory, f".{uuid.uuid4().hex}.tmp")
+    os.makedirs(tmp_directory)
+    for name in SEGMENT_FILES:
+        with open(os.path.join(tmp_directory, name), "wb") as f:
+            f.write(files[name])
+    _publish_segment(title_directory, tmp_directory, digest)
+    logging.info(f"Installed search index segment of Title {title}")
+
+
+def _publish_segment(title_directory, tmp_directory, digest):
+    """Moves a segment written to `tmp_directory` into place and makes it the Title's current segment."""
+    segment_directory = os.path.join(title_directory, digest)
+    if os.path.exists(segment_directory):
+        shutil.rmtree(tmp_directory)
+    else:
+        os.replace(tmp_directory, segment_directory)
+
+    tmp_current = os.path.join(title_directory, f".CURRENT.{uuid.uuid4().hex}.tmp")
+    with open(tmp_current, "w") as f:
+        f.write(digest)
+    os.replace(tmp_current, os.path.join(title_directory, "CURRENT"))
+
+    # Readers that still have an old segment mapped keep working; its files are unlinked, not truncated.
+    for name in os.listdir(title_directory):
+        if name not in (digest, "CURRENT") and not name.startswith("."):
+            shutil.rmtree(os.path.join(title_directory, name), ignore_errors=True)
+
+
+class TitleSegment:
+    """Read-only, memory-mapped view of one Title's segment."""
+
+    def __init__(self, path):
+        with open(os.path.join(path, "docs.json")) as f:
+            meta = json.load(f)
+        self.title = meta["title"]
+        self.date = meta["date"]
+        self.digest = meta["digest"]
+        self.docs = meta["docs"]
+        self._terms = _mmap(os.path.join(path, "terms.bin"), np.uint8)
+        self._lexicon = _mmap(os.path.join(path, "lexicon.bin"), "<u8").reshape(-1, 4)
+        self._postings = _mmap(os.path.join(path, "postings.bin"), np.uint8)
+
+    def _lookup(self, term):
+        encoded = term.encode("utf-8")
+        lo, hi = 0, len(self._lexicon)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start, end = self._lexicon[mid, :2]
+            if bytes(self._terms[start:end]) < encoded:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self._lexicon):
+            start, end = self._lexicon[lo, :2]
+            if bytes(self._terms[start:end]) == encoded:
+                return lo
+        return None
+
+    def postings(self, term):
+        """Document ids containing `term`, the term's frequency in each, and `(doc << 32) | position` of each hit."""
+        i = self._lookup(term)
+        if i is None:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, empty
+
+        start, end = self._lexicon[i, 2:]
+        values = np.frombuffer(zlib.decompress(bytes(self._postings[start:end])), dtype="<u4").astype(np.int64)
+        count = values[0]
+        doc_ids = np.cumsum(values[1:1 + count])
+        freqs = values[1 + count:1 + 2 * count]
+        deltas = values[1 + 2 * count:]
+
+        cumulative = np.cumsum(deltas)
+        starts = np.cumsum(freqs) - freqs
+        positions = cumulative - np.repeat(cumulative[starts] - deltas[starts], freqs)
+        return doc_ids, freqs, (np.repeat(doc_ids, freqs) << 32) | positions
+
+    def match(self, clause):
+        """Documents matching a clause (a term or a phrase of terms) and the number of matches in each."""
+        if len(clause) == 1:
+            doc_ids, freqs, _ = self.postings(clause[0])
+            return doc_ids, freqs
+
+        _, _, hits = self.postings(clause[0])
+        for offset, term in enumerate(clause[1:], start=1):
+            if len(hits) == 0:
+                break
+            hits = hits[np.isin(hits + offset, self.postings(term)[2])]
+        doc_ids, counts = np.unique(hits >> 32, return_counts=True)
+        return doc_ids, counts
+
+    def search(self, clauses):
+        """Documents matching every clause, with the total matches of all clauses in each."""
+        doc_ids, hits = None, None
+        for clause in clauses:
+            clause_docs, clause_hits = self.match(clause)
+            if doc_ids is None:
+                doc_ids, hits = clause_docs, clause_hits
+            else:
+                doc_ids, left, right = np.intersect1d(doc_ids, clause_docs, assume_unique=True, return_indices=True)
+                hits = hits[left] + clause_hits[right]
+            if len(doc_ids) == 0:
+                break
+        if doc_ids is None:
+            return [], []
+        return [self.docs[i] for i in doc_ids], hits.tolist()
+
+
+class SearchIndex:
+    """All current Title segments under `directory`. Segments are reopened when a Title is re-indexed."""
+
+    def __init__(self, directory=SEARCH_DIR):
+        self.directory = directory
+        self._segments = {}
+
+    def current(self, title):
+        """Digest of the Title XML its current segment was built from, or None."""
+        try:
+            with open(os.path.join(self.directory, f"title-{title}", "CURRENT")) as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def segments(self):
+        if not os.path.isdir(self.directory):
+            return []
+        segments = []
+        for name in sorted(os.listdir(self.directory)):
+            if not name.startswith("title-"):
+                continue
+            title = int(name.removeprefix("title-"))
+            digest = self.current(title)
+            if digest is None:
+                continue
+            cached = self._segments.get(title)
+            if cached is None or cached.digest != digest:
+                try:
+                    cached = self._segments[title] = TitleSegment(os.path.join(self.directory, name, digest))
+                except FileNotFoundError:
+                    continue
+            segments.append(cached)
+        return segments
+
+    def search(self, query):
+        """Rows of `(title, path, hits)` for every section or appendix matching the query."""
+        clauses = parse_query(query)
+        if not clauses:
+            return []
+        results = []
+        for segment in self.segments():
+            paths, hits = segment.search(clauses)
+            results.extend((segment.title, path, count) for path, count in zip(paths, hits))
+        return results
+
+
+search_index = SearchIndex()
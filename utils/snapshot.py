@@ -0,0 +1,101 @@
+"""
+Columnar snapshot of a metrics generation, published alongside it for the web application.
+
+The snapshot has two Parquet tables:
+
+- `agencies`: one row per Agency with its aggregate metrics and summed readability counts.
+- `references`: one row per Agency CFR reference, with the hierarchy levels as typed columns and the reference's
+  metrics.
+
+Both have a column for each custom metric in `utils.custom_metrics`. A third table, `corrections`, holds the number of
+corrections of each Agency by the date they were corrected (see `corrections.count_by_agency`).
+"""
+import io
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from utils.hierarchy import REFERENCE_LEVELS
+from utils.custom_metrics import VISITORS
+
+COUNTS = ["sentences", "words", "syllables", "polysyllables"]
+LEVELS = [level for level in REFERENCE_LEVELS if level != "title"]
+METRICS = [visitor.name for visitor in VISITORS]
+
+AGENCIES_SCHEMA = pa.schema(
+    [
+        ("slug", pa.string()),
+        ("total_word_count", pa.int64()),
+        ("average_flesch_kincaid", pa.float64()),
+        ("average_flesch_reading_ease", pa.float64()),
+        ("average_smog", pa.float64()),
+    ]
+    + [(metric, pa.float64()) for metric in METRICS]
+    + [(count, pa.int64()) for count in COUNTS]
+)
+
+REFERENCES_SCHEMA = pa.schema(
+    [("slug", pa.string()), ("title", pa.int32())]
+    + [(level, pa.string()) for level in LEVELS]
+    + [
+        ("node", pa.string()),
+        ("word_count", pa.int64()),
+        ("sentence_count", pa.int64()),
+        ("flesch_kincaid", pa.float64()),
+        ("flesch_reading_ease", pa.float64()),
+        ("smog", pa.float64()),
+    ]
+    + [(metric, pa.float64()) for metric in METRICS]
+)
+
+CORRECTIONS_SCHEMA = pa.schema([("slug", pa.string()), ("error_corrected", pa.date32()), ("count", pa.int64())])
+
+
+def build_tables(metrics):
+    """Builds the `agencies` and `references` tables from Agency metrics (slug to the metrics dict)."""
+    agencies = {name: [] for name in AGENCIES_SCHEMA.names}
+    references = {name: [] for name in REFERENCES_SCHEMA.names}
+
+    for slug, agency in metrics.items():
+        agencies["slug"].append(slug)
+        for name in ["total_word_count", "average_flesch_kincaid", "average_flesch_reading_ease", "average_smog",
+                     *METRICS]:
+            agencies[name].append(agency.get(name))
+        counts = agency.get("counts") or {}
+        for count in COUNTS:
+            agencies[count].append(counts.get(count))
+
+        for reference_data in agency.get("references", []):
+            reference = reference_data["reference"]
+            references["slug"].append(slug)
+            references["title"].append(reference["title"])
+            for level in LEVELS:
+                references[level].append(str(reference[level]) if reference.get(level) is not None else None)
+            for name in ["node", "word_count", "sentence_count", "flesch_kincaid", "flesch_reading_ease", "smog",
+                         *METRICS]:
+                references[name].append(reference_data.get(name))
+
+    return {
+        "agencies": pa.table(agencies, schema=AGENCIES_SCHEMA),
+        "references": pa.table(references, schema=REFERENCES_SCHEMA),
+    }
+
+
+def build_corrections_table(counts):
+    """Builds the `corrections` table from a DataFrame of daily correction counts per Agency."""
+    return pa.Table.from_pandas(counts, schema=CORRECTIONS_SCHEMA, preserve_index=False)
+
+
+def encode(tables):
+    """Serializes each table to Parquet bytes."""
+    encoded = {}
+    for name, table in tables.items():
+        buffer = io.BytesIO()
+        pq.write_table(table, buffer, compression="zstd")
+        encoded[name] = buffer.getvalue()
+    return encoded
+
+
+def decode(data):
+    """Reads Parquet bytes back into a DataFrame."""
+    return pq.read_table(pa.BufferReader(data)).to_pandas()
@@ -0,0 +1,20 @@
+# Hierarchy levels in the order they nest within eCFR source XML, with the element used for each.
+HIERARCHY_ELEMENTS = [
+    ("title", "DIV1", "TITLE"),
+    ("subtitle", "DIV2", "SUBTITLE"),
+    ("chapter", "DIV3", "CHAPTER"),
+    ("subchapter", "DIV4", "SUBCHAP"),
+    ("part", "DIV5", "PART"),
+    ("section", "DIV8", "SECTION"),
+]
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def iter_chunks(source):
+    if isinstance(source, (str, bytes)):
+        for i in range(0, len(source), CHUNK_SIZE):
+            yield source[i:i + CHUNK_SIZE]
+    else:
+        yield from source
+
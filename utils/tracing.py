@@ -0,0 +1,163 @@
+"""
+Timing spans and run reports for the metrics job.
+
+A `Tracer` records a span for each stage of the work on a Title, reference or Agency (see `STAGES`) with its duration,
+the bytes and the number of elements it handled. Spans recorded in worker processes are returned to the parent and
+merged with `extend`. At the end of a run, `build_report` summarizes the spans into a JSON-serializable report that is
+kept in Redis (see `save_report`) for the Runs page.
+"""
+import json
+import os
+import time
+
+import numpy as np
+
+from contextlib import contextmanager
+
+STAGES = ["fetch", "parse", "tokenize", "extract", "score", "store"]
+# Stages that the slowest Titles and references are ranked by. Lookups (`extract`) take microseconds, and storing
+# results does not depend on the Title's content.
+WORK_STAGES = ["fetch", "parse", "tokenize", "score"]
+
+# The newest reports, most recent first.
+RUN_REPORTS_KEY = "metrics:runs"
+# Increased every time a report is saved, so readers know when to reload.
+RUN_REPORTS_VERSION_KEY = "metrics:runs:version"
+RUN_REPORT_RETENTION = int(os.getenv("METRICS_RUN_REPORT_RETENTION", 30))
+SLOWEST_COUNT = 10
+
+
+class Tracer:
+    def __init__(self):
+        self.spans = []
+        self.caches = {}
+
+    @contextmanager
+    def span(self, stage, **attributes):
+        """
+        Times the enclosed block as a span of `stage`. Yields the span so the block can set `bytes` and `elements`.
+
+        Attributes identify what the span worked on, e.g. `title`, `reference` or `agency`.
+        """
+        span = {"stage": stage, "bytes": None, "elements": None, **attributes}
+        start = time.perf_counter()
+        try:
+            yield span
+        except BaseException:
+            span["failed"] = True
+            raise
+        finally:
+            span["seconds"] = time.perf_counter() - start
+            self.spans.append(span)
+
+    def record(self, stage, seconds, bytes=None, elements=None, **attributes):
+        """Records a span timed elsewhere."""
+        self.spans.append({"stage": stage, "seconds": seconds, "bytes": bytes, "elements": elements, **attributes})
+
+    def extend(self, spans):
+        self.spans.extend(spans)
+
+    def cache(self, name, hit, count=1):
+        """Counts `count` hits or misses of a cache."""
+        stats = self.caches.setdefault(name, {"hits": 0, "misses": 0})
+        stats["hits" if hit else "misses"] += count
+
+
+def _sum(values):
+    values = [v for v in values if v is not None]
+    return sum(values) if values else None
+
+
+def summarize_stages(spans):
+    """Count, total, p50, p95 and max duration, and total bytes and elements of each stage."""
+    stages = {}
+    for stage in STAGES + sorted({s["stage"] for s in spans} - set(STAGES)):
+        stage_spans = [s for s in spans if s["stage"] == stage]
+        if not stage_spans:
+            continue
+        seconds = np.array([s["seconds"] for s in stage_spans])
+        stages[stage] = {
+            "count": len(stage_spans),
+            "total_seconds": float(seconds.sum()),
+            "p50_seconds": float(np.percentile(seconds, 50)),
+            "p95_seconds": float(np.percentile(seconds, 95)),
+            "max_seconds": float(seconds.max()),
+            "bytes": _sum(s["bytes"] for s in stage_spans),
+            "elements": _sum(s["elements"] for s in stage_spans),
+            "failed": sum(1 for s in stage_spans if s.get("failed")),
+        }
+    return stages
+
+
+def slowest(spans, attribute, count=SLOWEST_COUNT, stages=WORK_STAGES):
+    """
+    The `count` values of `attribute` (e.g. `title`) whose spans of `stages` took longest in total, with time per
+    stage.
+    """
+    totals = {}
+    for span in spans:
+        value = span.get(attribute)
+        if value is None or span["stage"] not in stages:
+            continue
+        entry = totals.setdefault(value, {attribute: value, "seconds": 0.0, "stages": {}})
+        entry["seconds"] += span["seconds"]
+        entry["stages"][span["stage"]] = entry["stages"].get(span["stage"], 0.0) + span["seconds"]
+    return sorted(totals.values(), key=lambda entry: entry["seconds"], reverse=True)[:count]
+
+
+def slowest_references(spans, count=SLOWEST_COUNT, stages=WORK_STAGES):
+    """
+    The `count` references whose share of their Title's work took longest, with time per stage.
+
+    A reference is looked up in its Title's index in microseconds, so the time of each Title's spans of `stages` is
+    shared among the references looked up in it, in proportion to the words of their nodes.
+    """
+    words = {}
+    for span in spans:
+        if span["stage"] == "extract" and span.get("reference") is not None:
+            words.setdefault(span["title"], {})[span["reference"]] = span["elements"] or 0
+    titles = {entry["title"]: entry["stages"] for entry in slowest(spans, "title", count=None, stages=stages)
+              if entry["title"] in words}
+
+    entries = []
+    for title, title_stages in titles.items():
+        title_words = sum(words[title].values())
+        for reference, reference_words in words[title].items():
+            share = reference_words / title_words if title_words else 1 / len(words[title])
+            reference_stages = {stage: seconds * share for stage, seconds in title_stages.items()}
+            entries.append({"reference": reference, "seconds": sum(reference_stages.values()),
+                            "stages": reference_stages})
+    return sorted(entries, key=lambda entry: entry["seconds"], reverse=True)[:count]
+
+
+def build_report(tracer, started, finished, **details):
+    """A run report of the tracer's spans and cache counts. `details` (e.g. the generation) are included as is."""
+    caches = {
+        name: {**stats, "hit_rate": stats["hits"] / (stats["hits"] + stats["misses"])
+               if stats["hits"] + stats["misses"] else None}
+        for name, stats in tracer.caches.items()
+    }
+    return {
+        "started": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(started)),
+        "finished": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(finished)),
+        "seconds": finished - started,
+        **details,
+        "stages": summarize_stages(tracer.spans),
+        "slowest_titles": slowest(tracer.spans, "title"),
+        "slowest_references": slowest_references(tracer.spans),
+        "caches": caches,
+    }
+
+
+def save_report(r, report, retain=RUN_REPORT_RETENTION):
+    """Adds a report to the newest run reports, dropping the oldest beyond `retain`."""
+    pipe = r.pipeline()
+    pipe.lpush(RUN_REPORTS_KEY, json.dumps(report))
+    pipe.ltrim(RUN_REPORTS_KEY, 0, retain - 1)
+    pipe.incr(RUN_REPORTS_VERSION_KEY)
+    pipe.execute()
+
+
+def read_reports(r, count=RUN_REPORT_RETENTION):
+    """The newest run reports, most recent first."""
+    return [json.loads(report) for report in r.lrange(RUN_REPORTS_KEY, 0, count - 1)]
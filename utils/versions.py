@@ -0,0 +1,191 @@
+import json
+import logging
+import os
+import sqlite3
+
+import natsort
+import pandas as pd
+
+from contextlib import contextmanager
+from utils import ecfr
+from utils.cache import CACHE_DIR
+
+COLUMNS = [
+    "identifier", "name", "part", "subpart", "type", "amendment_date", "issue_date", "substantive", "removed",
+]
+
+
+class VersionIndex:
+    """
+    Local index of the eCFR content versions of each Title.
+
+    `sync` fetches only versions issued since the last sync of a Title and re-ranks its versions in natural order of
+    identifier (then issue date), so pages of versions are read in order straight from an index. The number of sections
+    and appendices, the parts and the issue date range of each Title are kept alongside.
+    """
+
+    def __init__(self, directory=CACHE_DIR):
+        self.directory = directory
+        self._initialized = False
+
+    @contextmanager
+    def _connect(self):
+        if not self._initialized:
+            os.makedirs(self.directory, exist_ok=True)
+        conn = sqlite3.connect(os.path.join(self.directory, "versions.sqlite"), timeout=60)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS versions (title INTEGER NOT NULL, identifier TEXT NOT NULL, "
+                "issue_date TEXT NOT NULL, amendment_date TEXT, name TEXT, part TEXT, subpart TEXT, type TEXT, "
+                "substantive INTEGER, removed INTEGER, position INTEGER, PRIMARY KEY (title, identifier, issue_date))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS versions_position ON versions (title, position)")
+            conn.execute("CREATE INDEX IF NOT EXISTS versions_part ON versions (title, part, position)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS titles (title INTEGER PRIMARY KEY, synced_issue_date TEXT, "
+                "first_issue_date TEXT, latest_issue_date TEXT, latest_amendment_date TEXT, versions INTEGER, "
+                "sections INTEGER, appendices INTEGER, parts TEXT)"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            conn.commit()
+            self._initialized = True
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def version(self):
+        """Increases every time a sync changes the index, for use as a cache key."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return int(row[0]) if row else 0
+
+    def sync(self, title, latest_issue_date=None):
+        """
+        Brings the versions of a Title up to date with the eCFR. Returns the index version, or None if the fetch failed.
+
+        If `latest_issue_date` (from the Titles list) is given and the Title was already synced against that date,
+        nothing is fetched. It is stored as the synced date even if no version was issued on it, which is common.
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT synced_issue_date, latest_issue_date FROM titles WHERE title = ?", (title,)
+            ).fetchone()
+        synced, newest = row if row else (None, None)
+        if synced is not None and latest_issue_date is not None and synced >= latest_issue_date:
+            return self.version()
+
+        # Versions issued on the newest issue date in the index are fetched again, in case that issue was incomplete.
+        data = ecfr.fetch_versions_for_title(title, gte=newest)
+        if data is None:
+            return None
+        versions = data["content_versions"]
+
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT INTO versions (title, identifier, issue_date, amendment_date, name, part, subpart, type, "
+                "substantive, removed) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (title, identifier, issue_date) DO UPDATE SET amendment_date = excluded.amendment_date, "
+                "name = excluded.name, part = excluded.part, subpart = excluded.subpart, type = excluded.type, "
+                "substantive = excluded.substantive, removed = excluded.removed",
+                [
+                    (
+                        title, v["identifier"], v["issue_date"], v.get("amendment_date"), v.get("name"), v.get("part"),
+                        v.get("subpart"), v.get("type"), v.get("substantive"), v.get("removed"),
+                    )
+                    for v in versions
+                ],
+            )
+            self._rank(conn, title, latest_issue_date or synced)
+            conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('version', 1) "
+                "ON CONFLICT (key) DO UPDATE SET value = value + 1"
+            )
+        logging.info(f"Synced {len(versions)} Content Versions of Title {title} issued since {newest or 'the start'}")
+        return self.version()
+
+    @staticmethod
+    def _rank(conn, title, synced_issue_date=None):
+        """
+        Stores each version's position in natural order, and the Title's summary along with the issue date it was
+        synced against (the newest version's, if later or not given).
+        """
+        rows = conn.execute(
+            "SELECT rowid, identifier, issue_date, part, type, amendment_date FROM versions WHERE title = ?", (title,)
+        ).fetchall()
+        ordered = natsort.natsorted(rows, key=lambda row: (row[1], row[2]))
+        conn.executemany(
+            "UPDATE versions SET position = ? WHERE rowid = ?", [(i, row[0]) for i, row in enumerate(ordered)]
+        )
+
+        issue_dates = [row[2] for row in rows]
+        amendment_dates = [row[5] for row in rows if row[5]]
+        synced_issue_date = max(filter(None, [synced_issue_date, max(issue_dates, default=None)]), default=None)
+        conn.execute(
+            "INSERT OR REPLACE INTO titles (title, synced_issue_date, first_issue_date, latest_issue_date, "
+            "latest_amendment_date, versions, sections, appendices, parts) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                title, synced_issue_date, min(issue_dates, default=None), max(issue_dates, default=None),
+                max(amendment_dates, default=None), len(rows), sum(1 for row in rows if row[4] == "section"),
+                sum(1 for row in rows if row[4] == "appendix"),
+                json.dumps(natsort.natsorted({row[3] for row in rows if row[3]})),
+            ),
+        )
+
+    def summary(self, title):
+        """Issue date range, latest amendment date, counts and parts of a synced Title, or None."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT first_issue_date, latest_issue_date, latest_amendment_date, versions, sections, appendices, "
+                "parts FROM titles WHERE title = ?",
+                (title,),
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "first_issue_date": row[0],
+            "latest_issue_date": row[1],
+            "latest_amendment_date": row[2],
+            "versions": row[3],
+            "sections": row[4],
+            "appendices": row[5],
+            "parts": json.loads(row[6]),
+        }
+
+    @staticmethod
+    def _where(title, start, end, part):
+        clauses, params = ["title = ?"], [title]
+        if start is not None:
+            clauses.append("issue_date >= ?")
+            params.append(start)
+        if end is not None:
+            clauses.append("issue_date <= ?")
+            params.append(end)
+        if part is not None:
+            clauses.append("part = ?")
+            params.append(part)
+        return " AND ".join(clauses), params
+
+    def counts(self, title, start=None, end=None, part=None):
+        """Number of versions of each type (e.g. `section`) issued between `start` and `end` in `part`."""
+        where, params = self._where(title, start, end, part)
+        with self._connect() as conn:
+            return dict(conn.execute(f"SELECT type, COUNT(*) FROM versions WHERE {where} GROUP BY type", params))
+
+    def page(self, title, offset=0, limit=100, start=None, end=None, part=None):
+        """A page of versions in natural order of identifier, filtered as in `counts`."""
+        where, params = self._where(title, start, end, part)
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM versions WHERE {where} ORDER BY position LIMIT ? OFFSET ?",
+                params + [limit, offset],
+            ).fetchall()
+        versions = pd.DataFrame(rows, columns=COLUMNS)
+        for col in ["substantive", "removed"]:
+            versions[col] = versions[col].astype(bool)
+        return versions
+
+
+version_index = VersionIndex()
@@ -0,0 +1,236 @@
+"""
+Redis-backed work queue with leases, so any number of worker processes (on any machine) can share one run.
+
+A run is a fixed set of jobs, each a JSON payload under a string id. Workers `claim` jobs by atomically moving their
+ids from the pending list to the processing list, and hold a lease on each claimed job that they renew with
+`heartbeat` while working. Results are checkpointed with `complete` as each job finishes. `requeue_expired` returns
+jobs whose lease ran out (e.g. because their worker died) to the pending list, and a job that failed `max_attempts`
+times is set aside as failed. Because the whole run lives in Redis, a restarted coordinator resumes it where it stopped.
+
+Only plain Redis commands and optimistic transactions are used (no Lua), so the queue also runs against fakeredis.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+
+import redis
+
+LEASE_SECONDS = int(os.getenv("METRICS_QUEUE_LEASE_SECONDS", 300))
+MAX_ATTEMPTS = int(os.getenv("METRICS_QUEUE_MAX_ATTEMPTS", 3))
+
+
+class WorkQueue:
+    def __init__(self, r, name, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+        self.r = r
+        self.name = name
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    def _key(self, part):
+        return f"queue:{self.name}:{part}"
+
+    @property
+    def _keys(self):
+        return [self._key(part) for part in
+                ("run", "jobs", "pending", "processing", "leases", "owners", "attempts", "results", "failed")]
+
+    def active(self):
+        """Metadata of the run in progress (`id`, `total` and `started`), or None."""
+        run = self.r.get(self._key("run"))
+        return json.loads(run) if run is not None else None
+
+    def start(self, jobs, results=None, **metadata):
+        """
+        Replaces any run in progress with a new run of `jobs` (id to JSON-serializable payload).
+
+        `results` are serialized results of jobs that are already complete (e.g. carried over from an interrupted run),
+        which are not queued again.
+        """
+        results = {job_id: result for job_id, result in (results or {}).items() if job_id in jobs}
+        run = {"id": uuid.uuid4().hex[:12], "total": len(jobs), "started": time.time(), **metadata}
+        pending = [job_id for job_id in jobs if job_id not in results]
+        pipe = self.r.pipeline()
+        pipe.delete(*self._keys)
+        if jobs:
+            pipe.hset(self._key("jobs"), mapping={job_id: json.dumps(payload) for job_id, payload in jobs.items()})
+        if pending:
+            pipe.rpush(self._key("pending"), *pending)
+        if results:
+            pipe.hset(self._key("results"), mapping=results)
+        pipe.set(self._key("run"), json.dumps(run))
+        pipe.execute()
+        return run
+
+    def clear(self):
+        self.r.delete(*self._keys)
+
+    def jobs(self):
+        return {job_id.decode(): json.loads(payload) for job_id, payload in self.r.hgetall(self._key("jobs")).items()}
+
+    def claim(self, worker):
+        """
+        Claims the next pending job for `worker` and returns `(job_id, payload)`, or None if nothing is pending.
+
+        Jobs that already have a result (completed by a worker whose lease had expired) are skipped.
+        """
+        while True:
+            job_id = self.r.lmove(self._key("pending"), self._key("processing"), "LEFT", "RIGHT")
+            if job_id is None:
+                return None
+            job_id = job_id.decode()
+
+            pipe = self.r.pipeline()
+            pipe.zadd(self._key("leases"), {job_id: time.time() + self.lease_seconds})
+            pipe.hset(self._key("owners"), job_id, worker)
+            pipe.hincrby(self._key("attempts"), job_id, 1)
+            pipe.hexists(self._key("results"), job_id)
+            pipe.hget(self._key("jobs"), job_id)
+            _, _, attempts, completed, payload = pipe.execute()
+
+            if completed or payload is None:
+                self._release(job_id)
+            elif attempts > self.max_attempts:
+                self._release(job_id, failed="exceeded the maximum number of attempts")
+            else:
+                return job_id, json.loads(payload)
+
+    def _release(self, job_id, result=None, failed=None, requeue=False, pipe=None):
+        execute = pipe is None
+        pipe = self.r.pipeline() if pipe is None else pipe
+        pipe.lrem(self._key("processing"), 0, job_id)
+        pipe.zrem(self._key("leases"), job_id)
+        pipe.hdel(self._key("owners"), job_id)
+        if result is not None:
+            pipe.hset(self._key("results"), job_id, result)
+        if failed is not None:
+            pipe.hset(self._key("failed"), job_id, failed)
+        if requeue:
+            pipe.rpush(self._key("pending"), job_id)
+        if execute:
+            pipe.execute()
+
+    def _owned(self, job_id, worker, action):
+        """Runs `action(pipe)` in a transaction if `worker` still holds the job. Returns whether it did."""
+        with self.r.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(self._key("owners"))
+                    owner = pipe.hget(self._key("owners"), job_id)
+                    if owner is None or owner.decode() != worker:
+                        pipe.unwatch()
+                        return False
+                    pipe.multi()
+                    action(pipe)
+                    pipe.execute()
+                    return True
+                except redis.WatchError:
+                    continue
+
+    def heartbeat(self, job_id, worker):
+        """Renews the lease on a job. Returns False if the job is no longer leased to `worker`."""
+        return self._owned(
+            job_id, worker,
+            lambda pipe: pipe.zadd(self._key("leases"), {job_id: time.time() + self.lease_seconds}, xx=True),
+        )
+
+    def complete(self, job_id, worker, result):
+        """Checkpoints a job's serialized result. Results are kept even if the lease expired, as jobs are idempotent."""
+        self._release(job_id, result=result)
+
+    def fail(self, job_id, worker, error):
+        """
+        Returns a failed job to the pending list, or sets it aside once it has used all its attempts.
+
+        Does nothing if the job has meanwhile been leased to another worker.
+        """
+        attempts = int(self.r.hget(self._key("attempts"), job_id) or 0)
+        if attempts >= self.max_attempts:
+            self._owned(job_id, worker, lambda pipe: self._release(job_id, failed=error, pipe=pipe))
+        else:
+            self._owned(job_id, worker, lambda pipe: self._release(job_id, requeue=True, pipe=pipe))
+
+    def requeue_expired(self):
+        """Returns jobs whose lease has expired to the pending list. Returns their ids."""
+        requeued = []
+        now = time.time()
+        for job_id in self.r.lrange(self._key("processing"), 0, -1):
+            job_id = job_id.decode()
+            with self.r.pipeline() as pipe:
+                try:
+                    pipe.watch(self._key("leases"), self._key("owners"))
+                    expires = pipe.zscore(self._key("leases"), job_id)
+                    if expires is None:
+                        # Claimed but not yet leased; the worker may still be between the two steps of `claim`.
+                        pipe.multi()
+                        pipe.zadd(self._key("leases"), {job_id: now + self.lease_seconds}, nx=True)
+                        pipe.execute()
+                        continue
+                    if expires > now:
+                        pipe.unwatch()
+                        continue
+                    pipe.multi()
+                    pipe.lrem(self._key("processing"), 0, job_id)
+                    pipe.zrem(self._key("leases"), job_id)
+                    pipe.hdel(self._key("owners"), job_id)
+                    pipe.rpush(self._key("pending"), job_id)
+                    pipe.execute()
+                    requeued.append(job_id)
+                except redis.WatchError:
+                    # A heartbeat renewed the lease concurrently; the job is checked again on the next call.
+                    continue
+        return requeued
+
+    def progress(self):
+        pipe = self.r.pipeline()
+        pipe.hlen(self._key("jobs"))
+        pipe.hlen(self._key("results"))
+        pipe.hlen(self._key("failed"))
+        pipe.llen(self._key("pending"))
+        pipe.llen(self._key("processing"))
+        total, completed, failed, pending, processing = pipe.execute()
+        return {"total": total, "completed": completed, "failed": failed, "pending": pending,
+                "processing": processing}
+
+    def done(self):
+        progress = self.progress()
+        return progress["completed"] + progress["failed"] >= progress["total"]
+
+    def results(self):
+        return {job_id.decode(): result for job_id, result in self.r.hgetall(self._key("results")).items()}
+
+    def failures(self):
+        return {job_id.decode(): error.decode() for job_id, error in self.r.hgetall(self._key("failed")).items()}
+
+    def lease(self, job_id, worker):
+        """A context manager that renews the lease on a job in the background while the block runs."""
+        return _Lease(self, job_id, worker)
+
+
+class _Lease:
+    def __init__(self, queue, job_id, worker):
+        self.queue = queue
+        self.job_id = job_id
+        self.worker = worker
+        self.lost = threading.Event()
+        self._stop = threading.Event()
+
+    def _renew(self):
+        while not self._stop.wait(self.queue.lease_seconds / 3):
+            try:
+                if not self.queue.heartbeat(self.job_id, self.worker):
+                    self.lost.set()
+                    return
+            except redis.RedisError:
+                # The lease is renewed on the next beat; if Redis stays unreachable the job is requeued elsewhere.
+                continue
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._renew, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()